@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BasicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'basic'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registers the signal receivers)
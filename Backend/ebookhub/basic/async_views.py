@@ -0,0 +1,103 @@
+"""
+Async-native variants of hot read endpoints, for the ASGI stack.
+
+Under ASGI a DRF `APIView` runs through `sync_to_async`, on a thread of
+its own per request. The views here are plain `async def` Django views:
+they query through the async ORM and the async cache API and serialize
+with the same DRF serializers, on objects loaded up front, so the
+event loop only leaves for the database. Their payloads match the sync
+endpoints they mirror, which stay the default; the async ones are served
+under `async/` next to them.
+
+Lazy relation loads are not allowed in async code, so every serializer
+used here must find its relations prefetched; Django raises
+SynchronousOnlyOperation when one is missed.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import Author, Genre
+from .serializers import AuthorSerializer, GenreSerializer, UserSerializer
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    """Renders `data` the way DRF's JSONRenderer renders the sync views' responses."""
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def error_response(request, exc):
+    """The response DRF gives for an APIException such as NotAuthenticated."""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = json_response(data, exc.status_code)
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        if authenticators:
+            response.headers['WWW-Authenticate'] = authenticators[0]().authenticate_header(request)
+    return response
+
+
+async def authenticate(request):
+    """
+    Runs the configured DRF authentication classes, as every DRF view does
+    before its handler, and returns the user (AnonymousUser without
+    credentials); raises AuthenticationFailed on bad ones. DRF's
+    authenticators are sync, so a request carrying credentials costs one
+    hop to a thread.
+    """
+    authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    if (not request.headers.get('Authorization') and not hasattr(request, '_force_auth_user')
+            and all(issubclass(auth, JWTAuthentication) for auth in authenticators)):
+        # Token authentication without a token: nothing to look up
+        return AnonymousUser()
+    drf_request = Request(request, authenticators=[auth() for auth in authenticators])
+    return await sync_to_async(lambda: drf_request.user)()
+
+
+async def require_user(request):
+    """`authenticate`, raising NotAuthenticated for anonymous requests."""
+    user = await authenticate(request)
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
+
+
+async def author_detail(request, id):
+    try:
+        await authenticate(request)
+    except APIException as exc:
+        return error_response(request, exc)
+    author = await Author.objects.filter(id=id).afirst()
+    if author is None:
+        return json_response({'error': 'Author not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(AuthorSerializer(author).data)
+
+
+async def publisher_detail(request, id):
+    try:
+        await authenticate(request)
+    except APIException as exc:
+        return error_response(request, exc)
+    # The serializer renders every field, groups and permissions included
+    publisher = await User.objects.prefetch_related('groups', 'user_permissions').filter(id=id).afirst()
+    if publisher is None:
+        return json_response({'error': 'Publisher not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(UserSerializer(publisher).data)
+
+
+async def genre_detail(request, id):
+    try:
+        await authenticate(request)
+    except APIException as exc:
+        return error_response(request, exc)
+    genre = await Genre.objects.filter(id=id).afirst()
+    if genre is None:
+        return json_response({'error': 'Genre not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(GenreSerializer(genre).data)
+
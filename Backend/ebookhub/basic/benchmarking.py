@@ -0,0 +1,203 @@
+"""
+Helpers shared by the benchmark management commands: a throwaway database
+and a synthetic catalog to run requests against.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import URLPattern, get_resolver
+
+from .forks import fork_book
+from .models import Author, Book, Chapter, Genre, SupportedFormat
+
+
+@contextmanager
+def scratch_database(verbosity=0, name=None):
+    """
+    Creates a fresh test database for the default alias, migrates it and
+    destroys it on exit, so benchmarks never touch the development data.
+    Replicas are switched off meanwhile; they would still be the real ones.
+
+    SQLite test databases live in memory unless `name` gives them a file.
+    Connections to an in-memory database share one cache, where a blocked
+    writer fails instead of waiting, so interaction writes and reading
+    positions are not handed to background writer threads there.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if name is not None:
+        test_settings['NAME'] = name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    overrides = {'DATABASE_REPLICAS': []}
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        overrides['INTERACTION_WRITE_COALESCING'] = False
+        overrides['READING_PROGRESS_BUFFERING'] = False
+    try:
+        with override_settings(**overrides):
+            yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        test_settings['NAME'] = old_test_name
+
+
+def seed_catalog(books=100, chapters_per_book=20, genres_per_book=2, authors=None,
+                 chapter_words=200, batch_size=1000, seed=0):
+    """
+    Bulk-inserts a synthetic catalog and returns the publisher user.
+    """
+    rng = random.Random(seed)
+    publisher, _ = User.objects.get_or_create(username='bench-publisher', defaults={'email': 'bench@example.com'})
+    book_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+
+    genres = Genre.objects.bulk_create([Genre(name=f'Genre {i}') for i in range(20)])
+    author_objs = Author.objects.bulk_create(
+        [Author(name=f'Author {i}') for i in range(authors or max(1, books // 10))],
+        batch_size=batch_size,
+    )
+
+    book_objs = Book.objects.bulk_create(
+        [
+            Book(
+                title=f'Book {i}',
+                author=rng.choice(author_objs),
+                publisher=publisher,
+                description=f'Synthetic book number {i}.',
+                date_published=date(2024, 1, 1),
+                format=book_format,
+            )
+            for i in range(books)
+        ],
+        batch_size=batch_size,
+    )
+
+    Through = Book.genre.through
+    Through.objects.bulk_create(
+        [
+            Through(book_id=book.id, genre_id=genre.id)
+            for book in book_objs
+            for genre in rng.sample(genres, min(genres_per_book, len(genres)))
+        ],
+        batch_size=batch_size,
+    )
+
+    words = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'reader', 'chapter', 'night', 'river', 'letter')
+    pending = []
+    for book in book_objs:
+        for number in range(1, chapters_per_book + 1):
+            content = ' '.join(rng.choice(words) for _ in range(chapter_words))
+            pending.append(Chapter(
+                book=book,
+                chapter_title=f'Chapter {number}',
+                content=content,
+                chapter_number=number,
+            ))
+            if len(pending) >= batch_size:
+                Chapter.objects.bulk_create(pending)
+                pending = []
+    if pending:
+        Chapter.objects.bulk_create(pending)
+
+    return publisher
+
+
+def seed_interactions(readers=100, per_reader=20, comments_per_reader=5, likes_per_reader=10,
+                      forks=20, batch_size=1000, seed=0):
+    """
+    Bulk-inserts reader accounts with loves, bookmarks, ratings, comments,
+    comment likes, reading positions and forks spread over the existing
+    books. Returns the
+    readers. Counters are not maintained; run `reconcile` afterwards if
+    they matter.
+    """
+    from django.utils import timezone
+
+    from readers.models import Bookmark, Comment, CommentLike, Love, Rating, ReadingProgress
+
+    rng = random.Random(seed)
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    users = User.objects.bulk_create(
+        [User(username=f'bench-reader-{i}', email=f'reader{i}@example.com') for i in range(readers)],
+        batch_size=batch_size,
+    )
+
+    for model in (Love, Bookmark):
+        model.objects.bulk_create(
+            [model(user=user, book_id=book_id) for user in users for book_id in rng.sample(book_ids, min(per_reader, len(book_ids)))],
+            batch_size=batch_size,
+        )
+    Rating.objects.bulk_create(
+        [
+            Rating(user=user, book_id=book_id, rating=rng.randint(0, 50) / 10)
+            for user in users for book_id in rng.sample(book_ids, min(per_reader, len(book_ids)))
+        ],
+        batch_size=batch_size,
+    )
+    comments = Comment.objects.bulk_create(
+        [
+            Comment(user=user, book_id=rng.choice(book_ids), content=f'Comment {i} by {user.username}')
+            for user in users for i in range(comments_per_reader)
+        ],
+        batch_size=batch_size,
+    )
+    CommentLike.objects.bulk_create(
+        [
+            CommentLike(user=user, comment=comment)
+            for user in users for comment in rng.sample(comments, min(likes_per_reader, len(comments)))
+        ],
+        batch_size=batch_size,
+    )
+
+    first_chapters = dict(
+        Chapter.objects.filter(chapter_number=1).values_list('book_id', 'id')
+    )
+    now = timezone.now()
+    ReadingProgress.objects.bulk_create(
+        [
+            ReadingProgress(
+                user=user, book_id=book_id, chapter_id=first_chapters.get(book_id),
+                offset=rng.randint(0, 1000), updated_at=now - timedelta(minutes=rng.randint(0, 10000)),
+            )
+            for user in users for book_id in rng.sample(book_ids, min(per_reader // 4, len(book_ids)))
+        ],
+        batch_size=batch_size,
+    )
+
+    originals = Book.objects.filter(id__in=rng.sample(book_ids, min(forks, len(book_ids))))
+    for original in originals:
+        fork_book(original, rng.choice(users))
+    return users
+
+
+def route_names(urlconfs):
+    """Names of every route included from the given URL modules."""
+    names = []
+    for entry in get_resolver().url_patterns:
+        module = getattr(entry, 'urlconf_name', None)
+        if getattr(module, '__name__', module) in urlconfs:
+            names.extend(p.name for p in entry.url_patterns if isinstance(p, URLPattern) and p.name)
+    return names
+
+
+def time_call(func, repeat=5):
+    """Runs ``func`` ``repeat`` times and returns the timings in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    """Returns median and max of a list of millisecond timings."""
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'max_ms': round(max(timings), 2),
+    }
@@ -0,0 +1,138 @@
+"""
+Resized copies of book covers.
+
+`generate_cover_variants` writes every size in COVER_SIZES as WebP plus a
+JPEG fallback, and records them in `Book.cover_variants`:
+
+    {'source': 'book_covers/x.png', 'hash': '3fa2...', 'sizes': {
+        'thumb': {'width': 160, 'height': 240,
+                  'webp': 'book_covers/variants/3fa2...-160.webp',
+                  'jpeg': 'book_covers/variants/3fa2...-160.jpg'},
+        ...}}
+
+File names start with a hash of the original's bytes, so a file never
+changes once written (it can be cached forever) and books sharing a cover
+share its variants. Variants are made by the `cover` job (see
+`writers.jobs`), never while serving a request.
+"""
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# size name -> width in pixels; covers are never scaled up
+COVER_SIZES = {
+    'thumb': 160,
+    'card': 320,
+    'detail': 640,
+}
+
+VARIANT_DIR = 'book_covers/variants'
+FORMATS = {
+    # format key -> (Pillow format, extension, save options)
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def needs_cover_variants(book):
+    """Whether the recorded variants belong to another cover (or to none)."""
+    return (book.cover_image.name or None) != book.cover_variants.get('source')
+
+
+def variants_are_current(book):
+    """Whether `book.cover_variants` were made from the current cover."""
+    return bool(book.cover_image) and book.cover_variants.get('source') == book.cover_image.name
+
+
+def generate_cover_variants(book, save=True):
+    """
+    Writes the variants of the book's cover that do not exist yet, records
+    them on the book and deletes the previous cover's variants. Returns the
+    new `cover_variants`.
+    """
+    previous = book.cover_variants or {}
+    if not book.cover_image:
+        variants = {}
+    else:
+        with book.cover_image.open('rb') as source:
+            original = source.read()
+        digest = hashlib.sha256(original).hexdigest()[:16]
+        image = _to_rgb(ImageOps.exif_transpose(Image.open(io.BytesIO(original))))
+
+        sizes = {}
+        for size, width in COVER_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            entry = {'width': resized.width, 'height': resized.height}
+            for key, (pillow_format, extension, options) in FORMATS.items():
+                # Named by the real width: sizes above the original share a file
+                name = f'{VARIANT_DIR}/{digest}-{resized.width}.{extension}'
+                if not default_storage.exists(name):
+                    buffer = io.BytesIO()
+                    resized.save(buffer, pillow_format, **options)
+                    default_storage.save(name, ContentFile(buffer.getvalue()))
+                entry[key] = name
+            sizes[size] = entry
+        variants = {'source': book.cover_image.name, 'hash': digest, 'sizes': sizes}
+
+    book.cover_variants = variants
+    if save:
+        book.save(update_fields=['cover_variants'])
+    delete_cover_variants(previous, keep=variant_files(variants), exclude_book=book.pk)
+    return variants
+
+
+def variant_files(variants):
+    return {
+        entry[key]
+        for entry in (variants or {}).get('sizes', {}).values()
+        for key in FORMATS
+        if key in entry
+    }
+
+
+def delete_cover_variants(variants, keep=(), exclude_book=None):
+    """
+    Deletes the files of `variants` except those in `keep`, unless another
+    book has variants of the same image (forks share their original's, and
+    the same picture uploaded twice maps to the same files).
+    """
+    from .models import Book
+
+    digest = (variants or {}).get('hash')
+    if not digest:
+        return
+    if Book.objects.filter(cover_variants__hash=digest).exclude(pk=exclude_book).exists():
+        return
+    for name in variant_files(variants) - set(keep):
+        default_storage.delete(name)
+
+
+def cover_variant_urls(book, request=None):
+    """
+    The size map exposed by the API: {'thumb': {'width', 'height', 'webp',
+    'jpeg'}, ...} with absolute URLs when a request is given. Empty until
+    the variants of the current cover exist.
+    """
+    if not variants_are_current(book):
+        return {}
+    sizes = {}
+    for size, entry in book.cover_variants['sizes'].items():
+        urls = {key: default_storage.url(entry[key]) for key in FORMATS if key in entry}
+        if request is not None:
+            urls = {key: request.build_absolute_uri(url) for key, url in urls.items()}
+        sizes[size] = {'width': entry['width'], 'height': entry['height'], **urls}
+    return sizes
+
+
+def _to_rgb(image):
+    """Flattens transparency onto white; JPEG has no alpha channel."""
+    if image.mode in ('RGBA', 'LA') or image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
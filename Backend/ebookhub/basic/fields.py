@@ -0,0 +1,110 @@
+import zlib
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+# Every stored value starts with a one byte tag naming its codec, so the
+# format can change later without rewriting old rows.
+ZLIB = b'z'
+RAW = b'u'
+
+# Below this size zlib's header costs more than it saves.
+MIN_COMPRESS_SIZE = 64
+
+
+def compress_text(text, level=6):
+    data = text.encode('utf-8')
+    if len(data) < MIN_COMPRESS_SIZE:
+        return RAW + data
+    return ZLIB + zlib.compress(data, level)
+
+
+def decompress_text(value):
+    """
+    Decodes a stored value. Plain strings are rows written before the column
+    was compressed and are returned as they are.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)  # memoryview on some backends
+    codec, payload = value[:1], value[1:]
+    if codec == ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if codec == RAW:
+        return payload.decode('utf-8')
+    raise ValueError(f"Unknown compressed text codec {codec!r}")
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """
+    Keeps the compressed bytes on the instance until the attribute is read,
+    so rows that are loaded but never rendered are never decompressed.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = decompress_text(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    A TextField stored zlib-compressed in a binary column.
+
+    If `length_field` is given, that field is set to the character count of
+    the text whenever the text is saved (including through `bulk_create`),
+    so lengths can be queried without decompressing anything.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, length_field=None, compression_level=6, **kwargs):
+        self.length_field = length_field
+        self.compression_level = compression_level
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.length_field is not None:
+            kwargs['length_field'] = self.length_field
+        if self.compression_level != 6:
+            kwargs['compression_level'] = self.compression_level
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        # Decompression is left to the descriptor
+        if isinstance(value, memoryview):
+            return bytes(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Read the raw attribute: untouched content is saved back as-is
+        # instead of being decompressed and compressed again.
+        value = model_instance.__dict__.get(self.attname)
+        if self.length_field and isinstance(value, str):
+            setattr(model_instance, self.length_field, len(value))
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = compress_text(value, self.compression_level)
+        if value is None:
+            return None
+        return connection.Database.Binary(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
@@ -0,0 +1,153 @@
+"""
+Copy-on-write chapters for forked books.
+
+A fork owns no copies of its original's chapters. It records the original
+(`Book.forked_from`) and the highest chapter id the original had when it
+was forked (`Book.forked_through_chapter`); chapter ids only grow, so the
+original's chapters up to that id are exactly the ones that existed then.
+The fork's chapters are those plus its own rows, minus the shared ones it
+has replaced: an own row with `source_chapter` set is the fork's edited
+version of that shared chapter.
+
+Rows are copied only when one side changes:
+
+- the forker edits a shared chapter: `save_chapter` writes the fork's own
+  copy with the changes, the original's row stays as it is;
+- the original's publisher edits or deletes a shared chapter, or deletes
+  the whole book: the receivers in `basic.signals` first give every fork
+  still sharing it a copy of the stored version (`detach_from_forks`), so
+  a fork keeps reading what was there when it was forked.
+
+Forking is a constant number of queries whatever the length of the book.
+"""
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+
+from .models import Book, Chapter, Fork
+
+# Fields that make up a chapter's text, copied when a fork gets its own row
+CHAPTER_FIELDS = ('chapter_title', 'content', 'chapter_number')
+
+
+def fork_book(original, user):
+    """Creates `user`'s fork of `original` and returns the new book."""
+    with transaction.atomic():
+        forked_through = Chapter.objects.filter(book=original).aggregate(last=Max('id'))['last']
+        forked_book = Book.objects.create(
+            title=f"{original.title} [Forked]",
+            author=original.author,
+            publisher=user,  # The user who forks is the publisher
+            description=original.description,
+            cover_image=original.cover_image,
+            cover_variants=original.cover_variants,  # Same picture, same resized files
+            date_published=date.today(),
+            format_id=original.format_id,
+            can_fork=False,  # Forked books cannot be forked again
+            is_forked=True,
+            ongoing=original.ongoing,
+            forked_from=original,
+            forked_through_chapter=forked_through or 0,
+        )
+        forked_book.genre.set(original.genre.all())
+        Fork.objects.create(original_book=original, forked_by=user, forked_book=forked_book)
+    return forked_book
+
+
+def chapters_of(book):
+    """
+    The chapters of `book` in reading order: its own and, for a fork, the
+    original's that it still shares. Needs `id`, `forked_from_id` and
+    `forked_through_chapter` on the book.
+    """
+    if not book.forked_from_id:
+        return Chapter.objects.filter(book_id=book.id)
+    replaced = Chapter.objects.filter(book_id=book.id, source_chapter__isnull=False).values('source_chapter_id')
+    return Chapter.objects.filter(
+        Q(book_id=book.id)
+        | Q(book_id=book.forked_from_id, id__lte=book.forked_through_chapter) & ~Q(id__in=replaced)
+    )
+
+
+def first_chapters_of(books, limit=None):
+    """
+    `chapters_of` for many books at once, in one windowed query: the
+    first `limit` chapters of each (all of them with no limit), in
+    reading order. Every chapter has `reading_book_id`, the id of the
+    book it was read through, which for a shared one is the fork's.
+    """
+    book_ids = [book.id for book in books]
+    if not book_ids:
+        return []
+    book_table, chapter_table = Book._meta.db_table, Chapter._meta.db_table
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    position = 'WHERE position <= %s' if limit is not None else ''
+    return list(Chapter.objects.raw(
+        f"""
+        SELECT id, book_id, chapter_title, chapter_number, reading_book_id FROM (
+            SELECT c.id, c.book_id, c.chapter_title, c.chapter_number, b.id AS reading_book_id,
+                   ROW_NUMBER() OVER (PARTITION BY b.id ORDER BY c.chapter_number, c.id) AS position
+            FROM {book_table} b
+            JOIN {chapter_table} c ON c.book_id = b.id OR (
+                c.book_id = b.forked_from_id AND c.id <= b.forked_through_chapter
+                AND c.id NOT IN (
+                    SELECT r.source_chapter_id FROM {chapter_table} r
+                    WHERE r.book_id = b.id AND r.source_chapter_id IS NOT NULL
+                )
+            )
+            WHERE b.id IN ({placeholders})
+        ) {position}
+        ORDER BY reading_book_id, chapter_number, id
+        """,
+        book_ids + ([limit] if limit is not None else []),
+    ))
+
+
+def find_chapter(book, chapter_id):
+    """
+    The chapter `chapter_id` as read through `book`, or None. For a fork,
+    the id of a shared chapter it has replaced leads to its own copy, so
+    links made before the edit keep working.
+    """
+    chapter = chapters_of(book).filter(id=chapter_id).first()
+    if chapter is None and book.forked_from_id:
+        chapter = Chapter.objects.filter(book_id=book.id, source_chapter_id=chapter_id).first()
+    return chapter
+
+
+def save_chapter(book, chapter, **changes):
+    """
+    Applies `changes` to a chapter read through `book` and returns the
+    saved row: the chapter itself when the book owns it, otherwise a new
+    row of the fork replacing the shared one.
+    """
+    if chapter.book_id == book.id:
+        for name, value in changes.items():
+            setattr(chapter, name, value)
+        chapter.save()
+        return chapter
+    values = {name: getattr(chapter, name) for name in CHAPTER_FIELDS}
+    values.update(changes)
+    return Chapter.objects.create(book=book, source_chapter=chapter, **values)
+
+
+def detach_from_forks(chapter, keep_source=True):
+    """
+    Gives every fork still sharing `chapter` its own copy of the version
+    stored in the database, before that version changes or is deleted.
+    `keep_source=False` leaves the copies unlinked, for a chapter that is
+    about to be deleted.
+    """
+    replaced = Chapter.objects.filter(source_chapter_id=chapter.pk).values('book_id')
+    forks = list(
+        Book.objects.filter(forked_from_id=chapter.book_id, forked_through_chapter__gte=chapter.pk)
+        .exclude(id__in=replaced).values_list('id', flat=True)
+    )
+    if not forks:
+        return
+    stored = Chapter.objects.get(pk=chapter.pk)
+    values = {name: getattr(stored, name) for name in CHAPTER_FIELDS}
+    for book_id in forks:
+        # One by one, so the TOC, search and detail receivers see every copy
+        Chapter.objects.create(book_id=book_id, source_chapter=chapter if keep_source else None, **values)
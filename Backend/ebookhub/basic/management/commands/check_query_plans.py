@@ -0,0 +1,225 @@
+import logging
+import re
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from basic.benchmarking import route_names, scratch_database, seed_catalog, seed_interactions
+from basic.models import Author, Book, Chapter, Genre
+from readers.counters import reconcile
+from writers.models import Job
+
+# The URL modules whose routes must all be covered below
+CHECKED_URLCONFS = ('basic.urls', 'readers.urls', 'writers.urls')
+
+# route name -> how to call it. `kwargs` builds the URL arguments from the
+# seeded fixtures, as can `data`; `user` picks who calls (a reader by
+# default); `allow_scan` lists tables a route legitimately reads in
+# full and `allow_sort` explains a temporary sort that is known to be small.
+ROUTES = {
+    # basic
+    'signup': {'method': 'post', 'data': {'username': 'plan-check', 'email': 'reader7@example.com', 'password': 'x'}},
+    'login': {
+        'method': 'post', 'data': {'username': 'reader7@example.com', 'password': 'wrong'},
+        'allow_sort': "orders the one or two users matched by username OR email",
+    },
+    'token_refresh': {'method': 'post', 'data': {}},
+    'author-detail': {'kwargs': lambda f: {'id': f.author.id}},
+    'publisher-detail': {
+        'kwargs': lambda f: {'id': f.publisher.id},
+        'allow_sort': "orders one user's groups and permissions",
+    },
+    'genre-detail': {'kwargs': lambda f: {'id': f.genre.id}},
+    'author-detail-async': {'kwargs': lambda f: {'id': f.author.id}},
+    'publisher-detail-async': {
+        'kwargs': lambda f: {'id': f.publisher.id},
+        'allow_sort': "orders one user's groups and permissions",
+    },
+    'genre-detail-async': {'kwargs': lambda f: {'id': f.genre.id}},
+    # Returns every title, author or genre name by design
+    'generic_queries': {'query': '?type=books', 'allow_scan': {'basic_book'}},
+    'search': {'query': '?q=river'},
+    # readers; the unfiltered book list walks basic_book in id order and
+    # stops at the page size
+    'book-list': {'allow_scan': {'basic_book'}},
+    'chapter-detail': {'kwargs': lambda f: {'book_id': f.book.id, 'chapter_id': f.chapter.id}},
+    'book-toc': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'book-download': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'book-find': {'kwargs': lambda f: {'book_id': f.book.id}, 'query': '?q=river'},
+    # Written at once: scratch databases do not buffer positions
+    'reading-progress': {
+        'method': 'put', 'kwargs': lambda f: {'book_id': f.book.id},
+        'data': lambda f: {'chapter_id': f.chapter.id, 'offset': 120},
+    },
+    'continue-reading': {},
+    'love-list': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'bookmark-list': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'rating-list': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'comment-list': {'kwargs': lambda f: {'book_id': f.book.id}, 'query': '?ordering=most_liked'},
+    'comment-like-list': {'kwargs': lambda f: {'book_id': f.book.id}},
+    'book-detail': {'kwargs': lambda f: {'id': f.book.id}},
+    'book-list-async': {'allow_scan': {'basic_book'}},
+    'book-detail-async': {'kwargs': lambda f: {'id': f.book.id}},
+    'chapter-detail-async': {'kwargs': lambda f: {'book_id': f.book.id, 'chapter_id': f.chapter.id}},
+    'books-loved-by-user': {'kwargs': lambda f: {'user_id': f.reader.id}},
+    'books-bookmarked-by-user': {'kwargs': lambda f: {'user_id': f.reader.id}},
+    'books-rated-by-user': {'kwargs': lambda f: {'user_id': f.reader.id}},
+    'books-commented-by-user': {'kwargs': lambda f: {'user_id': f.reader.id}},
+    # writers
+    'books-by-author': {'kwargs': lambda f: {'author_id': f.author.id}},
+    'books-forked-by-user': {'kwargs': lambda f: {'user_id': f.forker.id}},
+    'fork-book': {'method': 'post', 'kwargs': lambda f: {'pk': f.book.id}},
+    # The forker editing a chapter the fork shares, which copies it
+    'chapter-update': {
+        'method': 'put', 'kwargs': lambda f: {'book_id': f.fork.id, 'chapter_id': f.fork_chapter.id},
+        'data': {'content': 'Rewritten.'}, 'user': lambda f: f.fork.publisher,
+    },
+    'upload-epub': {'method': 'post', 'data': {}},
+    # Followed by the publisher of the job's book
+    'job-detail': {'kwargs': lambda f: {'pk': f.job.id}, 'user': lambda f: f.book.publisher},
+    'mybooks': {'kwargs': lambda f: {'publisher_id': f.publisher.id}},
+}
+
+# Temporary sorts accepted wherever they appear, by statement
+ALLOWED_SORTS = [
+    # Sliced prefetches (BookSerializer's first chapters) number rows per
+    # parent with a window and sort at most N rows per parent of the page
+    re.compile(r'ROW_NUMBER\(\) OVER \(PARTITION BY'),
+    # Relevance ranking sorts the full-text matches; FTS5 keeps no bm25 order
+    re.compile(r'\bbm25\('),
+    # A fork's chapters (basic.forks.chapters_of) merge its own rows with
+    # the shared ones of its original: at most one book's chapters
+    re.compile(r'"basic_chapter"\."book_id" = %s OR \("basic_chapter"\."book_id" = %s AND "basic_chapter"\."id" <= %s'),
+]
+
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+# `SCAN <fts table> VIRTUAL TABLE INDEX ...` is a MATCH lookup, not a scan
+SCAN_RE = re.compile(r'^SCAN (\w+)(?! VIRTUAL TABLE)')
+TEMP_BTREE = 'USE TEMP B-TREE'
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a scratch database, calls every route of the basic, readers and writers "
+        "APIs and runs EXPLAIN QUERY PLAN on each statement they issue. Fails on full "
+        "table scans and temporary B-tree sorts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--chapters', type=int, default=10, help="Chapters per book.")
+        parser.add_argument('--readers', type=int, default=300)
+        parser.add_argument('--analyze', action='store_true',
+                            help="Run ANALYZE before planning, as a maintained production database would.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The plan checks read SQLite's EXPLAIN QUERY PLAN output.")
+
+        missing = sorted(set(route_names(CHECKED_URLCONFS)) - set(ROUTES))
+        if missing:
+            raise CommandError(f"Routes without a plan check: {', '.join(missing)}. Add them to ROUTES.")
+
+        # DEBUG error pages render querysets from the crashed frame; those
+        # queries are not the route's
+        with scratch_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+            fixtures = self.seed(options)
+            if options['analyze']:
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            tables = set(connection.introspection.table_names())
+
+            failures = 0
+            for name, case in ROUTES.items():
+                status_code, statements = self.call(name, case, fixtures)
+                problems = []
+                for sql, params in statements:
+                    sort_allowed = 'allow_sort' in case or any(pattern.search(sql) for pattern in ALLOWED_SORTS)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"  {sql[:400]}")
+                    for detail in self.plan(sql, params):
+                        scan = SCAN_RE.match(detail)
+                        if scan and scan.group(1) in tables and scan.group(1) not in case.get('allow_scan', ()):
+                            problems.append((detail, sql))
+                        elif TEMP_BTREE in detail and not sort_allowed:
+                            problems.append((detail, sql))
+                        if options['verbosity'] > 1:
+                            self.stdout.write(f"    {detail}")
+
+                summary = f"{name}: HTTP {status_code}, {len(statements)} statement(s)"
+                if problems:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"FAIL {summary}"))
+                    for detail, sql in problems:
+                        self.stdout.write(f"    {detail}\n      {sql[:300]}")
+                else:
+                    self.stdout.write(f"ok   {summary}")
+
+        if failures:
+            raise CommandError(f"{failures} route(s) with full scans or temporary sorts.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(ROUTES)} routes use indexed plans."))
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['books']} books and {options['readers']} readers...")
+        publisher = seed_catalog(books=options['books'], chapters_per_book=options['chapters'], chapter_words=50)
+        readers = seed_interactions(readers=options['readers'])
+        reconcile()
+
+        book = Book.objects.filter(is_forked=False).order_by('-comment_count').first()
+        Book.objects.filter(id=book.id).update(can_fork=True)
+        fork = Book.objects.filter(is_forked=True).select_related('publisher').first()
+        return SimpleNamespace(
+            publisher=publisher,
+            reader=readers[0],
+            forker=User.objects.filter(fork__isnull=False).first(),
+            book=book,
+            chapter=Chapter.objects.filter(book=book).order_by('chapter_number')[1],
+            fork=fork,
+            fork_chapter=Chapter.objects.filter(book_id=fork.forked_from_id).order_by('chapter_number')[0],
+            author=Author.objects.first(),
+            genre=Genre.objects.first(),
+            job=Job.objects.create(kind=Job.KIND_EPUB, book=book),
+        )
+
+    @staticmethod
+    def call(name, case, fixtures):
+        """
+        Calls one route as an authenticated user; returns the status code
+        and the (sql, params) of every statement it ran.
+        """
+        # A view that crashes still shows the plans of what it ran before
+        client = APIClient(SERVER_NAME='localhost', raise_request_exception=False)
+        client.force_authenticate(case['user'](fixtures) if 'user' in case else fixtures.reader)
+        url = reverse(name, kwargs=case['kwargs'](fixtures) if 'kwargs' in case else None)
+        url += case.get('query', '')
+
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            if not many and sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)  # 4xx/5xx are reported in the summary line
+        try:
+            with connection.execute_wrapper(capture):
+                data = case.get('data')
+                if callable(data):
+                    data = data(fixtures)
+                response = getattr(client, case.get('method', 'get'))(url, data, format='json')
+        finally:
+            request_logger.setLevel(level)
+        return response.status_code, statements
+
+    @staticmethod
+    def plan(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
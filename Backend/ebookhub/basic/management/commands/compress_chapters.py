@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from basic.fields import compress_text, decompress_text
+from basic.models import Chapter
+
+
+class Command(BaseCommand):
+    help = "Compresses chapter content stored before Chapter.content became compressed, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Chapters rewritten per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the savings without writing anything.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        field = Chapter._meta.get_field('content')
+
+        last_id = 0
+        converted = bytes_before = bytes_after = 0
+        decode_seconds = 0.0
+
+        while True:
+            # values_list hands back the stored value untouched: str for
+            # legacy rows, bytes for rows that are already compressed
+            rows = list(
+                Chapter.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'content')[:chunk_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            pending = []
+            for chapter_id, content in rows:
+                if not isinstance(content, str):
+                    continue
+                encoded = compress_text(content, field.compression_level)
+                start = time.perf_counter()
+                decompress_text(encoded)
+                decode_seconds += time.perf_counter() - start
+
+                bytes_before += len(content.encode('utf-8'))
+                bytes_after += len(encoded)
+                pending.append(Chapter(id=chapter_id, content=content, content_length=len(content)))
+
+            if pending and not dry_run:
+                with transaction.atomic():
+                    Chapter.objects.bulk_update(pending, ['content', 'content_length'])
+            converted += len(pending)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Processed up to chapter {last_id} ({converted} compressed so far)")
+
+        if not converted:
+            self.stdout.write(self.style.SUCCESS("Nothing to compress."))
+            return
+
+        saved = bytes_before - bytes_after
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would compress' if dry_run else 'Compressed'} {converted} chapters: "
+            f"{bytes_before} -> {bytes_after} bytes "
+            f"({saved} bytes saved, {saved / bytes_before:.1%}). "
+            f"Average decode time {decode_seconds / converted * 1e6:.1f} us per chapter."
+        ))
+
@@ -0,0 +1,456 @@
+import contextlib
+import http.client
+import io
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connections
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from basic import search
+from basic.benchmarking import route_names, scratch_database, seed_catalog, seed_interactions
+from basic.models import Author, Book, Chapter, Fork, Genre
+from plugin.models import Plugin, Tag
+from readers.coalescing import interaction_writes
+from readers.counters import reconcile
+from readers.models import Comment
+from readers.progress import reading_progress
+from writers.models import Job
+
+# The URL modules whose routes must all be driven below
+LOADED_URLCONFS = ('basic.urls', 'readers.urls', 'writers.urls', 'plugin.urls')
+
+# Access tokens live five minutes; clients get a new one well before
+TOKEN_MAX_AGE = 60
+
+# case -> how to call it, once per request number `n`. `route` is the URL
+# name (the case name by default); `kwargs`, `data` and `user` are built
+# from the seeded fixtures and `n`, so writes never repeat themselves;
+# `user` None calls anonymously; `multipart` posts a form instead of JSON.
+CASES = {
+    # basic
+    'signup': {
+        'method': 'post', 'user': None,
+        'data': lambda f, n: {
+            'username': f'load-{n}', 'email': f'load-{n}@example.com', 'password': 'load-password',
+            'full_name': f'Load {n}', 'role': 'reader',
+        },
+    },
+    'login': {
+        'method': 'post', 'user': None,
+        'data': lambda f, n: {'username': f.login.email, 'password': f.password},
+    },
+    'token_refresh': {
+        'method': 'post', 'user': None,
+        'data': lambda f, n: {'refresh': str(RefreshToken.for_user(f.reader(n)))},
+    },
+    'author-detail': {'kwargs': lambda f, n: {'id': f.rng.choice(f.authors)}},
+    'publisher-detail': {'kwargs': lambda f, n: {'id': f.publisher.id}},
+    'genre-detail': {'kwargs': lambda f, n: {'id': f.rng.choice(f.genres)}},
+    'author-detail-async': {'kwargs': lambda f, n: {'id': f.rng.choice(f.authors)}},
+    'publisher-detail-async': {'kwargs': lambda f, n: {'id': f.publisher.id}},
+    'genre-detail-async': {'kwargs': lambda f, n: {'id': f.rng.choice(f.genres)}},
+    'generic_queries': {'query': '?type=genres'},
+    'search': {'query': lambda f, n: f'?q={f.rng.choice(f.words)}'},
+    # readers
+    'book-list': {'query': lambda f, n: f.rng.choice(('', '?page_size=50', '?fields=id,title,author'))},
+    'chapter-detail': {'kwargs': lambda f, n: dict(zip(('book_id', 'chapter_id'), f.rng.choice(f.chapters)))},
+    'book-toc': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)}},
+    'book-download': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.downloads)}},
+    'book-find': {
+        'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)},
+        'query': lambda f, n: f'?q={f.rng.choice(f.words)}',
+    },
+    'reading-progress': {
+        'method': 'put', 'kwargs': lambda f, n: {'book_id': f.chapters[n % len(f.chapters)][0]},
+        'data': lambda f, n: {'chapter_id': f.chapters[n % len(f.chapters)][1], 'offset': n},
+    },
+    'continue-reading': {},
+    'love-list': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)}},
+    'love-list POST': {
+        'route': 'love-list', 'method': 'post', 'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)},
+    },
+    'bookmark-list': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)}},
+    'bookmark-list POST': {
+        'route': 'bookmark-list', 'method': 'post', 'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)},
+    },
+    'rating-list': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)}},
+    'rating-list POST': {
+        'route': 'rating-list', 'method': 'post', 'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)},
+        'data': lambda f, n: {'user_id': f.reader(n).id, 'rating': f.rng.randint(0, 50) / 10},
+    },
+    'comment-list': {
+        'kwargs': lambda f, n: {'book_id': f.rng.choice(f.comments)[0]},
+        'query': lambda f, n: f.rng.choice(('', '?ordering=most_liked')),
+    },
+    'comment-list POST': {
+        'route': 'comment-list', 'method': 'post', 'kwargs': lambda f, n: {'book_id': f.rng.choice(f.books)},
+        'data': lambda f, n: {'user_id': f.reader(n).id, 'content': f'Load test comment {n}'},
+    },
+    'comment-like-list': {'kwargs': lambda f, n: {'book_id': f.rng.choice(f.comments)[0]}},
+    'comment-like-list POST': {
+        'route': 'comment-like-list', 'method': 'post',
+        'kwargs': lambda f, n: {'book_id': f.comment(n)[0]},
+        'data': lambda f, n: {'user_id': f.reader(n).id, 'comment_id': f.comment(n)[1]},
+    },
+    'book-detail': {'kwargs': lambda f, n: {'id': f.rng.choice(f.books)}},
+    'book-list-async': {'query': lambda f, n: f.rng.choice(('', '?page_size=50', '?fields=id,title,author'))},
+    'book-detail-async': {'kwargs': lambda f, n: {'id': f.rng.choice(f.books)}},
+    'chapter-detail-async': {
+        'kwargs': lambda f, n: dict(zip(('book_id', 'chapter_id'), f.rng.choice(f.chapters))),
+    },
+    'books-loved-by-user': {'kwargs': lambda f, n: {'user_id': f.reader(n).id}},
+    'books-bookmarked-by-user': {'kwargs': lambda f, n: {'user_id': f.reader(n).id}},
+    'books-rated-by-user': {'kwargs': lambda f, n: {'user_id': f.reader(n).id}},
+    'books-commented-by-user': {'kwargs': lambda f, n: {'user_id': f.reader(n).id}},
+    # writers
+    'books-by-author': {'kwargs': lambda f, n: {'author_id': f.rng.choice(f.authors)}},
+    'books-forked-by-user': {'kwargs': lambda f, n: {'user_id': f.rng.choice(f.forks).publisher_id}},
+    # Every reader forks every forkable book at most once
+    'fork-book': {
+        'method': 'post', 'kwargs': lambda f, n: {'pk': f.forkable[n // len(f.readers) % len(f.forkable)]},
+    },
+    # The first edit of a shared chapter copies it, later ones update the copy
+    'chapter-update': {
+        'method': 'put',
+        'kwargs': lambda f, n: {'book_id': f.forks[n % len(f.forks)].id,
+                                'chapter_id': f.forks[n % len(f.forks)].shared_chapter},
+        'data': lambda f, n: {'content': f'Rewritten {n} times.'},
+        'user': lambda f, n: f.forks[n % len(f.forks)].publisher,
+    },
+    'upload-epub': {
+        'method': 'post', 'multipart': True,
+        'data': lambda f, n: {
+            'file': SimpleUploadedFile(f'load-{n}.epub', f.epub, 'application/epub+zip'),
+            'title': f'Uploaded {n}', 'author': f'Author {n % 50}', 'genre': 'Genre-1 Genre-2',
+            'description': 'Uploaded by the load test.', 'user_id': f.publisher.id,
+        },
+        'user': lambda f, n: f.publisher,
+    },
+    'job-detail': {'kwargs': lambda f, n: {'pk': f.rng.choice(f.jobs)}},
+    'mybooks': {'kwargs': lambda f, n: {'publisher_id': f.publisher.id}, 'user': lambda f, n: f.publisher},
+    # plugin
+    'plugin-list': {},
+    'plugin-toggle': {
+        'method': 'patch', 'kwargs': lambda f, n: {'pk': f.rng.choice(f.plugins)},
+        'data': lambda f, n: {'is_active': n % 2 == 0},
+    },
+}
+
+
+def sample_epub(chapters=3):
+    """A small, valid EPUB to upload and download."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as epub:
+        epub.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip')
+        epub.writestr('META-INF/container.xml', (
+            '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            '</rootfiles></container>'
+        ))
+        items = ''.join(
+            f'<item id="c{i}" href="c{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(chapters)
+        )
+        spine = ''.join(f'<itemref idref="c{i}"/>' for i in range(chapters))
+        epub.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0"?><package version="3.0" xmlns="http://www.idpf.org/2007/opf" unique-identifier="id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="id">load</dc:identifier>'
+            '<dc:title>Load</dc:title><dc:language>en</dc:language></metadata>'
+            f'<manifest>{items}</manifest><spine>{spine}</spine></package>'
+        ))
+        for i in range(chapters):
+            epub.writestr(f'OEBPS/c{i}.xhtml', (
+                f'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapter {i + 1}</title></head>'
+                f'<body><h1>Chapter {i + 1}</h1>{"<p>The river at night.</p>" * 200}</body></html>'
+            ))
+    return buffer.getvalue()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    # runserver's backlog of 10 makes a burst of clients wait for SYN retries
+    request_queue_size = 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a scratch database with a synthetic catalog, starts a local threaded HTTP "
+        "server on it and drives every route of the basic, readers, writers and plugin "
+        "APIs with concurrent clients. Reports throughput and p50/p95/p99 latency per "
+        "route and writes them to a JSON file that later runs can be compared with."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=200000)
+        parser.add_argument('--chapters', type=int, default=10, help="Chapters per book.")
+        parser.add_argument('--readers', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=32, help="Concurrent clients.")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per route.")
+        parser.add_argument('--warmup', type=int, default=None,
+                            help="Unmeasured requests per route first (defaults to --clients).")
+        parser.add_argument('--routes', help="Comma separated cases to run (default: all of them).")
+        parser.add_argument('--output', help="JSON report path (default: loadtest-<timestamp>.json).")
+        parser.add_argument('--compare', help="A previous JSON report to compare with.")
+
+    def handle(self, *args, **options):
+        missing = sorted(set(route_names(LOADED_URLCONFS)) - {case.get('route', name) for name, case in CASES.items()})
+        if missing:
+            raise CommandError(f"Routes without a load test case: {', '.join(missing)}. Add them to CASES.")
+        names = options['routes'].split(',') if options['routes'] else list(CASES)
+        unknown = sorted(set(names) - set(CASES))
+        if unknown:
+            raise CommandError(f"Unknown cases: {', '.join(unknown)}.")
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+        warmup = options['clients'] if options['warmup'] is None else options['warmup']
+
+        # Counted per status instead; SignupView also prints every profile
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        started_at = datetime.now()
+        routes = {}
+        with tempfile.TemporaryDirectory() as directory:
+            # A file, so the server's threads share one database
+            with scratch_database(name=os.path.join(directory, 'load.sqlite3')), \
+                    override_settings(DEBUG=False, ALLOWED_HOSTS=['127.0.0.1'],
+                                      MEDIA_ROOT=os.path.join(directory, 'media')):
+                began = time.perf_counter()
+                fixtures = self.seed(options)
+                seed_seconds = round(time.perf_counter() - began, 1)
+                connections.close_all()
+
+                server = LoadTestServer(('127.0.0.1', 0), QuietRequestHandler)
+                server.set_app(get_internal_wsgi_application())
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        for name in names:
+                            if warmup:
+                                self.run(server.server_address, name, fixtures,
+                                         range(options['requests'], options['requests'] + warmup), options)
+                            routes[name] = self.run(server.server_address, name, fixtures,
+                                                    range(options['requests']), options)
+                            self.stdout.write(self.format_row(name, routes[name]))
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                    interaction_writes.stop()
+                    reading_progress.stop()
+                    connections.close_all()
+
+        report = {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'options': {key: options[key] for key in ('books', 'chapters', 'readers', 'clients', 'requests')},
+            'dataset': fixtures.dataset,
+            'seed_seconds': seed_seconds,
+            'routes': routes,
+        }
+        output = options['output'] or f"loadtest-{started_at:%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {output}"))
+        if previous:
+            self.compare(previous, report)
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['books']} books and {options['readers']} readers...")
+        rng = random.Random(0)
+        publisher = seed_catalog(books=options['books'], chapters_per_book=options['chapters'], chapter_words=50)
+        readers = seed_interactions(readers=options['readers'], forks=max(20, options['readers'] // 100))
+        reconcile()
+        search.rebuild_index()
+
+        password = 'load-password'
+        login = readers[-1]
+        login.set_password(password)
+        login.save(update_fields=['password'])
+
+        books = list(Book.objects.filter(forked_from=None).values_list('id', flat=True))
+        sample = rng.sample(books, min(1000, len(books)))
+        forked = set(Fork.objects.values_list('original_book_id', flat=True))
+        forkable = [book_id for book_id in sample[:200] if book_id not in forked]
+        Book.objects.filter(id__in=forkable).update(can_fork=True)
+
+        epub = sample_epub()
+        downloads = sample[:100]
+        path = os.path.join('epub_books', 'load.epub')
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'epub_books'), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, path), 'wb') as f:
+            f.write(epub)
+        Book.objects.filter(id__in=downloads).update(file=path)
+
+        forks = list(
+            Book.objects.filter(is_forked=True).exclude(forked_from=None).select_related('publisher')
+        )
+        first_chapters = dict(
+            Chapter.objects.filter(book_id__in=[fork.forked_from_id for fork in forks], chapter_number=1)
+            .values_list('book_id', 'id')
+        )
+        for fork in forks:
+            fork.shared_chapter = first_chapters[fork.forked_from_id]
+
+        tags = Tag.objects.bulk_create([Tag(name=f'tag-{i}') for i in range(10)])
+        plugins = Plugin.objects.bulk_create(
+            [Plugin(title=f'Plugin {i}', description='Synthetic plugin.') for i in range(30)]
+        )
+        for plugin in plugins:
+            plugin.tags.set(rng.sample(tags, 3))
+
+        comments = list(Comment.objects.values_list('book_id', 'id')[:5000])
+        tokens = {}
+
+        def reader(n):
+            return readers[n % len(readers)]
+
+        return SimpleNamespace(
+            rng=rng,
+            publisher=publisher,
+            readers=readers,
+            reader=reader,
+            login=login,
+            password=password,
+            tokens=tokens,
+            books=sample,
+            chapters=list(Chapter.objects.filter(book_id__in=sample).values_list('book_id', 'id')),
+            downloads=downloads,
+            forkable=forkable,
+            forks=forks,
+            authors=list(Author.objects.values_list('id', flat=True)[:1000]),
+            genres=list(Genre.objects.values_list('id', flat=True)),
+            comments=comments,
+            # A comment for every request, each reader liking a comment once
+            comment=lambda n: comments[(n // len(readers) + n) % len(comments)],
+            jobs=[Job.objects.create(kind=Job.KIND_EPUB, book_id=book_id).id for book_id in sample[:20]],
+            plugins=[plugin.id for plugin in plugins],
+            words=('river', 'night', 'letter', 'chapter', 'amet'),
+            epub=epub,
+            dataset={
+                'books': Book.objects.count(),
+                'chapters': Chapter.objects.count(),
+                'readers': len(readers),
+                'comments': Comment.objects.count(),
+                'forks': len(forks),
+            },
+        )
+
+    def token(self, fixtures, user):
+        minted = fixtures.tokens.get(user.id)
+        if minted is None or time.monotonic() - minted[1] > TOKEN_MAX_AGE:
+            minted = fixtures.tokens[user.id] = (str(AccessToken.for_user(user)), time.monotonic())
+        return minted[0]
+
+    def build(self, name, fixtures, n):
+        """Method, path, body and headers of request `n`, built before it is timed."""
+        case = CASES[name]
+        url = reverse(case.get('route', name), kwargs=case['kwargs'](fixtures, n) if 'kwargs' in case else None)
+        query = case.get('query', '')
+        url += query(fixtures, n) if callable(query) else query
+
+        headers = {'Host': '127.0.0.1', 'Accept': 'application/json'}
+        user = case['user'](fixtures, n) if callable(case.get('user')) else case.get('user', fixtures.reader(n))
+        if user is not None:
+            headers['Authorization'] = f'Bearer {self.token(fixtures, user)}'
+
+        body = None
+        if 'data' in case or case.get('method', 'get') != 'get':
+            data = case['data'](fixtures, n) if 'data' in case else {}
+            if case.get('multipart'):
+                body = encode_multipart(BOUNDARY, data)
+                headers['Content-Type'] = MULTIPART_CONTENT
+            else:
+                body = json.dumps(data).encode()
+                headers['Content-Type'] = 'application/json'
+        return case.get('method', 'get').upper(), url, body, headers
+
+    def run(self, address, name, fixtures, numbers, options):
+        """Sends requests `numbers` of a case from `--clients` clients at once."""
+        requests = [self.build(name, fixtures, n) for n in numbers]
+
+        def send(request):
+            method, url, body, headers = request
+            began = time.perf_counter()
+            conn = http.client.HTTPConnection(*address, timeout=120)
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                outcome = response.status
+            except (OSError, http.client.HTTPException) as e:
+                outcome = type(e).__name__
+            finally:
+                conn.close()
+            return outcome, (time.perf_counter() - began) * 1000
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['clients']) as pool:
+            outcomes = list(pool.map(send, requests))
+        elapsed = time.perf_counter() - began
+
+        latencies = sorted(ms for _, ms in outcomes)
+        statuses = {}
+        for outcome, _ in outcomes:
+            statuses[str(outcome)] = statuses.get(str(outcome), 0) + 1
+        errors = sum(count for outcome, count in statuses.items() if not outcome.isdigit() or int(outcome) >= 500)
+        return {
+            'requests': len(outcomes),
+            'requests_per_second': round(len(outcomes) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'errors': errors,
+            'statuses': statuses,
+        }
+
+    @staticmethod
+    def format_row(name, row):
+        statuses = ' '.join(f'{status}x{count}' for status, count in sorted(row['statuses'].items()))
+        return (
+            f"{name:>26} {row['requests_per_second']:>8} req/s  p50 {row['p50_ms']:>8}  "
+            f"p95 {row['p95_ms']:>8}  p99 {row['p99_ms']:>8} ms  {statuses}"
+        )
+
+    def compare(self, previous, report):
+        self.stdout.write(f"\nChange since {previous.get('started_at', 'the previous run')}:")
+        self.stdout.write(f"{'case':>26} {'req/s':>16} {'p99 ms':>20}")
+        for name, row in report['routes'].items():
+            before = previous['routes'].get(name)
+            if before is None:
+                continue
+            self.stdout.write(
+                f"{name:>26} {before['requests_per_second']:>7} -> {row['requests_per_second']:<7}"
+                f" {before['p99_ms']:>9} -> {row['p99_ms']:<9} ({change(before['p99_ms'], row['p99_ms'])})"
+            )
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(math.ceil(len(ordered) * fraction) - 1, 0)]
+
+
+def change(before, after):
+    return f"{(after - before) / before * 100:+.0f}%" if before else 'n/a'
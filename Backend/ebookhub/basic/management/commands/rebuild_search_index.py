@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from basic.search import rebuild_index, search_enabled
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of books and chapters from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Chapters read per query.")
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            raise CommandError("Full-text search needs the SQLite backend (FTS5).")
+
+        def progress(chapters):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Indexed {chapters} chapters")
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            books, chapters = rebuild_index(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {books} books and {chapters} chapters in {time.perf_counter() - start:.1f}s."
+        ))
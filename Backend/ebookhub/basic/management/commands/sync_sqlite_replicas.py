@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database onto the files of the DATABASE_REPLICAS "
+        "aliases, standing in for replication when running replicas locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep copying every this many seconds instead of once.")
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        if databases[DEFAULT_DB_ALIAS]['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Only SQLite primaries can be copied file by file.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured; set EBOOKHUB_DB_REPLICAS.")
+
+        primary = str(databases[DEFAULT_DB_ALIAS]['NAME'])
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                start = time.perf_counter()
+                pages = self.copy(primary, str(databases[alias]['NAME']))
+                if options['verbosity'] > 0:
+                    self.stdout.write(
+                        f"{alias}: copied {pages} pages in {(time.perf_counter() - start) * 1000:.0f} ms"
+                    )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def copy(source_name, target_name):
+        """
+        Copies with SQLite's online backup into the replica file itself. The
+        copy reads a consistent snapshot of the primary and locks the replica
+        while it writes; connections already open on the replica, persistent
+        ones included, see the new contents from their next transaction. A
+        copy renamed into place would leave them reading the old file.
+        """
+        source = sqlite3.connect(source_name)
+        target = sqlite3.connect(target_name)
+        try:
+            source.backup(target)
+            return source.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
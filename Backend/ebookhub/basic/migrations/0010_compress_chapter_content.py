@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:58
+
+import basic.fields
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def fill_content_length(apps, schema_editor):
+    # Existing rows still hold plain text here, so LENGTH() counts characters
+    Chapter = apps.get_model('basic', 'Chapter')
+    Chapter.objects.update(content_length=Length('content'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic', '0009_profile_reversed_chapter_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='content_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_content_length, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chapter',
+            name='content',
+            field=basic.fields.CompressedTextField(length_field='content_length'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+CREATE_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS basic_book_fts USING fts5("
+    "title, description, author, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS basic_chapter_fts USING fts5("
+    "chapter_title, content, book, tokenize='unicode61 remove_diacritics 2')",
+]
+DROP_STATEMENTS = [
+    "DROP TABLE IF EXISTS basic_book_fts",
+    "DROP TABLE IF EXISTS basic_chapter_fts",
+]
+
+
+def create_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    """
+    Creates the FTS5 tables used by basic.search. Existing books are indexed
+    by running `manage.py rebuild_search_index` once.
+    """
+
+    dependencies = [
+        ('basic', '0010_compress_chapter_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
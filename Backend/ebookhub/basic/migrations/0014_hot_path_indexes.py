@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic', '0013_book_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['book', 'chapter_number'], name='chapter_book_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fork',
+            index=models.Index(fields=['forked_by', 'forked_book'], name='fork_user_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fork',
+            index=models.Index(fields=['original_book', 'forked_by'], name='fork_original_user_idx'),
+        ),
+        # auth.User is not ours to add Meta indexes to, but login and signup
+        # look users up by email
+        migrations.RunSQL(
+            'CREATE INDEX basic_auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX basic_auth_user_email_idx',
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def link_existing_forks(apps, schema_editor):
+    """
+    Forks made so far got no chapters at all; let them share their
+    original's current ones.
+    """
+    Book = apps.get_model('basic', 'Book')
+    Chapter = apps.get_model('basic', 'Chapter')
+    Fork = apps.get_model('basic', 'Fork')
+
+    original = Fork.objects.filter(forked_book=OuterRef('pk')).values('original_book')[:1]
+    Book.objects.filter(id__in=Fork.objects.values('forked_book')).update(forked_from=Subquery(original))
+    last_chapter = (
+        Chapter.objects.filter(book=OuterRef('forked_from')).order_by()
+        .values('book').annotate(last=Max('id')).values('last')
+    )
+    Book.objects.filter(forked_from__isnull=False).update(
+        forked_through_chapter=Coalesce(Subquery(last_chapter), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic', '0015_book_cover_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='forked_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='basic.book'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='forked_through_chapter',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='source_chapter',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='basic.chapter'),
+        ),
+        migrations.RunPython(link_existing_forks, migrations.RunPython.noop),
+    ]
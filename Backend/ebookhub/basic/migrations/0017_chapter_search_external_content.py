@@ -0,0 +1,53 @@
+from django.db import migrations
+
+from basic.fields import decompress_text
+
+# Same definitions as basic.search, as of this migration
+OLD_CHAPTER_TABLE = (
+    "CREATE VIRTUAL TABLE basic_chapter_fts USING fts5("
+    "chapter_title, content, book, tokenize='unicode61 remove_diacritics 2')"
+)
+CREATE_STATEMENTS = [
+    "CREATE VIEW IF NOT EXISTS basic_chapter_fts_source AS SELECT id, chapter_title, "
+    "ebookhub_decompress(content) AS content, 'b' || book_id AS book FROM basic_chapter",
+    "CREATE VIRTUAL TABLE basic_chapter_fts USING fts5("
+    "chapter_title, content, book, content='basic_chapter_fts_source', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+]
+
+
+def external_content_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    connection.ensure_connection()
+    connection.connection.create_function('ebookhub_decompress', 1, decompress_text, deterministic=True)
+    schema_editor.execute("DROP TABLE IF EXISTS basic_chapter_fts")
+    for statement in CREATE_STATEMENTS:
+        schema_editor.execute(statement)
+    schema_editor.execute("INSERT INTO basic_chapter_fts (basic_chapter_fts) VALUES ('rebuild')")
+
+
+def stored_content_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS basic_chapter_fts")
+    schema_editor.execute("DROP VIEW IF EXISTS basic_chapter_fts_source")
+    schema_editor.execute(OLD_CHAPTER_TABLE)
+
+
+class Migration(migrations.Migration):
+    """
+    Stops the chapter search table from keeping its own uncompressed copy
+    of every chapter: it becomes an external-content table over a view that
+    decompresses basic_chapter.content, and is rebuilt from it. Going back
+    leaves the old table empty; run `manage.py rebuild_search_index` then.
+    """
+
+    dependencies = [
+        ('basic', '0016_book_forked_from_chapter_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(external_content_index, stored_content_index),
+    ]
@@ -4,6 +4,10 @@ from django.conf import settings
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 import os
+from operator import attrgetter
+
+from .covers import delete_cover_variants
+from .fields import CompressedTextField
 
 class Genre(models.Model):
     name = models.CharField(max_length=100)
@@ -39,6 +43,29 @@ class Profile(models.Model):
 
 
 
+class ReadingChapters:
+    """
+    `book.reading_chapters`: the chapters a reader sees, forks included
+    (`basic.forks.chapters_of`). Prefetchable with a `Prefetch` that sets
+    `to_attr`; a sliced queryset keeps that many chapters per book, e.g.
+    `Prefetch('reading_chapters', Chapter.objects.all()[:5], to_attr='first_chapters')`.
+    """
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        from .forks import chapters_of
+        return chapters_of(instance)
+
+    def get_prefetch_querysets(self, instances, querysets=None):
+        from .forks import first_chapters_of
+        limit = querysets[0].query.high_mark if querysets else None
+        return (
+            first_chapters_of(instances, limit),
+            attrgetter('reading_book_id'), attrgetter('id'), False, 'reading_chapters', False,
+        )
+
+
 class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.ForeignKey('Author', on_delete=models.SET_NULL, null=True, blank=True)
@@ -46,6 +73,7 @@ class Book(models.Model):
     description = models.TextField(blank=True, null=True)
     genre = models.ManyToManyField('Genre', blank=True)
     cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)  # Resized covers, see basic.covers
     date_published = models.DateField()
     format = models.ForeignKey('SupportedFormat', on_delete=models.CASCADE)
     can_fork = models.BooleanField(default=False)
@@ -53,11 +81,36 @@ class Book(models.Model):
     rating = models.DecimalField(max_digits=3, decimal_places=1, null=True, blank=True)
     file = models.FileField(upload_to='epub_books/', blank=True, null=True)
     is_forked = models.BooleanField(default=False)
-
+    # A fork shares its original's chapters with ids up to forked_through_chapter, see basic.forks
+    forked_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    forked_through_chapter = models.PositiveIntegerField(default=0, editable=False)
+
+    # Denormalized interaction counters, maintained by the readers write
+    # paths and repaired by `manage.py reconcile_counters`
+    love_count = models.PositiveIntegerField(default=0)
+    bookmark_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # Running rating aggregates: `rating` is rating_sum / rating_count and
+    # rating_<n>_count is the number of ratings that round to n stars
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    reading_chapters = ReadingChapters()
 
     def __str__(self):
         return self.title
 
+    @property
+    def rating_histogram(self):
+        """Number of ratings per star, e.g. {'1': 0, '2': 3, ..., '5': 10}."""
+        return {str(star): getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
     def cover_image_url(self):
         """Returns the full URL for the cover image."""
         if self.cover_image:
@@ -66,8 +119,13 @@ class Book(models.Model):
     
 @receiver(post_delete, sender=Book)
 def delete_book_files(sender, instance, **kwargs):
-    """Deletes the associated files (cover image and book file) when a Book is deleted."""
-    if instance.cover_image:
+    """
+    Deletes the associated files (cover image, its resized variants and book
+    file) when a Book is deleted. A cover still used by another book (a
+    fork shares its original's) is kept.
+    """
+    delete_cover_variants(instance.cover_variants)
+    if instance.cover_image and not Book.objects.filter(cover_image=instance.cover_image.name).exists():
         instance.cover_image.delete(save=False)  # Deletes the cover image file
     if instance.file:
         instance.file.delete(save=False)  # Deletes the book file
@@ -76,13 +134,20 @@ def delete_book_files(sender, instance, **kwargs):
 class Chapter(models.Model):
     book = models.ForeignKey(Book, related_name='chapters', on_delete=models.CASCADE)
     chapter_title = models.CharField(max_length=200)
-    content = models.TextField()  
+    content = CompressedTextField(length_field='content_length')  # Stored zlib-compressed
+    content_length = models.PositiveIntegerField(default=0)  # Characters in content, kept in sync on save
     chapter_number = models.PositiveIntegerField()
     date_published = models.DateField(auto_now_add=True)
+    # On a fork's own row: the original's chapter it replaces, see basic.forks
+    source_chapter = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     
 
     class Meta:
         ordering = ['chapter_number']
+        indexes = [
+            # Reading order within a book (TOC, first chapters, prev/next)
+            models.Index(fields=['book', 'chapter_number'], name='chapter_book_number_idx'),
+        ]
 
     def __str__(self):
         return f"{self.book.title} - Chapter {self.chapter_number}: {self.chapter_title}"
@@ -94,6 +159,14 @@ class Fork(models.Model):
     forked_book = models.ForeignKey(Book, related_name='original', on_delete=models.CASCADE)
     date_forked = models.DateField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # A user's forks, answered from the index alone
+            models.Index(fields=['forked_by', 'forked_book'], name='fork_user_book_idx'),
+            # "Has this user already forked this book?"
+            models.Index(fields=['original_book', 'forked_by'], name='fork_original_user_idx'),
+        ]
+
     def __str__(self):
         return f"Fork of {self.original_book.title} by {self.forked_by.username}"
     
@@ -0,0 +1,226 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a stable (sort key, id) ordering.
+
+    Every page is a `WHERE (key, id) > (last key, last id) ... LIMIT n`
+    lookup, so it costs the same on page 1000 as on page 1 and never runs
+    `COUNT(*)` unless the client asks for `?with_count=true`, in which case
+    an approximate, cached total is returned.
+
+    The last entry of `ordering` must be unique (normally `id` or `-id`).
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    count_cache_timeout = 60
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page, reverse, position = self._page_queryset(queryset, request)
+        if self._wants_count(request):
+            self.count = approximate_count(queryset, self.count_cache_timeout)
+        return self._finish_page(list(page), reverse, position)
+
+    async def apaginate_queryset(self, queryset, request):
+        """`paginate_queryset` for async views, on a plain Django request."""
+        page, reverse, position = self._page_queryset(queryset, request)
+        if self._wants_count(request):
+            self.count = await sync_to_async(approximate_count)(queryset, self.count_cache_timeout)
+        return self._finish_page([obj async for obj in page], reverse, position)
+
+    def _page_queryset(self, queryset, request):
+        """The query for one page plus one row, and the cursor it continues from."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+
+        reverse, position = self.decode_cursor(request)
+        if position is not None:
+            position = self.parse_position(queryset.model, position)
+        ordering = [self._flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+        return queryset[:self.page_size + 1], reverse, position
+
+    def _wants_count(self, request):
+        return bool(self.count_query_param) and _params(request).get(self.count_query_param, '').lower() in ('1', 'true')
+
+    def _finish_page(self, results, reverse, position):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.first_position = self._position(results[0]) if results else None
+        self.last_position = self._position(results[-1]) if results else None
+        if not results:
+            self.has_next = self.has_previous = False
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(_params(request)[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(False, self.last_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(True, self.first_position))
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_payload(data))
+
+    def get_paginated_payload(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['results'] = data
+        return payload
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Approximate, only with ?with_count=true'},
+                'results': schema,
+            },
+        }
+
+    # Cursor encoding -------------------------------------------------------
+
+    def encode_cursor(self, reverse, position):
+        raw = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = _params(request).get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            cursor = json.loads(raw)
+            position = cursor['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            return bool(cursor['r']), position
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_position(self, model, position):
+        """Converts every value of a decoded position with its ordering field's `to_python`."""
+        values = []
+        try:
+            for field, value in zip(self.ordering, position):
+                values.append(_ordering_field(model, field).to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    # Keyset helpers --------------------------------------------------------
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def _position(self, obj):
+        position = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            position.append(_to_json(value))
+        return position
+
+    @staticmethod
+    def _after(ordering, position):
+        """
+        Builds `(a, b, id) > (x, y, z)` as
+        `a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)`,
+        honouring the direction of every field.
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+
+def _ordering_field(model, field):
+    """The model field an ordering entry such as '-author__name' sorts on."""
+    *relations, name = field.lstrip('-').split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _params(request):
+    """Query parameters of a DRF request or of a plain Django one (async views)."""
+    return getattr(request, 'query_params', request.GET)
+
+
+def _to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def approximate_count(queryset, timeout=60):
+    """
+    Counts a queryset at most once per `timeout` seconds. The total can be
+    slightly stale, which is fine for "about N results" in the UI.
+    """
+    key = 'approx-count:' + hashlib.md5(str(queryset.order_by().query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, timeout)
+    return count
+
@@ -0,0 +1,395 @@
+"""
+Full-text search over books and chapter content, backed by SQLite FTS5.
+
+Two FTS5 tables are kept next to the regular ones:
+
+- `basic_book_fts` with one row per book (rowid = book id): title,
+  description and author name.
+- `basic_chapter_fts` with one row per chapter (rowid = chapter id): title,
+  content and a `book` key (`b<book id>`), which lets a search be limited
+  to one book inside the MATCH expression.
+
+The chapter table only holds the index, not a second, uncompressed copy of
+every chapter. It is an external-content table over the
+`basic_chapter_fts_source` view, which decompresses `basic_chapter.content`
+with the `ebookhub_decompress` SQL function that `install_functions` puts
+on every SQLite connection. FTS5 reads that view only to remove a chapter
+from the index, so a chapter is unindexed before its row changes or goes
+away. Searches never read it: snippets are cut from the decompressed
+content of the matching chapters only, in Python, and HTML-escaped.
+
+Both are updated from model signals (see `basic.signals`). Bulk writes
+that skip signals call `index_book_chapters`. `manage.py
+rebuild_search_index` rebuilds everything. On other database backends
+indexing is a no-op and searches return nothing.
+"""
+import html
+import re
+import unicodedata
+from collections import deque
+
+from django.db import connection
+
+from .fields import decompress_text
+from .models import Book, Chapter
+
+BOOK_TABLE = 'basic_book_fts'
+CHAPTER_TABLE = 'basic_chapter_fts'
+CHAPTER_SOURCE = 'basic_chapter_fts_source'
+# One row per indexed chapter, kept by FTS5 itself
+CHAPTER_DOCSIZE = f'{CHAPTER_TABLE}_docsize'
+DECOMPRESS_FUNCTION = 'ebookhub_decompress'
+
+# bm25 column weights: a hit in a title counts more than one in a description
+BOOK_WEIGHTS = (10.0, 2.0, 5.0)  # title, description, author
+CHAPTER_WEIGHTS = (4.0, 1.0, 0.0)  # chapter_title, content, book
+# Chapter hits are scored lower than hits on the book itself
+CHAPTER_SCORE_FACTOR = 0.5
+
+SNIPPET_TOKENS = 16
+
+CREATE_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {BOOK_TABLE} USING fts5("
+    "title, description, author, tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE VIEW IF NOT EXISTS {CHAPTER_SOURCE} AS SELECT id, chapter_title, "
+    f"{DECOMPRESS_FUNCTION}(content) AS content, 'b' || book_id AS book FROM basic_chapter",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {CHAPTER_TABLE} USING fts5("
+    f"chapter_title, content, book, content='{CHAPTER_SOURCE}', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+]
+DROP_STATEMENTS = [
+    f"DROP TABLE IF EXISTS {BOOK_TABLE}",
+    f"DROP TABLE IF EXISTS {CHAPTER_TABLE}",
+    f"DROP VIEW IF EXISTS {CHAPTER_SOURCE}",
+]
+
+# Marks put around the matched words of a snippet
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+ELLIPSIS = '…'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_enabled(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install_functions(sqlite_connection):
+    """Adds the SQL functions the search tables need to a raw sqlite3 connection."""
+    sqlite_connection.create_function(DECOMPRESS_FUNCTION, 1, decompress_text, deterministic=True)
+
+
+def build_match(query):
+    """
+    Turns free text into a safe FTS5 expression: every word must match and
+    the last one may be a prefix ("pride and prej" finds "prejudice").
+    Returns None when the text has no words.
+    """
+    words = WORD_RE.findall(query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def book_key(book_id):
+    return f'b{book_id}'
+
+
+# Indexing ------------------------------------------------------------------
+
+def index_book(book):
+    if not search_enabled():
+        return
+    author = book.author.name if book.author_id else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {BOOK_TABLE} WHERE rowid = %s", [book.id])
+        cursor.execute(
+            f"INSERT INTO {BOOK_TABLE} (rowid, title, description, author) VALUES (%s, %s, %s, %s)",
+            [book.id, book.title, book.description or '', author],
+        )
+
+
+def unindex_book(book_id):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {BOOK_TABLE} WHERE rowid = %s", [book_id])
+
+
+def reindex_author(author):
+    """Updates the author name of every indexed book by `author`."""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {BOOK_TABLE} SET author = %s WHERE rowid IN (SELECT id FROM basic_book WHERE author_id = %s)",
+            [author.name, author.id],
+        )
+
+
+def index_chapter(chapter):
+    """Indexes a saved chapter; `unindex_chapter` must have run before its row changed."""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        _insert_chapters(cursor, [chapter])
+
+
+def unindex_chapter(chapter_id):
+    """
+    Removes a chapter from the index while its row still holds the indexed
+    text: FTS5 reads that text back to know which entries to remove.
+    """
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        # Removing a chapter that is not indexed would corrupt the index
+        cursor.execute(
+            f"DELETE FROM {CHAPTER_TABLE} WHERE rowid IN (SELECT id FROM {CHAPTER_DOCSIZE} WHERE id = %s)",
+            [chapter_id],
+        )
+
+
+def index_book_chapters(book_id, batch_size=200):
+    """(Re)indexes every chapter of a book, for writes that bypass signals."""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {CHAPTER_TABLE} WHERE rowid IN (SELECT id FROM {CHAPTER_DOCSIZE} WHERE id IN "
+            f"(SELECT id FROM {Chapter._meta.db_table} WHERE book_id = %s))",
+            [book_id],
+        )
+        chapters = Chapter.objects.filter(book_id=book_id).only('id', 'book_id', 'chapter_title', 'content')
+        _insert_chapters(cursor, chapters.iterator(chunk_size=batch_size))
+
+
+def index_new_books(books):
+    """Indexes books inserted with bulk_create, which skips the signals; authors must be loaded."""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {BOOK_TABLE} (rowid, title, description, author) VALUES (%s, %s, %s, %s)",
+            [
+                [book.id, book.title, book.description or '', book.author.name if book.author_id else '']
+                for book in books
+            ],
+        )
+
+
+def index_new_chapters(chapters):
+    """Indexes chapters inserted with bulk_create, without reading them back."""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        _insert_chapters(cursor, chapters)
+
+
+def _insert_chapters(cursor, chapters):
+    # Only the index is written: the text stays compressed in basic_chapter
+    cursor.executemany(
+        f"INSERT INTO {CHAPTER_TABLE} (rowid, chapter_title, content, book) VALUES (%s, %s, %s, %s)",
+        ([chapter.id, chapter.chapter_title, chapter.content, book_key(chapter.book_id)] for chapter in chapters),
+    )
+
+
+def rebuild_index(batch_size=500, progress=None):
+    """Drops and refills both tables. Returns (books, chapters) indexed."""
+    with connection.cursor() as cursor:
+        for statement in DROP_STATEMENTS + CREATE_STATEMENTS:
+            cursor.execute(statement)
+
+        books = Book.objects.select_related('author').only('id', 'title', 'description', 'author__name')
+        book_count = 0
+        for book in books.iterator(chunk_size=batch_size):
+            cursor.execute(
+                f"INSERT INTO {BOOK_TABLE} (rowid, title, description, author) VALUES (%s, %s, %s, %s)",
+                [book.id, book.title, book.description or '', book.author.name if book.author else ''],
+            )
+            book_count += 1
+
+        chapter_count = 0
+        last_id = 0
+        while True:
+            chapters = list(
+                Chapter.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'book_id', 'chapter_title', 'content')[:batch_size]
+            )
+            if not chapters:
+                break
+            _insert_chapters(cursor, chapters)
+            chapter_count += len(chapters)
+            last_id = chapters[-1].id
+            if progress:
+                progress(chapter_count)
+
+        cursor.execute(f"INSERT INTO {BOOK_TABLE} ({BOOK_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"INSERT INTO {CHAPTER_TABLE} ({CHAPTER_TABLE}) VALUES ('optimize')")
+    return book_count, chapter_count
+
+
+# Querying ------------------------------------------------------------------
+
+def _fold(word):
+    """A word as the tokenizer indexes it: case-folded, without diacritics."""
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def make_snippet(text, query, tokens=SNIPPET_TOKENS):
+    """
+    About `tokens` words of `text` around the first word matching `query`
+    (the last query word as a prefix, like `build_match`), HTML-escaped,
+    with the matches between HIGHLIGHT_START and HIGHLIGHT_END. A chapter
+    found by its title gets its first words.
+    """
+    words = [_fold(word) for word in WORD_RE.findall(query or '')]
+    exact, prefix = set(words[:-1]), words[-1] if words else None
+
+    def matches(word):
+        word = _fold(word)
+        return word in exact or prefix is not None and word.startswith(prefix)
+
+    # Scanning stops once the window after the first match is complete
+    lead = tokens // 4
+    before = deque(maxlen=lead)
+    head = []  # The first words, for when nothing matches
+    window = None
+    for found in WORD_RE.finditer(text or ''):
+        if window is not None:
+            window.append(found)
+        elif matches(found.group()):
+            window = [*before, found]
+        else:
+            before.append(found)
+            if len(head) <= tokens:
+                head.append(found)
+        if window is not None and len(window) > tokens:
+            break
+    if window is None:
+        window = head
+    if not window:
+        return ''
+    truncated_end = len(window) > tokens
+    window = window[:tokens]
+
+    # Punctuation before the first word and after the last one is kept
+    position = window[0].start()
+    parts = []
+    if WORD_RE.search(text, 0, position):
+        parts.append(ELLIPSIS)
+    else:
+        position = 0
+    for found in window:
+        parts.append(html.escape(text[position:found.start()]))
+        if matches(found.group()):
+            parts.append(f'{HIGHLIGHT_START}{html.escape(found.group())}{HIGHLIGHT_END}')
+        else:
+            parts.append(html.escape(found.group()))
+        position = found.end()
+    parts.append(ELLIPSIS if truncated_end else html.escape(text[position:]))
+    return ''.join(parts)
+
+
+def _snippets(chapter_ids, query):
+    """chapter id -> (chapter_title, snippet), decompressing only these chapters."""
+    chapters = Chapter.objects.filter(id__in=chapter_ids).only('id', 'chapter_title', 'content')
+    return {chapter.id: (chapter.chapter_title, make_snippet(chapter.content, query)) for chapter in chapters}
+
+
+def search_books(query, limit=20, snippets_per_book=3):
+    """
+    Returns up to `limit` (book id, score, snippets) tuples, best first.
+    Scores are bm25 values (lower is better). Each snippet is a dict with
+    chapter_id, chapter_title and a highlighted excerpt of the content.
+    """
+    match = build_match(query)
+    if not match or not search_enabled():
+        return []
+
+    scores = {}
+    matched_chapters = {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({BOOK_TABLE}, %s, %s, %s) AS score FROM {BOOK_TABLE} "
+            f"WHERE {BOOK_TABLE} MATCH %s ORDER BY score LIMIT %s",
+            [*BOOK_WEIGHTS, match, limit],
+        )
+        for book_id, score in cursor.fetchall():
+            scores[book_id] = score
+
+        # Look at more chapters than books: several can belong to one book.
+        # The book comes from basic_chapter: reading a column of the index
+        # would decompress the chapter through the source view.
+        chapter_table = Chapter._meta.db_table
+        cursor.execute(
+            f"SELECT {CHAPTER_TABLE}.rowid, {chapter_table}.book_id, "
+            f"bm25({CHAPTER_TABLE}, %s, %s, %s) AS score FROM {CHAPTER_TABLE} "
+            f"JOIN {chapter_table} ON {chapter_table}.id = {CHAPTER_TABLE}.rowid "
+            f"WHERE {CHAPTER_TABLE} MATCH %s ORDER BY score LIMIT %s",
+            [*CHAPTER_WEIGHTS, f'{{chapter_title content}}: ({match})', limit * 10],
+        )
+        for chapter_id, book_id, score in cursor.fetchall():
+            score *= CHAPTER_SCORE_FACTOR
+            scores[book_id] = min(scores.get(book_id, 0.0), score)
+            book_chapters = matched_chapters.setdefault(book_id, [])
+            if len(book_chapters) < snippets_per_book:
+                book_chapters.append(chapter_id)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1])[:limit]
+    snippets = _snippets(
+        [chapter_id for book_id, _ in ranked for chapter_id in matched_chapters.get(book_id, [])], query,
+    )
+    results = []
+    for book_id, score in ranked:
+        book_snippets = []
+        for chapter_id in matched_chapters.get(book_id, []):
+            if chapter_id in snippets:
+                chapter_title, snippet = snippets[chapter_id]
+                book_snippets.append({'chapter_id': chapter_id, 'chapter_title': chapter_title, 'snippet': snippet})
+        results.append((book_id, score, book_snippets))
+    return results
+
+
+def find_in_book(book, query, limit=50):
+    """
+    Returns the chapters of one book matching `query`, best first, as dicts
+    with chapter_id, chapter_title, snippet and score. A fork also finds
+    the chapters it shares with its original (see `basic.forks`).
+    """
+    match = build_match(query)
+    if not match or not search_enabled():
+        return []
+
+    chapter_table = Chapter._meta.db_table
+    books = book_key(book.id)
+    condition = ''
+    params = []
+    if book.forked_from_id:
+        # Shared rows are indexed under the original only
+        books = f'({books} OR {book_key(book.forked_from_id)})'
+        condition = (
+            f"AND ({chapter_table}.book_id = %s OR {CHAPTER_TABLE}.rowid <= %s AND {CHAPTER_TABLE}.rowid NOT IN "
+            f"(SELECT source_chapter_id FROM {chapter_table} WHERE book_id = %s AND source_chapter_id IS NOT NULL)) "
+        )
+        params = [book.id, book.forked_through_chapter, book.id]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {CHAPTER_TABLE}.rowid, bm25({CHAPTER_TABLE}, %s, %s, %s) AS score FROM {CHAPTER_TABLE} "
+            f"JOIN {chapter_table} ON {chapter_table}.id = {CHAPTER_TABLE}.rowid "
+            f"WHERE {CHAPTER_TABLE} MATCH %s {condition}ORDER BY score LIMIT %s",
+            [*CHAPTER_WEIGHTS, f'book: {books} AND {{chapter_title content}}: ({match})', *params, limit],
+        )
+        rows = cursor.fetchall()
+
+    snippets = _snippets([chapter_id for chapter_id, _ in rows], query)
+    return [
+        {'chapter_id': chapter_id, 'chapter_title': snippets[chapter_id][0], 'snippet': snippets[chapter_id][1],
+         'score': score}
+        for chapter_id, score in rows if chapter_id in snippets
+    ]
@@ -1,39 +1,189 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Prefetch
+from django.urls import reverse
+from basic.covers import cover_variant_urls
+from basic.forks import chapters_of
 from basic.models import Book, Chapter, Author, Genre
 from readers.models import Bookmark, Comment, CommentLike, Love, Rating
 from django.contrib.auth.models import User
 
 
-class ChapterTitleSerializer(serializers.ModelSerializer):
+def _split_paths(names):
+    """{'id', 'book.title', 'book.author.name'} -> ({'id', 'book'}, {'book': {'title', 'author.name'}})"""
+    top, nested = set(), {}
+    for name in names:
+        head, _, rest = name.partition('.')
+        top.add(head)
+        if rest:
+            nested.setdefault(head, set()).add(rest)
+    return top, nested
+
+
+def _parse_names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets and opt-in expansion of nested relations.
+
+    `?fields=id,title,book.title` limits the output to these fields (a
+    dotted name reaches into a nested relation and implies expanding it),
+    `?expand=book,book.author` renders these relations nested. As soon as
+    either parameter is given, relations that are not expanded are rendered
+    as their primary key, while to-many relations and the method fields in
+    `expandable_method_fields` are left out, so none of them is queried.
+    Without either parameter the output is unchanged.
+
+    The outermost serializer reads the parameters from
+    `context['query_params']`; nested ones get theirs as the `fields` and
+    `expand` arguments. `shape_queryset` adds exactly the joins and
+    prefetches the selected fields need.
+    """
+    expandable_method_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        self._requested_fields = fields
+        self._requested_expand = expand
+        self._top_fields = None
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def shape_queryset(cls, queryset, query_params=None, prefix=''):
+        """
+        Adds the select_related/prefetch_related calls needed to render
+        `queryset` (or, with `prefix`, the relation it reaches) with the
+        fieldsets in `query_params`.
+        """
+        return cls(context={'query_params': query_params}).eager_loading(queryset, prefix)
+
+    def _fieldsets(self):
+        if self._requested_fields is not None or self._requested_expand is not None:
+            return self._requested_fields, self._requested_expand
+        root = self.root
+        if root is not self and getattr(root, 'child', None) is not self:
+            return None, None  # Nested in a parent rendering everything
+        params = self.context.get('query_params') or {}
+        fields = _parse_names(params['fields']) if 'fields' in params else None
+        expand = _parse_names(params['expand']) if 'expand' in params else None
+        return fields, expand
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = self._fieldsets()
+        if requested is None and expand is None:
+            return fields
+
+        top_fields, nested_fields = _split_paths(requested) if requested is not None else (None, {})
+        top_expand, nested_expand = _split_paths(expand or ())
+        top_expand |= set(nested_fields)
+        self._top_fields = top_fields
+
+        for name, field in list(fields.items()):
+            if top_fields is not None and name not in top_fields:
+                del fields[name]
+            elif isinstance(field, serializers.BaseSerializer):
+                if name in top_expand:
+                    fields[name] = self._expanded(field, nested_fields.get(name), nested_expand.get(name, set()))
+                elif isinstance(field, serializers.ListSerializer):
+                    del fields[name]
+                else:
+                    source = field._kwargs.get('source', name)
+                    kwargs = {'source': source} if source != name else {}
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, **kwargs)
+            elif name in self.expandable_method_fields and name not in top_expand:
+                del fields[name]
+        return fields
+
+    @staticmethod
+    def _expanded(field, fields, expand):
+        """A fresh copy of a nested serializer field with its own fieldsets."""
+        many = isinstance(field, serializers.ListSerializer)
+        serializer = field.child if many else field
+        if not isinstance(serializer, DynamicFieldsMixin):
+            return field
+        kwargs = {**serializer._kwargs, 'fields': fields, 'expand': expand}
+        if many:
+            kwargs['many'] = True
+        return type(serializer)(*serializer._args, **kwargs)
+
+    def wants_field(self, name):
+        """Whether `name` was asked for (always, unless ?fields= narrows the output)."""
+        self.fields  # Resolves the fieldsets
+        return self._top_fields is None or name in self._top_fields
+
+    def eager_loading(self, queryset, prefix='', prefetch=False):
+        """
+        Adds what the current fields need to `queryset`: joins for to-one
+        relations, prefetches for to-many ones and for everything below them.
+        """
+        for field in self.fields.values():
+            if field.source == '*':
+                continue
+            path = prefix + '__'.join(field.source_attrs)
+            if isinstance(field, serializers.ListSerializer):
+                queryset = queryset.prefetch_related(path)
+                if isinstance(field.child, DynamicFieldsMixin):
+                    queryset = field.child.eager_loading(queryset, f'{path}__', prefetch=True)
+            elif isinstance(field, serializers.BaseSerializer):
+                queryset = queryset.prefetch_related(path) if prefetch else queryset.select_related(path)
+                if isinstance(field, DynamicFieldsMixin):
+                    queryset = field.eager_loading(queryset, f'{path}__', prefetch)
+            elif isinstance(field, serializers.ManyRelatedField):
+                queryset = queryset.prefetch_related(path)
+            elif isinstance(field, serializers.RelatedField) and not field.use_pk_only_optimization():
+                queryset = queryset.prefetch_related(path) if prefetch else queryset.select_related(path)
+        return self.extra_eager_loading(queryset, prefix)
+
+    def extra_eager_loading(self, queryset, prefix):
+        """Hook for the queries of method fields; `prefix` leads to this serializer's model."""
+        return queryset
+
+
+class ChapterTitleSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Chapter
         fields = ['id', 'chapter_title']
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class ChapterTOCSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    length = serializers.IntegerField(source='content_length', read_only=True)
+
+    class Meta:
+        model = Chapter
+        fields = ['id', 'chapter_number', 'chapter_title', 'length']
+
+
+class AuthorSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = ['id', 'name', 'bio']  # You can customize fields as needed
 
 # todo - edit this serialier to paginated books with the given genres
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = ['id', 'name']
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     cover_image_url = serializers.SerializerMethodField()
+    cover_images = serializers.SerializerMethodField()  # Resized covers by size name, see basic.covers
     chapters = serializers.SerializerMethodField()
     author = AuthorSerializer()  # Nested AuthorSerializer to include the author details of the book
     genre = GenreSerializer(many=True)  # Nested GenreSerializer to include related genres
+    expandable_method_fields = ('chapters',)
 
     class Meta:
         model = Book
         fields = [
             'id', 'title', 'author', 'publisher', 'description', 'genre',
-            'cover_image_url', 'date_published', 'can_fork', 'rating', 'file', 'chapters'
+            'cover_image_url', 'cover_images', 'date_published', 'can_fork', 'rating', 'file', 'chapters',
+            'love_count', 'bookmark_count', 'rating_count', 'comment_count'
         ]
+        read_only_fields = ['love_count', 'bookmark_count', 'rating_count', 'comment_count']
 
     def get_cover_image_url(self, obj):
         request = self.context.get('request')
@@ -42,7 +192,39 @@ class BookSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(cover_image_url)
         return cover_image_url
 
-    def get_chapters(self, obj):
+    def get_cover_images(self, obj):
+        return cover_variant_urls(obj, self.context.get('request'))
+
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        """
+        Loads everything the serializer touches in a fixed number of queries:
+        the author through a join, genres in one query and the first five
+        chapter titles of every book, forks included, in one windowed query.
+        `prefix` lets serializers that nest a book (e.g. `book__`) reuse this.
+        """
+        return queryset.select_related(f'{prefix}author').prefetch_related(
+            f'{prefix}genre', BookSerializer.first_chapters_prefetch(prefix),
+        )
+
+    @staticmethod
+    def first_chapters_prefetch(prefix=''):
+        # Book.reading_chapters also covers the chapters a fork shares
+        return Prefetch(f'{prefix}reading_chapters', queryset=Chapter.objects.all()[:5], to_attr='first_chapters')
+
+    def extra_eager_loading(self, queryset, prefix):
+        if 'chapters' in self.fields:
+            queryset = queryset.prefetch_related(self.first_chapters_prefetch(prefix))
+        return queryset
+
+    def _reverse_chapters(self):
+        """
+        Resolves the chapter order once per request and caches it in the
+        context shared by every book of the page.
+        """
+        if '_reverse_chapters' in self.context:
+            return self.context['_reverse_chapters']
+
         # Get the default reverse setting from the user's profile
         reverse_from_profile = False
         request = self.context.get('request')
@@ -53,31 +235,57 @@ class BookSerializer(serializers.ModelSerializer):
             if profile:
                 reverse_from_profile = profile.reversed_chapter_order
 
-        # Get the 'reverse' argument from the request
-        request_reverse = self.context.get('reverse', None)
-
         # If 'reverse' is True in the request, flip the profile's setting
-        if request_reverse:
-            reverse = not reverse_from_profile
-        else:
-            reverse = reverse_from_profile
-
-        # Retrieve the chapters, ordered based on the final 'reverse' value
-        chapters = obj.chapters.all()[:5]
-        if reverse:
+        reverse = not reverse_from_profile if self.context.get('reverse', None) else reverse_from_profile
+        self.context['_reverse_chapters'] = reverse
+        return reverse
+
+    def get_chapters(self, obj):
+        # Prefetched by setup_eager_loading. A lone book may query; in a list
+        # that would be a query per book, which DEBUG reports
+        chapters = getattr(obj, 'first_chapters', None)
+        if chapters is None:
+            if settings.DEBUG and isinstance(self.root, serializers.ListSerializer):
+                raise ImproperlyConfigured(
+                    "BookSerializer's chapters were not prefetched; load the books "
+                    "with setup_eager_loading() or shape_queryset()."
+                )
+            chapters = obj.reading_chapters.only('id', 'chapter_title', 'chapter_number')[:5]
+        if self._reverse_chapters():
             chapters = chapters[::-1]  # Reverse the chapter list if needed
 
         return ChapterTitleSerializer(chapters, many=True).data 
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Per-user flags, resolved for the whole page by readers.interactions
+        interactions = self.context.get('interactions')
+        if interactions is not None:
+            data.update(
+                (name, value) for name, value in interactions.for_book(instance.id).items()
+                if self.wants_field(name)
+            )
+        return data
 
 
-class BookDetailSerializer(serializers.ModelSerializer):
+
+# Comments embedded in the book detail, newest first; `comment_count` has the total
+DETAIL_COMMENT_COUNT = 3
+
+# Fields of the book detail that depend on who is reading
+BOOK_DETAIL_USER_FIELDS = ('is_loved', 'is_bookmarked', 'user_rating')
+
+
+class BookDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     cover_image_url = serializers.SerializerMethodField()
+    cover_images = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()  # Range/ETag aware, unlike the raw `file` URL
     chapters = ChapterTitleSerializer(many=True)
     genreNames = serializers.SerializerMethodField()  # Add this field to return genre names
     is_loved = serializers.SerializerMethodField()
     is_bookmarked = serializers.SerializerMethodField()
     user_rating = serializers.SerializerMethodField()
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     comments = serializers.SerializerMethodField()
     author = AuthorSerializer()  # Nested AuthorSerializer for detailed author info
     genre = GenreSerializer(many=True)  # Nested GenreSerializer to return only related genres
@@ -86,9 +294,11 @@ class BookDetailSerializer(serializers.ModelSerializer):
         model = Book
         fields = [
             'id', 'title', 'author', 'publisher', 'description', 'genreNames',
-            'cover_image_url', 'date_published', 'can_fork', 'rating', 'file', 'chapters',
-            'is_loved', 'is_bookmarked', 'user_rating', 'comments', 'genre'
+            'cover_image_url', 'cover_images', 'date_published', 'can_fork', 'rating', 'file', 'download_url', 'chapters',
+            'is_loved', 'is_bookmarked', 'user_rating', 'comments', 'genre',
+            'love_count', 'bookmark_count', 'rating_count', 'comment_count', 'rating_histogram'
         ]
+        read_only_fields = ['love_count', 'bookmark_count', 'rating_count', 'comment_count']
 
     def get_cover_image_url(self, obj):
         request = self.context.get('request')
@@ -97,6 +307,24 @@ class BookDetailSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(cover_image_url)
         return cover_image_url
 
+    def get_cover_images(self, obj):
+        return cover_variant_urls(obj, self.context.get('request'))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.forked_from_id and 'chapters' in data:
+            # The prefetched relation only holds the fork's own rows
+            shared = chapters_of(instance).only('id', 'chapter_title', 'chapter_number')
+            data['chapters'] = self.fields['chapters'].to_representation(shared)
+        return data
+
+    def get_download_url(self, obj):
+        if not obj.file:
+            return None
+        url = reverse('book-download', args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def get_genreNames(self, obj):
         return [genre.name for genre in obj.genre.all()]
 
@@ -114,16 +342,27 @@ class BookDetailSerializer(serializers.ModelSerializer):
         return rating.rating if rating else None
 
     def get_comments(self, obj):
-        return Comment.objects.filter(book=obj).values('user__username', 'content', 'created_at')
+        # Only the newest few; the full stream is paginated by readers' CommentList
+        comments = Comment.objects.filter(book=obj).order_by('-created_at', '-id')
+        return list(comments.values('id', 'user__username', 'content', 'created_at')[:DETAIL_COMMENT_COUNT])
+
+
+class SharedBookDetailSerializer(BookDetailSerializer):
+    """
+    The part of the book detail that is the same for every reader, which
+    `readers.caching` caches per book version.
+    """
+    class Meta(BookDetailSerializer.Meta):
+        fields = [field for field in BookDetailSerializer.Meta.fields if field not in BOOK_DETAIL_USER_FIELDS]
 
 
-class ChapterSerializer(serializers.ModelSerializer):
+class ChapterSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Chapter
         fields = ['id', 'chapter_title', 'content']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'  
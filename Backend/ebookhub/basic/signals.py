@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import search
+from .forks import detach_from_forks
+from .models import Author, Book, Chapter
+from .toc import invalidate_book_toc
+
+
+@receiver([post_save, post_delete], sender=Chapter)
+def invalidate_toc_on_chapter_change(sender, instance, **kwargs):
+    """Drops the cached table of contents when one of its chapters changes."""
+    invalidate_book_toc(instance.book_id)
+
+
+@receiver(pre_save, sender=Chapter)
+def copy_chapter_before_edit(sender, instance, raw=False, **kwargs):
+    """Forks sharing the chapter keep the version they were forked with."""
+    if not raw and not instance._state.adding:
+        detach_from_forks(instance)
+
+
+@receiver(pre_delete, sender=Chapter)
+def copy_chapter_before_delete(sender, instance, **kwargs):
+    """Also runs for every chapter of a deleted book, so its forks keep their text."""
+    detach_from_forks(instance, keep_source=False)
+
+
+@receiver(pre_save, sender=Chapter)
+def unindex_chapter_before_edit(sender, instance, **kwargs):
+    """The index is cleared from the stored text, so this runs before the row changes."""
+    if not instance._state.adding:
+        search.unindex_chapter(instance.pk)
+
+
+@receiver(post_save, sender=Chapter)
+def index_saved_chapter(sender, instance, **kwargs):
+    search.index_chapter(instance)
+
+
+@receiver(pre_delete, sender=Chapter)
+def unindex_chapter_before_delete(sender, instance, **kwargs):
+    search.unindex_chapter(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, **kwargs):
+    search.index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.unindex_book(instance.id)
+
+
+@receiver(post_save, sender=Author)
+def reindex_author_books(sender, instance, created, **kwargs):
+    if not created:
+        search.reindex_author(instance)
+
+
+@receiver(connection_created)
+def install_search_functions(sender, connection, **kwargs):
+    """The chapter search index reads chapter text through SQL functions, see basic.search."""
+    if connection.vendor == 'sqlite':
+        search.install_functions(connection.connection)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Applies settings.SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(settings.SQLITE_PRAGMAS)
+    if connection.alias in settings.DATABASE_REPLICAS:
+        # Replica files are written by sync_sqlite_replicas only
+        pragmas.pop('journal_mode', None)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
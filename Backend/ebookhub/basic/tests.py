@@ -1,3 +1,470 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import random
+import zipfile
+from datetime import date
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from readers.models import Love, ReadingProgress
+from writers.epub import document_paths, package_metadata
+from . import search
+from .fields import MIN_COMPRESS_SIZE, compress_text, decompress_text
+from .forks import chapters_of, find_chapter, first_chapters_of, fork_book, save_chapter
+from .benchmarking import route_names, seed_catalog, seed_interactions
+from .management.commands import check_query_plans, loadtest
+from .models import Author, Book, Chapter, Genre, SupportedFormat
+from .serializers import BookSerializer
+from .toc import get_book_toc, toc_cache_key
+
+
+def make_book(publisher, **fields):
+    book_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+    return Book.objects.create(
+        title=fields.pop('title', 'A book'), publisher=publisher, date_published=date(2024, 1, 1),
+        format=book_format, **fields,
+    )
+
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode().rstrip('=')
+
+
+class CompressedContentTests(TestCase):
+    text = 'Call me Ishmael. Some years ago, never mind how long precisely… ' * 20
+
+    def setUp(self):
+        self.book = make_book(User.objects.create_user('publisher'))
+
+    def stored(self, chapter):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT content FROM {Chapter._meta.db_table} WHERE id = %s', [chapter.id])
+            return cursor.fetchone()[0]
+
+    def test_round_trip(self):
+        for text in ('', 'Short', self.text):
+            with self.subTest(length=len(text)):
+                self.assertEqual(decompress_text(compress_text(text)), text)
+        self.assertTrue(compress_text('x' * MIN_COMPRESS_SIZE).startswith(b'z'))
+        self.assertTrue(compress_text('Short').startswith(b'u'))
+
+    def test_stored_compressed_and_read_lazily(self):
+        chapter = Chapter.objects.create(book=self.book, chapter_title='One', content=self.text, chapter_number=1)
+        stored = self.stored(chapter)
+        self.assertIsInstance(stored, bytes)
+        self.assertLess(len(stored), len(self.text.encode()) // 4)
+
+        loaded = Chapter.objects.get(id=chapter.id)
+        self.assertIsInstance(loaded.__dict__['content'], bytes)  # Not decompressed until read
+        self.assertEqual(loaded.content, self.text)
+        loaded.chapter_title = 'First'
+        loaded.save()
+        self.assertEqual(self.stored(chapter), stored)
+
+    def test_content_length_follows_the_text(self):
+        chapter = Chapter.objects.create(book=self.book, chapter_title='One', content=self.text, chapter_number=1)
+        self.assertEqual(chapter.content_length, len(self.text))
+        chapter.content = 'Shorter'
+        chapter.save()
+        chapter.refresh_from_db()
+        self.assertEqual((chapter.content, chapter.content_length), ('Shorter', 7))
+
+        [bulk] = Chapter.objects.bulk_create([
+            Chapter(book=self.book, chapter_title='Two', content=self.text, chapter_number=2),
+        ])
+        self.assertEqual(Chapter.objects.get(id=bulk.id).content_length, len(self.text))
+
+    def test_compress_chapters_rewrites_legacy_rows(self):
+        chapter = Chapter.objects.create(book=self.book, chapter_title='One', content=self.text, chapter_number=1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Chapter._meta.db_table} SET content = %s, content_length = 0 WHERE id = %s',
+                [self.text, chapter.id],
+            )
+        self.assertEqual(Chapter.objects.get(id=chapter.id).content, self.text)  # Still readable
+
+        out = StringIO()
+        call_command('compress_chapters', dry_run=True, stdout=out)
+        self.assertIn('Would compress 1 chapters', out.getvalue())
+        self.assertIsInstance(self.stored(chapter), str)
+
+        out = StringIO()
+        call_command('compress_chapters', stdout=out)
+        self.assertIn('Compressed 1 chapters', out.getvalue())
+        self.assertIsInstance(self.stored(chapter), bytes)
+        chapter.refresh_from_db()
+        self.assertEqual((chapter.content, chapter.content_length), (self.text, len(self.text)))
+
+        out = StringIO()
+        call_command('compress_chapters', stdout=out)
+        self.assertIn('Nothing to compress.', out.getvalue())
+
+
+class FieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('reader')
+        author = Author.objects.create(name='Herman Melville', bio='Sailor')
+        cls.book = make_book(User.objects.create_user('publisher'), title='Moby Dick', author=author)
+        Chapter.objects.create(book=cls.book, chapter_title='Loomings', content='Text', chapter_number=1)
+
+    def get(self, name, args=(), **params):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        return client.get(reverse(name, args=args), params).json()
+
+    def test_full_representation_by_default(self):
+        [book] = self.get('book-list')['results']
+        self.assertEqual(book['author'], {'id': self.book.author.id, 'name': 'Herman Melville', 'bio': 'Sailor'})
+        self.assertEqual([chapter['chapter_title'] for chapter in book['chapters']], ['Loomings'])
+
+    def test_fields_narrow_the_output_and_the_queries(self):
+        # Only the book query: no author join, genres or chapters
+        with self.assertNumQueries(1):
+            self.client.get(reverse('book-list'), {'fields': 'id,title'})
+        [book] = self.get('book-list', fields='id,title')['results']
+        self.assertEqual(book, {'id': self.book.id, 'title': 'Moby Dick'})
+
+    def test_unexpanded_relations_are_primary_keys(self):
+        [book] = self.get('book-list', fields='id,author,genre,chapters')['results']
+        self.assertEqual(book, {'id': self.book.id, 'author': self.book.author.id})
+
+    def test_expand_and_dotted_fields(self):
+        [book] = self.get('book-list', expand='author,chapters', fields='id,author.name,chapters')['results']
+        self.assertEqual(book['author'], {'name': 'Herman Melville'})
+        self.assertEqual(len(book['chapters']), 1)
+
+        Love.objects.create(user=self.reader, book=self.book)
+        [love] = self.get('love-list', [self.book.id], fields='book.title,book.author.name')['results']
+        self.assertEqual(love, {'book': {'title': 'Moby Dick', 'author': {'name': 'Herman Melville'}}})
+
+    def test_book_detail_fieldsets(self):
+        detail = self.get('book-detail', [self.book.id], fields='id,title,is_loved')
+        self.assertEqual(detail, {'id': self.book.id, 'title': 'Moby Dick', 'is_loved': False})
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        publisher = User.objects.create_user('publisher')
+        cls.book_ids = [make_book(publisher, title=f'Book {number}').id for number in range(25)]
+
+    def test_next_links_walk_every_book_once(self):
+        url = reverse('book-list') + '?page_size=10'
+        seen = []
+        pages = 0
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(book['id'] for book in page['results'])
+            url = page['next']
+            pages += 1
+        self.assertEqual(seen, self.book_ids)
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_the_page_before(self):
+        first = self.client.get(reverse('book-list') + '?page_size=10').json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([book['id'] for book in back['results']], self.book_ids[:10])
+        self.assertIsNone(back['previous'])
+
+    def test_approximate_count_on_request(self):
+        page = self.client.get(reverse('book-list') + '?with_count=true').json()
+        self.assertEqual(page['count'], 25)
+        self.assertNotIn('count', self.client.get(reverse('book-list')).json())
+
+    def test_invalid_cursors(self):
+        cursors = [
+            'not base64!',
+            encode_cursor(['a list']),
+            encode_cursor({'r': False}),
+            encode_cursor({'r': False, 'p': [1, 2]}),
+            encode_cursor({'r': False, 'p': [{'x': 1}]}),
+            encode_cursor({'r': False, 'p': ['one']}),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('book-list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor.'})
+
+
+class ForkCopyOnWriteTests(TestCase):
+    def setUp(self):
+        self.original = make_book(User.objects.create_user('author'), can_fork=True)
+        self.chapters = [
+            Chapter.objects.create(book=self.original, chapter_title=f'Chapter {number}',
+                                   content=f'Original text {number}', chapter_number=number)
+            for number in (1, 2, 3)
+        ]
+        self.fork = fork_book(self.original, User.objects.create_user('forker'))
+
+    def texts(self, book):
+        return [chapter.content for chapter in chapters_of(book).order_by('chapter_number')]
+
+    def test_fork_shares_chapters_without_copying(self):
+        self.assertEqual(Chapter.objects.count(), 3)
+        self.assertEqual(self.texts(self.fork), ['Original text 1', 'Original text 2', 'Original text 3'])
+
+    def test_chapters_added_later_stay_with_the_original(self):
+        Chapter.objects.create(book=self.original, chapter_title='Chapter 4', content='New', chapter_number=4)
+        self.assertEqual(len(self.texts(self.original)), 4)
+        self.assertEqual(len(self.texts(self.fork)), 3)
+
+    def test_forker_edit_copies_the_chapter(self):
+        shared = self.chapters[1]
+        copy = save_chapter(self.fork, shared, content='Forked text 2')
+
+        self.assertEqual(copy.book_id, self.fork.id)
+        self.assertEqual(self.texts(self.fork), ['Original text 1', 'Forked text 2', 'Original text 3'])
+        self.assertEqual(self.texts(self.original), ['Original text 1', 'Original text 2', 'Original text 3'])
+        # Links to the shared chapter lead to the fork's copy
+        self.assertEqual(find_chapter(self.fork, shared.id), copy)
+
+    def test_original_edit_keeps_the_forked_version(self):
+        shared = self.chapters[0]
+        shared.content = 'Revised text 1'
+        shared.save()
+
+        self.assertEqual(self.texts(self.original)[0], 'Revised text 1')
+        self.assertEqual(self.texts(self.fork)[0], 'Original text 1')
+
+    def test_first_chapters_of_many_books(self):
+        copy = save_chapter(self.fork, self.chapters[0], content='Forked text 1')
+        chapters = first_chapters_of([self.original, self.fork], limit=2)
+        self.assertEqual(
+            [(chapter.reading_book_id, chapter.id) for chapter in chapters],
+            [(self.original.id, self.chapters[0].id), (self.original.id, self.chapters[1].id),
+             (self.fork.id, copy.id), (self.fork.id, self.chapters[1].id)],
+        )
+        # Books, their genres and the chapters of both
+        with self.assertNumQueries(3):
+            original, fork = BookSerializer.setup_eager_loading(Book.objects.order_by('id'))
+        self.assertEqual(original.first_chapters, self.chapters)
+        self.assertEqual(fork.first_chapters, [copy] + self.chapters[1:])
+
+    def test_original_deletes_keep_the_fork_whole(self):
+        self.chapters[2].delete()
+        self.assertEqual(len(self.texts(self.original)), 2)
+        self.assertEqual(self.texts(self.fork), ['Original text 1', 'Original text 2', 'Original text 3'])
+
+        self.original.delete()
+        self.fork.refresh_from_db()
+        self.assertEqual(self.texts(self.fork), ['Original text 1', 'Original text 2', 'Original text 3'])
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(name='Herman Melville')
+        self.book = make_book(User.objects.create_user('publisher'), title='Moby Dick', author=self.author)
+        self.chapter = Chapter.objects.create(
+            book=self.book, chapter_title='Loomings', content='Call me Ishmael. Some years ago...', chapter_number=1,
+        )
+
+    def found(self, query, book=None):
+        return [hit['chapter_id'] for hit in search.find_in_book(book or self.book, query)]
+
+    def assertIndexIntact(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {search.CHAPTER_TABLE} ({search.CHAPTER_TABLE}) VALUES ('integrity-check')")
+
+    def test_saved_chapters_are_indexed(self):
+        self.assertEqual(self.found('ishmael'), [self.chapter.id])
+        self.assertEqual(self.found('looming'), [self.chapter.id])  # Title, last word as a prefix
+
+    def test_edited_chapter_is_reindexed(self):
+        self.chapter.content = 'Towards thee I roll, thou all-destroying but unconquering whale'
+        self.chapter.save()
+        self.assertEqual(self.found('ishmael'), [])
+        self.assertEqual(self.found('whale'), [self.chapter.id])
+        self.assertIndexIntact()
+
+    def test_deleted_chapter_is_unindexed(self):
+        self.chapter.delete()
+        self.assertEqual(self.found('ishmael'), [])
+        self.assertIndexIntact()
+
+    def test_books_are_indexed_with_their_author(self):
+        self.assertEqual([book_id for book_id, _, _ in search.search_books('moby')], [self.book.id])
+        self.author.name = 'Anonymous'
+        self.author.save()
+        self.assertEqual(search.search_books('melville'), [])
+        self.assertEqual([book_id for book_id, _, _ in search.search_books('anonymous')], [self.book.id])
+        self.book.delete()
+        self.assertEqual(search.search_books('moby'), [])
+        self.assertIndexIntact()
+
+    def test_bulk_written_chapters(self):
+        chapters = Chapter.objects.bulk_create([
+            Chapter(book=self.book, chapter_title='The Carpet-Bag', content='Nantucket harbour', chapter_number=2),
+        ])
+        self.assertEqual(self.found('nantucket'), [])
+        search.index_new_chapters(chapters)
+        self.assertEqual(self.found('nantucket'), [chapters[0].id])
+        search.index_book_chapters(self.book.id)
+        self.assertEqual(self.found('nantucket'), [chapters[0].id])
+        self.assertIndexIntact()
+
+    def test_chapter_text_is_not_stored_in_the_index(self):
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+        self.assertNotIn(f'{search.CHAPTER_TABLE}_content', tables)
+
+    def test_snippets_are_escaped(self):
+        self.chapter.content = '<b onclick=x>world</b> & more'
+        self.chapter.save()
+        [hit] = search.find_in_book(self.book, 'world')
+        self.assertEqual(hit['snippet'], '&lt;b onclick=x&gt;<mark>world</mark>&lt;/b&gt; &amp; more')
+
+    def test_fork_finds_shared_and_own_chapters(self):
+        fork = fork_book(self.book, User.objects.create_user('forker'))
+        self.assertEqual(self.found('ishmael', fork), [self.chapter.id])
+        copy = save_chapter(fork, self.chapter, content='Call me Queequeg.')
+        self.assertEqual(self.found('ishmael', fork), [])
+        self.assertEqual(self.found('queequeg', fork), [copy.id])
+        self.assertEqual(self.found('ishmael'), [self.chapter.id])
+
+
+class TocCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = make_book(User.objects.create_user('publisher'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chapter = Chapter.objects.create(book=self.book, chapter_title='One', content='Text', chapter_number=1)
+
+    def titles(self):
+        return [entry['chapter_title'] for entry in get_book_toc(self.book.id)]
+
+    def test_edit_retires_the_toc_on_commit(self):
+        self.assertEqual(self.titles(), ['One'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.chapter.chapter_title = 'First'
+            self.chapter.save()
+            # Not yet committed: the cached TOC stays
+            self.assertIsNotNone(cache.get(toc_cache_key(self.book.id)))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ['First'])
+
+    def test_rolled_back_edit_keeps_the_toc(self):
+        self.assertEqual(self.titles(), ['One'])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Chapter.objects.create(book=self.book, chapter_title='Two', content='Text', chapter_number=2)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.titles(), ['One'])
+
+
+class QueryPlanCheckTests(TransactionTestCase):
+    # The command seeds through the test database's own connection (an
+    # in-memory database cannot be swapped for a scratch one) and migrates,
+    # which SQLite refuses inside TestCase's transaction
+
+    def _fixture_teardown(self):
+        super()._fixture_teardown()
+        search.rebuild_index()  # The flush leaves the full-text tables alone
+
+    def test_every_route_uses_indexed_plans(self):
+        out = StringIO()
+        call_command('check_query_plans', books=40, chapters=3, readers=10, stdout=out)
+        self.assertIn(f'All {len(check_query_plans.ROUTES)} routes use indexed plans.', out.getvalue())
+
+    def test_routes_without_a_plan_check_fail(self):
+        routes = {name: case for name, case in check_query_plans.ROUTES.items() if name != 'book-toc'}
+        with mock.patch.object(check_query_plans, 'ROUTES', routes):
+            with self.assertRaisesMessage(CommandError, 'Routes without a plan check: book-toc.'):
+                call_command('check_query_plans', books=40, chapters=3, readers=10, stdout=StringIO())
+
+
+class AsyncDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.publisher = User.objects.create_user('publisher', email='publisher@example.com')
+        cls.author = Author.objects.create(name='Ursula')
+        cls.genre = Genre.objects.create(name='Fiction')
+
+    def test_same_payload_as_the_sync_views(self):
+        client = APIClient()
+        for name, id in (('author-detail', self.author.id), ('publisher-detail', self.publisher.id),
+                         ('genre-detail', self.genre.id), ('author-detail', 0), ('genre-detail', 0)):
+            with self.subTest(name=name, id=id):
+                sync = client.get(reverse(name, args=[id]))
+                asynchronous = client.get(reverse(f'{name}-async', args=[id]))
+                self.assertEqual(asynchronous.status_code, sync.status_code)
+                self.assertEqual(asynchronous.json(), sync.json())
+
+
+class LoadTestTests(TestCase):
+    def test_every_route_has_a_case(self):
+        names = route_names(loadtest.LOADED_URLCONFS)
+        self.assertIn('plugin-toggle', names)
+        self.assertIn('book-list-async', names)
+        cases = {case.get('route', name) for name, case in loadtest.CASES.items()}
+        self.assertEqual(set(names) - cases, set())
+
+    def test_routes_without_a_case_fail_before_seeding(self):
+        cases = {name: case for name, case in loadtest.CASES.items() if name != 'plugin-list'}
+        with mock.patch.object(loadtest, 'CASES', cases):
+            with self.assertRaisesMessage(CommandError, 'Routes without a load test case: plugin-list.'):
+                call_command('loadtest', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'Unknown cases: nowhere.'):
+            call_command('loadtest', routes='book-list,nowhere', stdout=StringIO())
+
+    def test_build(self):
+        reader = User.objects.create_user('reader')
+        fixtures = SimpleNamespace(rng=random.Random(0), books=[7], reader=lambda n: reader, tokens={})
+        command = loadtest.Command()
+
+        method, url, body, headers = command.build('book-toc', fixtures, 0)
+        self.assertEqual((method, url, body), ('GET', reverse('book-toc', args=[7]), None))
+        self.assertTrue(headers['Authorization'].startswith('Bearer '))
+        # Tokens are minted once per reader
+        self.assertEqual(command.build('book-toc', fixtures, 1)[3]['Authorization'], headers['Authorization'])
+
+        method, url, body, headers = command.build('signup', fixtures, 3)
+        self.assertEqual((method, url), ('POST', reverse('signup')))
+        self.assertEqual(json.loads(body)['username'], 'load-3')
+        self.assertNotIn('Authorization', headers)
+
+    def test_percentiles(self):
+        ordered = list(range(1, 101))
+        self.assertEqual((loadtest.percentile(ordered, 0.5), loadtest.percentile(ordered, 0.99)), (50, 99))
+        self.assertEqual(loadtest.percentile([4], 0.95), 4)
+        self.assertEqual((loadtest.change(10, 15), loadtest.change(0, 3)), ('+50%', 'n/a'))
+
+    def test_sample_epub(self):
+        with zipfile.ZipFile(io.BytesIO(loadtest.sample_epub(chapters=4))) as archive:
+            self.assertEqual(len(document_paths(archive)), 4)
+            self.assertEqual(package_metadata(archive)['title'], 'Load')
+
+
+class SeedTests(TestCase):
+    def test_seeded_catalog_and_readers(self):
+        publisher = seed_catalog(books=12, chapters_per_book=3, authors=4, chapter_words=5)
+        self.assertEqual(Book.objects.filter(publisher=publisher).count(), 12)
+        self.assertEqual(Chapter.objects.count(), 36)
+        self.assertEqual(Author.objects.count(), 4)
+        self.assertEqual(Book.genre.through.objects.count(), 24)
+
+        readers = seed_interactions(readers=5, per_reader=4, comments_per_reader=2, likes_per_reader=3, forks=2)
+        self.assertEqual(len(readers), 5)
+        self.assertEqual(Love.objects.count(), 20)
+        self.assertEqual(ReadingProgress.objects.count(), 5)
+        # Forks share their original's chapters instead of copying them
+        self.assertEqual(Book.objects.filter(is_forked=True).count(), 2)
+        self.assertEqual(Chapter.objects.count(), 36)
@@ -0,0 +1,66 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from ebookhub.routers import primary_reads
+
+from .forks import chapters_of
+from .models import Book
+from .serializers import ChapterTOCSerializer
+
+TOC_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def toc_cache_key(book_id):
+    return f'book-toc:{book_id}'
+
+
+def get_book_toc(book_id):
+    """
+    Returns the table of contents of a book (id, number, title, length of
+    every chapter, in reading order). Chapter bodies are never loaded; the
+    result is cached until a chapter of the book changes. A fork's TOC
+    includes the chapters it shares with its original (see `basic.forks`).
+    """
+    key = toc_cache_key(book_id)
+    toc = cache.get(key)
+    if toc is None:
+        with primary_reads():
+            book = Book.objects.only('id', 'forked_from', 'forked_through_chapter').filter(id=book_id).first()
+            if book is None:
+                return []
+            chapters = (
+                chapters_of(book)
+                .only('id', 'chapter_number', 'chapter_title', 'content_length')
+                .order_by('chapter_number', 'id')
+            )
+            toc = [dict(entry) for entry in ChapterTOCSerializer(chapters, many=True).data]
+        cache.set(key, toc, TOC_CACHE_TIMEOUT)
+    return toc
+
+
+async def aget_book_toc(book_id):
+    """`get_book_toc` for async views; only a cache miss leaves the event loop."""
+    toc = await cache.aget(toc_cache_key(book_id))
+    if toc is None:
+        toc = await sync_to_async(get_book_toc)(book_id)
+    return toc
+
+
+def invalidate_book_toc(book_id):
+    """
+    Drops the cached TOC of a book once the current transaction commits;
+    earlier, a concurrent request could cache the uncommitted chapters
+    again, or the old ones if the transaction rolls back.
+    """
+    transaction.on_commit(lambda: cache.delete(toc_cache_key(book_id)))
+
+
+def neighbours(toc, chapter_id):
+    """Returns the (previous, next) TOC entries around a chapter."""
+    for index, entry in enumerate(toc):
+        if entry['id'] == chapter_id:
+            previous = toc[index - 1] if index > 0 else None
+            following = toc[index + 1] if index + 1 < len(toc) else None
+            return previous, following
+    return None, None
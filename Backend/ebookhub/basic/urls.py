@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('signup/', views.SignupView.as_view(), name='signup'),
@@ -9,4 +9,10 @@ urlpatterns = [
     path('publishers/<int:id>/', views.PublisherDetailView.as_view(), name='publisher-detail'),
     path('genres/<int:id>/', views.GenreDetailView.as_view(), name='genre-detail'),
     path('api/generic_queries/',views.BasicQueryView.as_view(),name='generic_queries'),
+    path('search/', views.SearchView.as_view(), name='search'),
+
+    # Async-native variants for the ASGI stack (see basic.async_views)
+    path('async/authors/<int:id>/', async_views.author_detail, name='author-detail-async'),
+    path('async/publishers/<int:id>/', async_views.publisher_detail, name='publisher-detail-async'),
+    path('async/genres/<int:id>/', async_views.genre_detail, name='genre-detail-async'),
 ]
@@ -9,7 +9,8 @@ from django.db import IntegrityError
 from django.db.models import Q  
 
 from .models import Author, Genre,Profile,Book
-from .serializers import AuthorSerializer, UserSerializer, GenreSerializer
+from .serializers import AuthorSerializer, UserSerializer, GenreSerializer, BookSerializer
+from .search import search_books
 
 
 
@@ -146,4 +147,41 @@ class BasicQueryView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        return Response(list(data), status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(list(data), status=status.HTTP_200_OK)
+
+
+class SearchView(APIView):
+    """
+    Full-text search over book titles, descriptions, author names and
+    chapter content. Returns books ranked by relevance, each with up to
+    three highlighted chapter snippets (HTML-escaped text with the matches
+    in <mark> tags).
+    """
+    max_limit = 50
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "The 'q' parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), self.max_limit)
+        except ValueError:
+            return Response({"error": "'limit' must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        hits = search_books(query, limit=limit)
+        books = BookSerializer.shape_queryset(
+            Book.objects.filter(id__in=[book_id for book_id, _, _ in hits]), request.query_params
+        )
+        books = {book.id: book for book in books}
+
+        results = []
+        for book_id, score, snippets in hits:
+            if book_id not in books:
+                continue  # Deleted since it was indexed
+            results.append({
+                'book': BookSerializer(books[book_id], context={'query_params': request.query_params}).data,
+                'score': score,
+                'snippets': snippets,
+            })
+        return Response({'query': query, 'results': results}, status=status.HTTP_200_OK)
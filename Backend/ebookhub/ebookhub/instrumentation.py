@@ -0,0 +1,184 @@
+"""
+Per-request timings: SQL statements and their time, serializer time,
+response rendering time and the total, collected by
+`PerformanceMiddleware` for the `Server-Timing` header and the /metrics
+histograms (see ebookhub.metrics).
+
+SQL is timed by an execute wrapper put on every database connection,
+including those the async ORM opens on its own threads, and only counts
+statement execution, not the fetching of rows afterwards. Serializer
+time is the time spent in the `data` of the outermost serializer; DRF
+has no hook for it, so `install` wraps `BaseSerializer.data`. Both
+include the SQL run meanwhile, so the segments overlap.
+
+A statement slower than `settings.SLOW_QUERY_MS` is logged to
+`ebookhub.slow_queries` with the view and the serializer method that ran
+it, e.g. `BookSerializer.get_chapters`. Its parameters are not logged.
+"""
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import django
+import rest_framework
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.views import View
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+slow_query_logger = logging.getLogger('ebookhub.slow_queries')
+
+_current = ContextVar('ebookhub_request_timings', default=None)
+
+# Frames in these packages, and this module's wrappers, are only reported
+# as the issuer of a query when nothing else is found
+_LIBRARY_DIRS = tuple(os.path.dirname(module.__file__) + os.sep for module in (django, rest_framework))
+
+
+class RequestTimings:
+    """What one request spent its time on, in milliseconds."""
+
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.slow_queries = 0
+        self.serializer_ms = 0.0
+        self.render_ms = 0.0
+        self._serializing = False
+        self._render_started = None
+
+    @property
+    def route(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match else 'unmatched'
+
+    def render_started(self):
+        self._render_started = time.perf_counter()
+
+    def rendered(self, response):
+        if self._render_started is not None:
+            self.render_ms += (time.perf_counter() - self._render_started) * 1000
+            self._render_started = None
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """The value of the `Server-Timing` header."""
+        return ', '.join([
+            f'db;dur={self.sql_ms:.2f};desc="{self.queries} queries"',
+            f'serializer;dur={self.serializer_ms:.2f}',
+            f'render;dur={self.render_ms:.2f}',
+            f'total;dur={self.total_ms:.2f}',
+        ])
+
+
+def current():
+    """The timings of the request being handled, if any."""
+    return _current.get()
+
+
+@contextmanager
+def timing(request):
+    """Collects the timings of `request` while the block runs."""
+    timings = RequestTimings(request)
+    for connection in connections.all():
+        # Opened before `install`, or not opened yet
+        watch(connection)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        timings.finish()
+
+
+@receiver(connection_created)
+def watch_new_connection(sender, connection, **kwargs):
+    watch(connection)
+
+
+def watch(connection):
+    # Wrappers stay on the connection object across reconnects
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def record_query(execute, sql, params, many, context):
+    began = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - began) * 1000
+        timings = _current.get()
+        if timings is not None:
+            timings.queries += 1
+            timings.sql_ms += elapsed
+        threshold = getattr(settings, 'SLOW_QUERY_MS', None)
+        if threshold is not None and elapsed >= threshold:
+            if timings is not None:
+                timings.slow_queries += 1
+            view, serializer = issuers(sys._getframe(1))
+            if view is None and timings is not None:
+                view = timings.route
+            slow_query_logger.warning(
+                "Slow query: %.1f ms in %s via %s: %s",
+                elapsed, view or '-', serializer or '-', sql,
+            )
+
+
+def issuers(frame):
+    """
+    The innermost view and serializer methods on the stack of `frame`, as
+    'Class.method'. Methods written here win over DRF's and Django's own.
+    """
+    found = {View: [None, None], BaseSerializer: [None, None]}  # kind -> [ours, any]
+    while frame is not None and None in (found[View][0], found[BaseSerializer][0]):
+        owner = frame.f_locals.get('self')
+        for kind, names in found.items():
+            if isinstance(owner, kind):
+                # A `many=True` serializer is named after its child
+                cls = type(owner.child) if isinstance(owner, ListSerializer) else type(owner)
+                name = f'{cls.__name__}.{frame.f_code.co_name}'
+                filename = frame.f_code.co_filename
+                if names[0] is None and filename != __file__ and not filename.startswith(_LIBRARY_DIRS):
+                    names[0] = name
+                if names[1] is None:
+                    names[1] = name
+        frame = frame.f_back
+    return tuple(names[0] or names[1] for names in found.values())
+
+
+_installed = False
+
+
+def install():
+    """Times serializers through `BaseSerializer.data`; runs once per process."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    data = BaseSerializer.data.fget
+
+    def timed_data(self):
+        timings = _current.get()
+        if timings is None or timings._serializing:
+            # Nested serializers count towards the outermost one
+            return data(self)
+        timings._serializing = True
+        began = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            timings.serializer_ms += (time.perf_counter() - began) * 1000
+            timings._serializing = False
+
+    BaseSerializer.data = property(timed_data)
@@ -0,0 +1,160 @@
+"""
+Per-route histograms of the request timings collected by
+`PerformanceMiddleware`, and the counters of the apps' write buffers and
+caches, in the Prometheus text format on /metrics.
+
+Everything is kept in memory, per process: with several worker processes
+each one answers for itself, so scrape them one by one or put a
+multiprocess-aware exporter in front.
+"""
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+ROUTE_LABELS = ('route', 'method')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=ROUTE_LABELS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [count per bucket..., count above, sum]
+
+    def observe(self, values, amount):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0]
+            series[bisect_left(self.buckets, amount)] += 1
+            series[-1] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {values: list(counts) for values, counts in self._series.items()}
+        for values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le=le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=ROUTE_LABELS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, values, amount=1):
+        with self._lock:
+            self._series[values] = self._series.get(values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for values, count in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labels, values)} {_number(count)}')
+        return lines
+
+
+requests_total = Counter(
+    'ebookhub_requests_total', 'Requests answered.', ROUTE_LABELS + ('status',),
+)
+request_duration = Histogram(
+    'ebookhub_request_duration_seconds', 'Time to answer a request.', SECONDS_BUCKETS,
+)
+sql_duration = Histogram(
+    'ebookhub_request_sql_duration_seconds', 'Time spent executing SQL per request.', SECONDS_BUCKETS,
+)
+sql_queries = Histogram(
+    'ebookhub_request_sql_queries', 'SQL statements executed per request.', QUERY_BUCKETS,
+)
+serializer_duration = Histogram(
+    'ebookhub_request_serializer_duration_seconds', 'Time spent in serializers per request.', SECONDS_BUCKETS,
+)
+render_duration = Histogram(
+    'ebookhub_request_render_duration_seconds', 'Time spent rendering the response.', SECONDS_BUCKETS,
+)
+slow_queries_total = Counter(
+    'ebookhub_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.',
+)
+
+REQUEST_METRICS = (
+    requests_total, request_duration, sql_duration, sql_queries, serializer_duration, render_duration,
+    slow_queries_total,
+)
+
+
+def observe(timings, response):
+    """Adds a finished request's timings to the histograms."""
+    values = (timings.route, timings.request.method)
+    requests_total.inc(values + (str(response.status_code),))
+    request_duration.observe(values, timings.total_ms / 1000)
+    sql_duration.observe(values, timings.sql_ms / 1000)
+    sql_queries.observe(values, timings.queries)
+    serializer_duration.observe(values, timings.serializer_ms / 1000)
+    render_duration.observe(values, timings.render_ms / 1000)
+    if timings.slow_queries:
+        slow_queries_total.inc(values, timings.slow_queries)
+
+
+def app_stats():
+    """The process-wide counters of the apps, by metric name prefix."""
+    from readers.caching import book_detail_stats
+    from readers.coalescing import interaction_writes
+    from readers.progress import reading_progress
+
+    return {
+        'ebookhub_book_detail_cache': book_detail_stats.snapshot(),
+        'ebookhub_interaction_writes': interaction_writes.stats.snapshot(),
+        'ebookhub_reading_progress': reading_progress.stats.snapshot(),
+    }
+
+
+def render():
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+    for prefix, snapshot in app_stats().items():
+        for key, value in snapshot.items():
+            if value is not None:
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, open to `settings.METRICS_ALLOWED_IPS` (everyone when empty)."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,98 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import instrumentation, metrics
+from .routers import SAFE_METHODS, pin_to_primary, request_routing
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets `ReplicaRouter` send the reads of GET requests to a replica, and
+    pins users who have just written to the primary. A view whose write is
+    deferred sets `response.pin_to_primary = False`.
+
+    Works in both sync and async chains, so async views under ASGI are not
+    pushed back onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_routing(request):
+            response = self.get_response(request)
+            if self.pins(request, response):
+                self.pin_user(request)
+        return response
+
+    async def __acall__(self, request):
+        with request_routing(request):
+            response = await self.get_response(request)
+            if self.pins(request, response):
+                # The user may still be a lazy, session-backed object
+                await sync_to_async(self.pin_user)(request)
+        return response
+
+    @staticmethod
+    def pins(request, response):
+        return (
+            request.method not in SAFE_METHODS and response.status_code < 400
+            and getattr(response, 'pin_to_primary', True)
+        )
+
+    @staticmethod
+    def pin_user(request):
+        # DRF stores the user it authenticated on the Django request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
+
+
+class PerformanceMiddleware:
+    """
+    Times every request below it (see ebookhub.instrumentation): SQL
+    statements and time, serializer, rendering and total time. Sends them
+    in a `Server-Timing` header unless `settings.SERVER_TIMING_HEADER` is
+    off and adds them to the per-route histograms on /metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrumentation.install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with instrumentation.timing(request) as timings:
+            response = self.get_response(request)
+        return self.report(timings, response)
+
+    async def __acall__(self, request):
+        with instrumentation.timing(request) as timings:
+            response = await self.get_response(request)
+        return self.report(timings, response)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view, inside the block above
+        timings = instrumentation.current()
+        if timings is not None:
+            timings.render_started()
+            response.add_post_render_callback(timings.rendered)
+        return response
+
+    @staticmethod
+    def report(timings, response):
+        if getattr(settings, 'SERVER_TIMING_HEADER', True):
+            response.headers['Server-Timing'] = timings.server_timing()
+        metrics.observe(timings, response)
+        return response
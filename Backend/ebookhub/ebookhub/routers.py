@@ -0,0 +1,185 @@
+"""
+Primary/replica routing for the `DATABASES` aliases.
+
+Writes always go to `default`. Reads go to one of the aliases listed in
+`settings.DATABASE_REPLICAS`, but only while `ReplicaRoutingMiddleware`
+has marked the current request as a read-only (GET/HEAD/OPTIONS) one. Code
+running outside a request (management commands, the job worker) always
+uses the primary. A request switches to the primary for good as soon as
+it writes, and a user who has just written is pinned to the primary for
+`DATABASE_REPLICA_PIN_SECONDS` so they read their own writes while the
+replicas catch up.
+
+Replicas that fail a health check are skipped for
+`DATABASE_REPLICA_RETRY_SECONDS`; with none healthy, reads fall back to
+the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = ContextVar('ebookhub_db_routing', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Sends the user's reads to the primary until the replicas have caught up."""
+    seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+    if seconds:
+        cache.set(pin_key(user_id), True, seconds)
+
+
+class RequestRouting:
+    """Routing state of one request."""
+
+    def __init__(self, request):
+        self.request = request
+        self.read_only = request.method in SAFE_METHODS
+        self.wrote = False
+        self.forced = 0
+        self.replica = None
+        self._pinned = None
+
+    @property
+    def use_primary(self):
+        return not self.read_only or self.wrote or self.forced > 0 or self.pinned()
+
+    def pinned(self):
+        """
+        Whether the requesting user wrote recently. The user is only known
+        once the view has authenticated the request; until then (including
+        the authentication lookup itself) the answer is no.
+        """
+        if self._pinned is None:
+            user = self.request.__dict__.get('user')
+            if user is None or isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+                return False
+            self._pinned = bool(user.is_authenticated and cache.get(pin_key(user.pk)))
+        return self._pinned
+
+
+@contextmanager
+def request_routing(request):
+    """Routes the database reads made while handling `request`."""
+    token = _routing.set(RequestRouting(request))
+    try:
+        yield _routing.get()
+    finally:
+        _routing.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Reads from the primary inside the block. Use it wherever what is read
+    gets cached, so a lagging replica cannot be stored as current.
+    """
+    state = _routing.get()
+    if state is None:
+        yield
+        return
+    state.forced += 1
+    try:
+        yield
+    finally:
+        state.forced -= 1
+
+
+class ReplicaHealth:
+    """Per-process record of which replicas answered their last check."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = {}
+        self._down_until = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            if self._down_until.get(alias, 0) > now:
+                return False
+            interval = getattr(settings, 'DATABASE_REPLICA_HEALTH_CHECK_INTERVAL', 10)
+            if now - self._checked_at.get(alias, float('-inf')) < interval:
+                return True
+            self._checked_at[alias] = now
+        return self.check(alias)
+
+    def check(self, alias):
+        """
+        Runs a query against the replica's schema: a replica file that is
+        missing would otherwise be created empty and still answer `SELECT 1`.
+        """
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1 FROM django_migrations LIMIT 1')
+        except DatabaseError as e:
+            self.mark_down(alias, e)
+            return False
+        return True
+
+    def mark_down(self, alias, error=None):
+        retry = getattr(settings, 'DATABASE_REPLICA_RETRY_SECONDS', 30)
+        logger.warning("Database replica %r is unavailable for %ss: %s", alias, retry, error)
+        connections[alias].close()
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + retry
+
+    def reset(self):
+        with self._lock:
+            self._checked_at.clear()
+            self._down_until.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """Database router; see the module docstring."""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state.use_primary:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None or state.replica != DEFAULT_DB_ALIAS and not replica_health.is_healthy(state.replica):
+            healthy = [alias for alias in replica_aliases() if replica_health.is_healthy(alias)]
+            # One replica per request, so its reads come from a single copy
+            state.replica = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold copies of the primary's rows
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in replica_aliases():
+            return False
+        return None
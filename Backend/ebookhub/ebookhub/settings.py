@@ -77,6 +77,7 @@ AUTHENTICATION_BACKENDS = [
 
 
 MIDDLEWARE = [
+    'ebookhub.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,6 +86,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ebookhub.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'ebookhub.urls'
@@ -111,10 +113,93 @@ WSGI_APPLICATION = 'ebookhub.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connections are kept open for CONN_MAX_AGE seconds (0 closes them after
+# every request) and checked before reuse. Django only pools connections
+# for PostgreSQL; with SQLite, persistent connections are the reuse there is.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('EBOOKHUB_DB_CONN_MAX_AGE', 60))
+
+# SQLite profile. 'production' tunes every connection for concurrent
+# readers and writers: WAL lets reads continue during a write, NORMAL
+# synchronous skips the fsync per commit (still safe in WAL mode), writers
+# wait for the lock instead of failing, and write transactions take the
+# lock when they begin, so a read-then-write transaction cannot fail with
+# "database is locked" halfway through. 'stock' keeps SQLite's defaults.
+SQLITE_PROFILE = os.environ.get('EBOOKHUB_SQLITE_PROFILE', 'production')
+
+# Applied on connection_created (see basic.signals)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'MEMORY',
+} if SQLITE_PROFILE == 'production' else {}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'} if SQLITE_PROFILE == 'production' else {},
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Read replicas: EBOOKHUB_DB_REPLICAS is a comma-separated list of SQLite
+# files, refreshed from the primary by `manage.py sync_sqlite_replicas`.
+# ebookhub.routers sends the reads of GET requests to them (see there).
+DATABASE_REPLICAS = []
+for index, replica_name in enumerate(filter(None, os.environ.get('EBOOKHUB_DB_REPLICAS', '').split(',')), 1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': replica_name.strip(),
+        'OPTIONS': {'init_command': 'PRAGMA query_only = 1'},
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['ebookhub.routers.ReplicaRouter']
+
+# How long a user who wrote reads from the primary; keep it above the
+# replicas' refresh interval
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('EBOOKHUB_DB_REPLICA_PIN_SECONDS', 5))
+DATABASE_REPLICA_HEALTH_CHECK_INTERVAL = 10
+DATABASE_REPLICA_RETRY_SECONDS = 30
+
+# Group the love, bookmark, rating and comment-like writes of a process
+# into one transaction every few milliseconds (see readers.coalescing)
+INTERACTION_WRITE_COALESCING = SQLITE_PROFILE == 'production'
+INTERACTION_WRITE_WINDOW_MS = 5
+INTERACTION_WRITE_MAX_BATCH = 200
+
+# Keep only the latest reading position per user and book in memory and
+# upsert them every few seconds (see readers.progress)
+READING_PROGRESS_BUFFERING = True
+READING_PROGRESS_FLUSH_SECONDS = 2
+READING_PROGRESS_MAX_PENDING = 5000
+
+# Per-request instrumentation (see ebookhub.instrumentation): timings in a
+# Server-Timing header, per-route histograms on /metrics for the addresses
+# below (any address when empty), and statements slower than
+# SLOW_QUERY_MS logged to 'ebookhub.slow_queries' (None turns that off)
+SERVER_TIMING_HEADER = True
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+SLOW_QUERY_MS = int(os.environ.get('EBOOKHUB_SLOW_QUERY_MS', 200))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Holds derived data such as book tables of contents. Point this at a shared
+# backend (Redis/Memcached) when running several worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ebookhub',
     }
 }
 
@@ -158,6 +243,12 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Who sends the bytes of EPUB downloads (see readers.downloads): '' for
+# Django itself, 'nginx' (X-Accel-Redirect) or 'apache' (X-Sendfile). For
+# nginx, DOWNLOAD_ACCEL_PREFIX is an `internal` location aliasing MEDIA_ROOT.
+DOWNLOAD_OFFLOAD = os.environ.get('EBOOKHUB_DOWNLOAD_OFFLOAD', '')
+DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,163 @@
+import time
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from basic.models import Book, Chapter, SupportedFormat
+from basic.serializers import BookSerializer
+from . import metrics
+from .routers import ReplicaHealth, ReplicaRouter, pin_key, pin_to_primary, primary_reads, replica_health, request_routing
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        healthy = mock.patch.object(replica_health, 'is_healthy', return_value=True)
+        self.is_healthy = healthy.start()
+        self.addCleanup(healthy.stop)
+
+    def read(self):
+        return self.router.db_for_read(Book)
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+    def test_safe_requests_read_from_a_replica(self):
+        with request_routing(self.factory.get('/')):
+            self.assertEqual(self.read(), 'replica_1')
+        with request_routing(self.factory.post('/')):
+            self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+    def test_a_write_moves_the_request_to_the_primary(self):
+        with request_routing(self.factory.get('/')):
+            self.assertEqual(self.read(), 'replica_1')
+            self.assertEqual(self.router.db_for_write(Book), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+    def test_primary_reads(self):
+        with request_routing(self.factory.get('/')):
+            with primary_reads():
+                self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+                with primary_reads():
+                    self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+                self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.read(), 'replica_1')
+
+    def test_users_who_wrote_are_pinned_to_the_primary(self):
+        writer, reader = User.objects.create_user('writer'), User.objects.create_user('reader')
+        pin_to_primary(writer.pk)
+        for user, expected in ((writer, DEFAULT_DB_ALIAS), (reader, 'replica_1')):
+            request = self.factory.get('/')
+            request.user = user
+            with self.subTest(user=user.username), request_routing(request):
+                self.assertEqual(self.read(), expected)
+
+    def test_unhealthy_replicas_fall_back_to_the_primary(self):
+        self.is_healthy.return_value = False
+        with request_routing(self.factory.get('/')):
+            self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+
+class ReplicaHealthTests(TestCase):
+    def test_failed_check_skips_the_replica_for_a_while(self):
+        health = ReplicaHealth()
+        self.assertTrue(health.is_healthy(DEFAULT_DB_ALIAS))
+        health.reset()
+        with mock.patch.object(connections[DEFAULT_DB_ALIAS], 'cursor', side_effect=DatabaseError('gone')):
+            with self.assertLogs('ebookhub.routers', 'WARNING'):
+                self.assertFalse(health.is_healthy(DEFAULT_DB_ALIAS))
+        # Down until the retry delay has passed, without checking again
+        self.assertFalse(health.is_healthy(DEFAULT_DB_ALIAS))
+        with mock.patch('ebookhub.routers.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertTrue(health.is_healthy(DEFAULT_DB_ALIAS))
+
+
+class WritePinningTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_successful_writes_pin_the_user(self):
+        user = User.objects.create_user('reader')
+        book_format = SupportedFormat.objects.create(name='EPUB')
+        book = Book.objects.create(title='A book', publisher=user, date_published=date(2024, 1, 1), format=book_format)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        client.get(reverse('love-list', args=[book.id]))
+        self.assertIsNone(cache.get(pin_key(user.pk)))
+        self.assertEqual(client.post(reverse('love-list', args=[book.id])).status_code, 201)
+        self.assertTrue(cache.get(pin_key(user.pk)))
+
+        # A refused write pins no one
+        cache.clear()
+        self.assertEqual(client.post(reverse('love-list', args=[book.id])).status_code, 400)
+        self.assertIsNone(cache.get(pin_key(user.pk)))
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        publisher = User.objects.create_user('publisher')
+        book_format = SupportedFormat.objects.create(name='EPUB')
+        cls.book = Book.objects.create(title='A book', publisher=publisher, date_published=date(2024, 1, 1),
+                                       format=book_format)
+        Chapter.objects.create(book=cls.book, chapter_title='One', content='Text', chapter_number=1)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('book-list'))
+        segments = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(list(segments), ['db', 'serializer', 'render', 'total'])
+        self.assertRegex(segments['db'], r'^dur=\d+\.\d\d;desc="[1-9]\d* queries"$')
+
+        with override_settings(SERVER_TIMING_HEADER=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('book-list')))
+
+    def test_metrics_are_open_to_the_allowed_addresses_only(self):
+        self.client.get(reverse('book-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('ebookhub_requests_total{route="book-list",method="GET",status="200"}', body)
+        self.assertIn('ebookhub_request_sql_queries_bucket{route="book-list",method="GET",le="+Inf"}', body)
+        self.assertIn('# TYPE ebookhub_reading_progress_reports gauge', body)
+
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.8').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.8').status_code, 200)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_with_their_issuer(self):
+        with self.assertLogs('ebookhub.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('book-list'))
+        self.assertTrue(all(line.startswith('WARNING:ebookhub.slow_queries:Slow query: ') for line in logs.output))
+        self.assertTrue(all(' in BookList.get via -: ' in line for line in logs.output))
+
+        # Outside a view, with the serializer method that ran it
+        with self.assertLogs('ebookhub.slow_queries', 'WARNING') as logs:
+            BookSerializer(Book.objects.get(id=self.book.id)).data
+        self.assertIn(' in - via BookSerializer.get_chapters: ', ''.join(logs.output))
+
+        with override_settings(SLOW_QUERY_MS=None), self.assertNoLogs('ebookhub.slow_queries'):
+            self.client.get(reverse('book-list'))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', (0.1, 1))
+        for amount in (0.05, 0.1, 0.5, 3):
+            histogram.observe(('route', 'GET'), amount)
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{route="route",method="GET",le="0.1"} 2',
+            'test_seconds_bucket{route="route",method="GET",le="1"} 3',
+            'test_seconds_bucket{route="route",method="GET",le="+Inf"} 4',
+            'test_seconds_sum{route="route",method="GET"} 3.65',
+            'test_seconds_count{route="route",method="GET"} 4',
+        ])
@@ -19,6 +19,8 @@ from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+
 urlpatterns = [
     
     path('', include('basic.urls')),
@@ -26,6 +28,7 @@ urlpatterns = [
     path('writers/',include('writers.urls')),
     path('plugins/',include('plugin.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     
 ]
 
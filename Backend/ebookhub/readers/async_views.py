@@ -0,0 +1,80 @@
+"""
+Async-native variants of the book list, book detail and chapter views
+(see `basic.async_views`). Each mirrors the sync view of the same name
+in `readers.views` and answers with the same payload.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from basic.async_views import authenticate, error_response, json_response, require_user
+from basic.forks import find_chapter
+from basic.models import Book, Chapter
+from basic.serializers import BookSerializer, ChapterSerializer
+from basic.toc import aget_book_toc, neighbours
+from readers.caching import aget_shared_book_detail, auser_overlay, get_book_detail, wants_fieldsets
+from readers.interactions import UserInteractions
+from readers.views import BookPagination
+
+
+async def book_list(request):
+    try:
+        user = await authenticate(request)
+        books = BookSerializer.shape_queryset(Book.objects.all().order_by('id'), request.GET)
+        paginator = BookPagination()
+        result_page = await paginator.apaginate_queryset(books, request)
+    except APIException as exc:
+        return error_response(request, exc)
+
+    context = {'query_params': request.GET}
+    if user.is_authenticated:
+        context['interactions'] = await UserInteractions.aload(user, [book.id for book in result_page])
+
+    serializer = BookSerializer(result_page, many=True, context=context)
+    return json_response(paginator.get_paginated_payload(serializer.data))
+
+
+async def book_detail(request, id):
+    try:
+        user = await require_user(request)
+    except APIException as exc:
+        return error_response(request, exc)
+    try:
+        if wants_fieldsets(request):
+            # Not cached: one hop to the sync serializer
+            return json_response(await sync_to_async(get_book_detail)(id, request, user))
+        data = await aget_shared_book_detail(id, request)
+    except Http404 as exc:
+        # DRF answers the sync view's Http404 the same way
+        return json_response({'detail': str(exc) or 'Not found.'}, status.HTTP_404_NOT_FOUND)
+    data = dict(data)
+    data.update(await auser_overlay(id, user))
+    return json_response(data)
+
+
+async def chapter_detail(request, book_id, chapter_id):
+    try:
+        await authenticate(request)
+    except APIException as exc:
+        return error_response(request, exc)
+    chapter = await Chapter.objects.filter(id=chapter_id, book_id=book_id).afirst()
+    if chapter is None:
+        # A fork reading one of its original's chapters
+        book = await Book.objects.only('id', 'forked_from', 'forked_through_chapter').filter(id=book_id).afirst()
+        if book is not None:
+            chapter = await sync_to_async(find_chapter)(book, chapter_id)
+        if chapter is None:
+            return json_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+
+    toc = await aget_book_toc(book_id)
+    previous_chapter, next_chapter = neighbours(toc, chapter.id)
+    data = {
+        "chapter": ChapterSerializer(chapter).data,
+        "previous": previous_chapter,
+        "next": next_chapter,
+    }
+    if request.GET.get('toc', 'true').lower() != 'false':
+        data["all_chapters"] = toc
+    return json_response(data)
+
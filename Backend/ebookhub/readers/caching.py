@@ -0,0 +1,187 @@
+"""
+Response cache for the book detail endpoint.
+
+Everything in a book detail payload except `is_loved`, `is_bookmarked` and
+`user_rating` is the same for every reader, so that part is serialized once
+per version of the book and kept in Django's cache. Each request only adds
+the per-user overlay, which is three indexed lookups. Requests with
+`?fields=` or `?expand=` skip the cache, which only holds the full payload.
+
+The cache key carries a per-book version number. Signal receivers (see
+`readers.signals`) and the counter helpers bump the version whenever
+something in the payload changes; entries of older versions are never read
+again and simply expire. A version shared by all books, read in the same
+cache round trip, retires every entry at once after set-based repairs that
+do not know which books they changed.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+
+from basic.models import Book, Chapter
+from basic.serializers import BookDetailSerializer, SharedBookDetailSerializer
+from ebookhub.routers import primary_reads
+from .interactions import UserInteractions
+
+BOOK_DETAIL_CACHE_TIMEOUT = 60 * 60
+
+
+class CacheStats:
+    """Hit and miss counters of one cache, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+book_detail_stats = CacheStats()
+
+
+ALL_BOOKS_VERSION_KEY = 'book-version:all'
+
+
+def book_version_key(book_id):
+    return f'book-version:{book_id}'
+
+
+def _version_from(key, found):
+    """
+    The version stored under `key`, or a new one. A lost version key
+    restarts from the clock rather than from 1, so entries written under an
+    older version can never be mistaken for current ones.
+    """
+    version = found.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def book_version(book_id):
+    """Current version of a book's cached representations."""
+    keys = (ALL_BOOKS_VERSION_KEY, book_version_key(book_id))
+    found = cache.get_many(keys)
+    return '.'.join(str(_version_from(key, found)) for key in keys)
+
+
+def invalidate_book_detail(book_id):
+    """
+    Retires the cached representations of a book once the current
+    transaction commits; earlier, a concurrent request could cache the
+    uncommitted state under the new version.
+    """
+    transaction.on_commit(lambda: _bump_version(book_version_key(book_id)))
+
+
+def invalidate_all_book_details():
+    """`invalidate_book_detail` for every book."""
+    transaction.on_commit(lambda: _bump_version(ALL_BOOKS_VERSION_KEY))
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def book_detail_key(book_id, request, version=None):
+    # Cover URLs are absolute, so the host is part of the key
+    if version is None:
+        version = book_version(book_id)
+    return f'book-detail:{book_id}:{version}:{request.get_host()}'
+
+
+def get_shared_book_detail(book_id, request):
+    """
+    Returns the reader-independent part of the detail payload of a book.
+    The book is only loaded and serialized when this version is not cached
+    yet; raises Http404 if it does not exist.
+    """
+    key = book_detail_key(book_id, request)
+    data = cache.get(key)
+    book_detail_stats.record(data is not None)
+    if data is None:
+        chapters = Chapter.objects.only('id', 'book_id', 'chapter_title', 'chapter_number')
+        books = Book.objects.select_related('author').prefetch_related('genre', Prefetch('chapters', queryset=chapters))
+        with primary_reads():
+            book = get_object_or_404(books, id=book_id)
+            data = dict(SharedBookDetailSerializer(book, context={'request': request}).data)
+        cache.set(key, data, BOOK_DETAIL_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_shared_book_detail(book_id, request):
+    """
+    `get_shared_book_detail` for async views. A hit is two reads through
+    the async cache API; a miss loads and serializes the book in one hop
+    to the sync code.
+    """
+    keys = (ALL_BOOKS_VERSION_KEY, book_version_key(book_id))
+    found = await cache.aget_many(keys)
+    if len(found) == len(keys):
+        version = '.'.join(str(found[key]) for key in keys)
+        data = await cache.aget(book_detail_key(book_id, request, version))
+        if data is not None:
+            book_detail_stats.record(True)
+            return data
+    return await sync_to_async(get_shared_book_detail)(book_id, request)
+
+
+def user_overlay(book_id, user):
+    """The fields of the detail payload that depend on who is reading."""
+    return UserInteractions(user, [book_id]).for_book(book_id)
+
+
+async def auser_overlay(book_id, user):
+    return (await UserInteractions.aload(user, [book_id])).for_book(book_id)
+
+
+def wants_fieldsets(request):
+    """Whether the request narrows or expands the payload (see `DynamicFieldsMixin`)."""
+    params = getattr(request, 'query_params', request.GET)
+    return 'fields' in params or 'expand' in params
+
+
+def get_book_detail(book_id, request, user):
+    """
+    The book detail payload as `user` sees it: the cached shared part plus
+    the overlay, or with `?fields=` / `?expand=`, only what they ask for,
+    serialized from a queryset shaped for them. Raises Http404 if the book
+    does not exist.
+    """
+    if not wants_fieldsets(request):
+        data = dict(get_shared_book_detail(book_id, request))
+        data.update(user_overlay(book_id, user))
+        return data
+    params = getattr(request, 'query_params', request.GET)
+    book = get_object_or_404(BookDetailSerializer.shape_queryset(Book.objects.all(), params), id=book_id)
+    context = {'request': request, 'user': user, 'query_params': params}
+    return dict(BookDetailSerializer(book, context=context).data)
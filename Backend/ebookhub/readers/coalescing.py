@@ -0,0 +1,150 @@
+"""
+In-process write coalescing for small interaction writes.
+
+SQLite lets one connection write at a time and makes every commit durable
+on its own, so a burst of loves, bookmarks, ratings and likes mostly
+queues on the database lock. With `INTERACTION_WRITE_COALESCING` on, the
+request threads of a process hand those writes to a single writer thread
+instead. It collects whatever arrives within `INTERACTION_WRITE_WINDOW_MS`
+and commits the batch as one transaction, running each write in a
+savepoint of its own, so one failing write does not undo the others.
+Callers block until the batch has committed and get their own result or
+exception back, so responses still mean "stored".
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+_STOP = object()
+
+
+class CoalescerStats:
+    """Writes and batches committed by a coalescer, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.batches = 0
+
+    def record(self, writes):
+        with self._lock:
+            self.writes += writes
+            self.batches += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'writes': self.writes,
+                'batches': self.batches,
+                'writes_per_batch': round(self.writes / self.batches, 2) if self.batches else None,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.writes = self.batches = 0
+
+
+class WriteCoalescer:
+    """Hands transactions to one writer thread that commits them in batches."""
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = CoalescerStats()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs `func(*args, **kwargs)` in a transaction and returns its result.
+        Inside an open transaction, or with coalescing off, that happens
+        right here; the write then commits (or rolls back) with the caller.
+        """
+        if not getattr(settings, 'INTERACTION_WRITE_COALESCING', False) or connection.in_atomic_block:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+        self._start_worker()
+        return future.result()
+
+    def stop(self):
+        """
+        Lets the writer thread commit what is queued, close its database
+        connection and exit. The next write starts a new one.
+        """
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None and worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join()
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name=f'{self.name}-writer', daemon=True)
+                self._worker.start()
+
+    def _work(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                close_old_connections()
+                self._commit(batch)
+        connection.close()
+
+    def _next_batch(self):
+        """
+        Waits for a write, then takes whatever else arrives within the
+        window. Returns the batch and whether `stop` was called.
+        """
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + getattr(settings, 'INTERACTION_WRITE_WINDOW_MS', 5) / 1000
+        max_batch = getattr(settings, 'INTERACTION_WRITE_MAX_BATCH', 200)
+        while len(batch) < max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, batch):
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for func, args, kwargs, future in batch:
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed; none of the writes are stored
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats.record(len(batch))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+interaction_writes = WriteCoalescer('interactions')
@@ -0,0 +1,135 @@
+"""
+Denormalized interaction counters on Book and Comment.
+
+The write paths call `bump` (or `apply_rating` for votes) in the same
+transaction as the row they insert, change or delete; the UPDATE uses F()
+expressions, so concurrent requests never overwrite each other's
+increments. `reconcile` recomputes the counters from the interaction
+tables with set-based UPDATEs to repair any drift (cascade deletes, manual
+edits, ...).
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+from basic.models import Book
+from .caching import invalidate_all_book_details, invalidate_book_detail
+from .models import Bookmark, Comment, CommentLike, Love, Rating
+
+STARS = range(1, 6)
+
+
+def bump(model, pk, **deltas):
+    """Adds the given deltas to counter columns of one row, e.g. bump(Book, 1, love_count=1)."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in deltas.items()})
+    if model is Book:
+        # Queryset updates send no signals; the counters are part of the cached detail
+        invalidate_book_detail(pk)
+
+
+# Ratings -------------------------------------------------------------------
+
+def rating_star(value):
+    """The histogram bucket of a rating: rounded half up, 0-1.4 counting as one star."""
+    star = int(Decimal(str(value)).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    return min(max(star, STARS[0]), STARS[-1])
+
+
+def star_range(star):
+    """The Rating.rating filter matching `rating_star(value) == star`."""
+    condition = Q()
+    if star > STARS[0]:
+        condition &= Q(rating__gte=Decimal(star) - Decimal('0.5'))
+    if star < STARS[-1]:
+        condition &= Q(rating__lt=Decimal(star) + Decimal('0.5'))
+    return condition
+
+
+# rating_sum / rating_count, NULL while a book has no ratings. The cast
+# avoids integer division where the backend stores whole sums as integers.
+AVERAGE_RATING = Case(
+    When(rating_count=0, then=Value(None)),
+    default=Round(Cast('rating_sum', FloatField()) / F('rating_count'), 1),
+)
+
+
+def apply_rating(book_id, old=None, new=None):
+    """
+    Moves a book's rating aggregates from one vote to another: `old=None`
+    for a new vote, `new=None` for a removed one. Costs two UPDATEs on the
+    book row however many ratings it has; call it inside the transaction
+    that writes the Rating.
+    """
+    deltas = {}
+    if old is not None:
+        deltas['rating_sum'] = -Decimal(str(old))
+        deltas['rating_count'] = -1
+        deltas[f'rating_{rating_star(old)}_count'] = -1
+    if new is not None:
+        deltas['rating_sum'] = deltas.get('rating_sum', 0) + Decimal(str(new))
+        deltas['rating_count'] = deltas.get('rating_count', 0) + 1
+        field = f'rating_{rating_star(new)}_count'
+        deltas[field] = deltas.get(field, 0) + 1
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        bump(Book, book_id, **deltas)
+    Book.objects.filter(pk=book_id).update(rating=AVERAGE_RATING)
+
+
+# Reconciliation ------------------------------------------------------------
+
+def _aggregate_of(model, fk, aggregate=Count('*'), condition=Q(), default=0):
+    """Correlated subquery aggregating the `model` rows pointing at the outer row."""
+    values = (
+        model.objects.filter(condition, **{fk: OuterRef('pk')})
+        .order_by()
+        .values(fk)
+        .annotate(total=aggregate)
+        .values('total')
+    )
+    return Coalesce(Subquery(values), Value(default))
+
+
+# counter field -> expression computing its true value, per counted model
+COUNTERS = {
+    Book: {
+        'love_count': _aggregate_of(Love, 'book'),
+        'bookmark_count': _aggregate_of(Bookmark, 'book'),
+        'rating_count': _aggregate_of(Rating, 'book'),
+        'comment_count': _aggregate_of(Comment, 'book'),
+        'rating_sum': _aggregate_of(Rating, 'book', Sum('rating'), default=Decimal(0)),
+        **{
+            f'rating_{star}_count': _aggregate_of(Rating, 'book', condition=star_range(star))
+            for star in STARS
+        },
+    },
+    Comment: {
+        'like_count': _aggregate_of(CommentLike, 'comment'),
+    },
+}
+
+
+def reconcile(dry_run=False):
+    """
+    Recomputes every counter, then the average ratings derived from them.
+    Returns {'Book.love_count': rows repaired, ...}. Each counter costs one
+    UPDATE, or one COUNT in dry-run mode, with the true value computed by a
+    correlated subquery in both the WHERE and the SET.
+    """
+    repaired = {}
+    for model, counters in COUNTERS.items():
+        for field, actual in counters.items():
+            drifted = model.objects.exclude(**{field: actual})
+            repaired[f'{model.__name__}.{field}'] = drifted.count() if dry_run else drifted.update(**{field: actual})
+
+    drifted = Book.objects.filter(
+        Q(rating_count=0, rating__isnull=False) | Q(rating_count__gt=0) & ~Q(rating=AVERAGE_RATING)
+        | Q(rating_count__gt=0, rating__isnull=True)
+    )
+    repaired['Book.rating'] = drifted.count() if dry_run else drifted.update(rating=AVERAGE_RATING)
+
+    if not dry_run and any(count for name, count in repaired.items() if name.startswith('Book.')):
+        # The repaired books are not read back, so every cached detail goes
+        invalidate_all_book_details()
+    return repaired
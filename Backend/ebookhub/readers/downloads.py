@@ -0,0 +1,177 @@
+"""
+EPUB downloads with conditional and range requests.
+
+Every response carries a strong ETag and Last-Modified taken from the
+file's size and modification time (uploads are never rewritten in place,
+so equal metadata means equal bytes), in nginx's format so the validators
+stay the same when nginx serves the file. `If-None-Match` is answered with
+a 304 here; single `Range` requests (with `If-Range`) get a 206.
+
+The bytes themselves are sent by the front proxy when
+`DOWNLOAD_OFFLOAD` names one: 'nginx' answers with `X-Accel-Redirect` to
+`DOWNLOAD_ACCEL_PREFIX` (an `internal` location aliasing MEDIA_ROOT),
+'apache' with `X-Sendfile` (mod_xsendfile). Both proxies apply the Range
+header themselves. Without a proxy the file goes out as a FileResponse,
+which WSGI servers with a `wsgi.file_wrapper` (gunicorn, uWSGI) send with
+`sendfile()` instead of reading it into Python.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+EPUB_CONTENT_TYPE = 'application/epub+zip'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    return quote_etag(f'{int(stat.st_mtime):x}-{stat.st_size:x}')
+
+
+def etag_matches(header, etag, weak=True):
+    """
+    Whether an If-None-Match / If-Range header matches `etag`. If-None-Match
+    compares weakly; If-Range needs a strong match.
+    """
+    for candidate in (part.strip() for part in header.split(',')):
+        if candidate == '*' and weak:
+            return True
+        if weak and candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) byte positions, inclusive, asked for by a
+    single-range `Range` header; None when the header should be ignored
+    (malformed or several ranges, which we answer with the whole file), or
+    'unsatisfiable'.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    return start, end
+
+
+class FileRange:
+    """
+    A file limited to `length` bytes from its current position. It keeps
+    `fileno()`, so `wsgi.file_wrapper` implementations can still use
+    sendfile(), which starts at the current offset and stops at
+    Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def download_response(request, field, filename):
+    """
+    The response to a GET/HEAD of the file stored in `field` (a FieldFile).
+    Raises Http404 when the file is missing from storage, which is checked
+    before a proxy is told to send it too.
+    """
+    path = field.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("The file of this book is missing.")
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+
+    validators = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',  # Cacheable, but revalidated with the ETag
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        response = HttpResponse(status=304)
+        for header, value in validators.items():
+            response.headers[header] = value
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_holds(request.headers.get('If-Range'), etag, stat):
+        byte_range = parse_range(range_header, size)
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+
+    offload = getattr(settings, 'DOWNLOAD_OFFLOAD', '')
+    if offload:
+        # The proxy sends the body and applies Range itself
+        response = HttpResponse(content_type=EPUB_CONTENT_TYPE)
+        if offload == 'nginx':
+            response.headers['X-Accel-Redirect'] = quote(settings.DOWNLOAD_ACCEL_PREFIX + field.name)
+        else:
+            response.headers['X-Sendfile'] = path
+    else:
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            # Deleted since the stat
+            raise Http404("The file of this book is missing.")
+        if byte_range:
+            start, end = byte_range
+            file.seek(start)
+            response = FileResponse(FileRange(file, end - start + 1), content_type=EPUB_CONTENT_TYPE)
+            response.status_code = 206
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response.headers['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(file, content_type=EPUB_CONTENT_TYPE)
+
+    for header, value in validators.items():
+        response.headers[header] = value
+    response.headers['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def _if_range_holds(if_range, etag, stat):
+    """Whether a Range header applies: no If-Range, or one naming the current file."""
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag_matches(if_range, etag, weak=False)
+    return parse_http_date_safe(if_range) == int(stat.st_mtime)
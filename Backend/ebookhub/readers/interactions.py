@@ -0,0 +1,89 @@
+"""
+Per-reader state (loved, bookmarked, own rating) for many books at once.
+
+Rendering these flags book by book costs three queries per book; the
+resolver below loads them for a whole page in three queries, however many
+books the page has.
+"""
+from django.db.models import Exists, OuterRef, Value
+
+from .models import Bookmark, Comment, CommentLike, Love, Rating
+
+
+class UserInteractions:
+    """The current user's loves, bookmarks and ratings for a set of books."""
+
+    def __init__(self, user, book_ids, load=True):
+        self.loved = set()
+        self.bookmarked = set()
+        self.ratings = {}
+        queries = self._queries(user, book_ids) if load else None
+        if queries:
+            loved, bookmarked, ratings = queries
+            self.loved = set(loved)
+            self.bookmarked = set(bookmarked)
+            self.ratings = dict(ratings)
+
+    @classmethod
+    async def aload(cls, user, book_ids):
+        """The same flags for async views, through the async ORM."""
+        interactions = cls(user, book_ids, load=False)
+        queries = cls._queries(user, book_ids)
+        if queries:
+            loved, bookmarked, ratings = queries
+            interactions.loved = {book_id async for book_id in loved}
+            interactions.bookmarked = {book_id async for book_id in bookmarked}
+            interactions.ratings = {book_id: rating async for book_id, rating in ratings}
+        return interactions
+
+    @staticmethod
+    def _queries(user, book_ids):
+        book_ids = set(book_ids)
+        if not book_ids or user is None or not user.is_authenticated:
+            return None
+        return (
+            Love.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', flat=True),
+            Bookmark.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', flat=True),
+            Rating.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', 'rating'),
+        )
+
+    def for_book(self, book_id):
+        return {
+            'is_loved': book_id in self.loved,
+            'is_bookmarked': book_id in self.bookmarked,
+            'user_rating': self.ratings.get(book_id),
+        }
+
+
+def interaction_context(request, books):
+    """
+    Serializer context adding the requesting user's flags to every book of
+    a page (see `BookSerializer.to_representation`). Anonymous requests get
+    an empty context and the plain book representation.
+    """
+    if not request.user.is_authenticated:
+        return {}
+    return {'interactions': UserInteractions(request.user, [book.id for book in books])}
+
+
+def comment_like_state(book_id, user):
+    """
+    Returns [{'comment_id', 'like_count', 'liked'}] for every comment on a
+    book, oldest first, in one query. The count is the denormalized column;
+    `liked` is an EXISTS probe of the (user, comment) unique index per row
+    found through the comment's book index, so no likes are scanned.
+    """
+    if user is not None and user.is_authenticated:
+        liked = Exists(CommentLike.objects.filter(user=user, comment=OuterRef('pk')))
+    else:
+        liked = Value(False)
+    rows = (
+        Comment.objects.filter(book_id=book_id)
+        .annotate(liked=liked)
+        .order_by('id')
+        .values_list('id', 'like_count', 'liked')
+    )
+    return [
+        {'comment_id': comment_id, 'like_count': like_count, 'liked': bool(is_liked)}
+        for comment_id, like_count, is_liked in rows
+    ]
@@ -0,0 +1,217 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from basic.benchmarking import scratch_database, seed_catalog, seed_interactions
+from basic.models import Author, Book, Chapter
+from readers.counters import reconcile
+
+# route -> URL arguments from (book id, chapter id, author id), query string
+ROUTES = {
+    'book-list': (lambda book, chapter, author: {}, ''),
+    'book-detail': (lambda book, chapter, author: {'id': book}, ''),
+    'chapter-detail': (lambda book, chapter, author: {'book_id': book, 'chapter_id': chapter}, '?toc=false'),
+    'author-detail': (lambda book, chapter, author: {'id': author}, ''),
+}
+
+# mode -> (server, suffix of the route names it calls)
+MODES = {
+    'wsgi': ('wsgi', ''),
+    'asgi-sync': ('asgi', ''),
+    'asgi-async': ('asgi', '-async'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the sync views under WSGI, the same views under ASGI and their async "
+        "variants under ASGI: requests per second and latency percentiles for book list, "
+        "book detail, chapter and author requests made by many concurrent clients. The "
+        "handlers are called in process, without a network server in front."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help="Concurrent clients, each waiting for its answer.")
+        parser.add_argument('--requests', type=int, default=20, help="Requests made by every client.")
+        parser.add_argument('--threads', type=int, default=16, help="Worker threads of the WSGI server.")
+        parser.add_argument('--books', type=int, default=500)
+        parser.add_argument('--routes', default=','.join(ROUTES), help="Comma separated routes to mix.")
+        parser.add_argument('--modes', default=','.join(MODES), help="Comma separated modes to run.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        routes = options['routes'].split(',')
+
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            # A file, so the threads of both servers share one database
+            with scratch_database(name=os.path.join(directory, 'bench.sqlite3')), \
+                    override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+                token, targets = self.seed(options)
+                connections.close_all()
+                for mode in options['modes'].split(','):
+                    server, suffix = MODES[mode]
+                    rng = random.Random(0)
+                    plans = [
+                        [self.url(rng.choice(routes) + suffix, rng.choice(targets))
+                         for _ in range(options['requests'])]
+                        for _ in range(options['clients'])
+                    ]
+                    run = self.run_wsgi if server == 'wsgi' else self.run_asgi
+                    asyncio.run(run(plans[:1], token, options))  # Warms caches and imports
+                    results.append({'mode': mode, **asyncio.run(run(plans, token, options))})
+                    connections.close_all()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':>11} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:>11} {row['requests_per_second']:>8} {row['p50_ms']:>8} "
+                f"{row['p99_ms']:>8} {row['errors']:>7}"
+            )
+
+    def seed(self, options):
+        seed_catalog(books=options['books'], chapters_per_book=5, chapter_words=300)
+        reader = seed_interactions(readers=20, forks=10)[0]
+        reconcile()
+        first_chapters = dict(Chapter.objects.filter(chapter_number=1).values_list('book_id', 'id'))
+        authors = dict(Book.objects.exclude(author=None).values_list('id', 'author_id'))
+        fallback_author = Author.objects.values_list('id', flat=True).first()
+        targets = [
+            (book_id, chapter_id, authors.get(book_id, fallback_author))
+            for book_id, chapter_id in first_chapters.items()
+        ]
+        return str(AccessToken.for_user(reader)), targets
+
+    @staticmethod
+    def url(name, target):
+        route = name.removesuffix('-async')
+        kwargs, query = ROUTES[route]
+        return reverse(name, kwargs=kwargs(*target) or None) + query
+
+    def run_wsgi(self, plans, token, options):
+        """A threaded WSGI server: `--threads` workers shared by all clients."""
+        application = WSGIHandler()
+        pool = ThreadPoolExecutor(max_workers=options['threads'])
+
+        def call(url):
+            path = urlsplit(url)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path.path, 'QUERY_STRING': path.query,
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'HTTP_AUTHORIZATION': f'Bearer {token}', 'HTTP_ACCEPT': 'application/json',
+                'wsgi.input': io.BytesIO(b''), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            response = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return status[0]
+
+        async def request(url):
+            return await asyncio.get_running_loop().run_in_executor(pool, call, url)
+
+        async def measure():
+            try:
+                return await self.drive(plans, request)
+            finally:
+                pool.shutdown()
+
+        return measure()
+
+    def run_asgi(self, plans, token, options):
+        """An ASGI server: one event loop, every client a coroutine."""
+        application = ASGIHandler()
+
+        async def request(url):
+            path = urlsplit(url)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path.path, 'raw_path': path.path.encode(),
+                'query_string': path.query.encode(), 'root_path': '',
+                'headers': [
+                    (b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode()),
+                    (b'accept', b'application/json'),
+                ],
+                'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+            }
+            finished = asyncio.Event()
+            received = False
+            status = []
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The handler listens for a disconnect until it has answered
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                    finished.set()
+
+            await application(scope, receive, send)
+            return status[0]
+
+        return self.drive(plans, request)
+
+    @staticmethod
+    async def drive(plans, request):
+        """Runs every client's requests one after the other, all clients at once."""
+        latencies = []
+        errors = []
+
+        async def client(urls):
+            for url in urls:
+                began = time.perf_counter()
+                try:
+                    status = await request(url)
+                except Exception as e:
+                    errors.append(f'{type(e).__name__}: {e}')
+                    continue
+                if status >= 400:
+                    errors.append(f'HTTP {status}')
+                    continue
+                latencies.append((time.perf_counter() - began) * 1000)
+
+        began = time.perf_counter()
+        await asyncio.gather(*(client(urls) for urls in plans))
+        elapsed = time.perf_counter() - began
+
+        latencies.sort()
+        return {
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+            'p99_ms': round(latencies[max(int(len(latencies) * 0.99) - 1, 0)], 2) if latencies else None,
+            'errors': len(errors),
+            'error_kinds': sorted(set(errors)),
+        }
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from basic.benchmarking import scratch_database, seed_catalog, summarize, time_call
+from readers.views import BookList
+
+
+class Command(BaseCommand):
+    help = "Records SQL query counts and latency of the book listing for several page sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=500, help="Number of books to seed.")
+        parser.add_argument('--chapters', type=int, default=30, help="Chapters seeded per book.")
+        parser.add_argument('--page-sizes', default='10,50,100', help="Comma separated page sizes to measure.")
+        parser.add_argument('--repeat', type=int, default=5, help="Requests timed per page size.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        results = []
+
+        with scratch_database():
+            seed_catalog(books=options['books'], chapters_per_book=options['chapters'])
+            factory = RequestFactory(SERVER_NAME='localhost')
+            view = BookList.as_view()
+
+            for page_size in page_sizes:
+                def fetch():
+                    response = view(factory.get('/readers/books/', {'page_size': page_size}))
+                    response.render()
+                    return response
+
+                with CaptureQueriesContext(connection) as queries:
+                    fetch()
+                timings = time_call(fetch, repeat=options['repeat'])
+                results.append({'page_size': page_size, 'queries': len(queries), **summarize(timings)})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'page size':>10} {'queries':>8} {'median ms':>10} {'max ms':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['page_size']:>10} {row['queries']:>8} {row['median_ms']:>10} {row['max_ms']:>8}"
+            )
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from basic.benchmarking import scratch_database, seed_catalog
+from basic.models import Book
+from readers.coalescing import interaction_writes
+from readers.counters import reconcile
+from readers.models import Comment
+
+# name -> (SQLITE_PRAGMAS, transaction mode, coalescing)
+VARIANTS = {
+    'stock': ({}, None, False),
+    'tuned': (settings.SQLITE_PRAGMAS, 'IMMEDIATE', False),
+    'tuned+coalescing': (settings.SQLITE_PRAGMAS, 'IMMEDIATE', True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures love, bookmark, rating and comment-like writes per second under "
+        "concurrent clients, with SQLite's defaults, with the production profile and "
+        "with the profile plus write coalescing. Runs against a scratch database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent client threads.")
+        parser.add_argument('--writes', type=int, default=100, help="Writes made by every client.")
+        parser.add_argument('--books', type=int, default=200)
+        parser.add_argument('--variants', default=','.join(VARIANTS), help="Comma separated variants to run.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        if not settings.SQLITE_PRAGMAS:
+            self.stderr.write("SQLITE_PROFILE is not 'production'; the tuned variants use no pragmas.")
+
+        # Failed writes are counted in the results instead
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        results = []
+        for name in options['variants'].split(','):
+            with tempfile.TemporaryDirectory() as directory:
+                with scratch_database(name=os.path.join(directory, 'bench.sqlite3')):
+                    clients = self.seed(options)
+                    with self.variant(*VARIANTS[name]):
+                        result = self.run(clients, options['writes'])
+                    # Counters that disagree with the rows written
+                    result['counter_drift'] = sum(reconcile(dry_run=True).values())
+                    results.append({'variant': name, **result})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'variant':>18} {'writes/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'per batch':>10} {'drift':>6}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['variant']:>18} {row['writes_per_second']:>9} {row['p50_ms']:>8} {row['p99_ms']:>8} "
+                f"{row['errors']:>7} {row['writes_per_batch'] or '-':>10} {row['counter_drift']:>6}"
+            )
+
+    def seed(self, options):
+        seed_catalog(books=options['books'], chapters_per_book=1, chapter_words=20)
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        users = User.objects.bulk_create([User(username=f'bench-writer-{i}') for i in range(options['clients'])])
+        comments = Comment.objects.bulk_create(
+            [Comment(user=users[0], book_id=book_id, content='Comment') for book_id in book_ids]
+        )
+        reconcile()
+        comment_books = {comment.id: comment.book_id for comment in comments}
+        return [(user, book_ids, comment_books) for user in users]
+
+    @contextmanager
+    def variant(self, pragmas, transaction_mode, coalescing):
+        """Applies a variant to the connections opened inside the block."""
+        options = connection.settings_dict['OPTIONS']
+        saved = dict(options)
+        options.pop('transaction_mode', None)
+        if transaction_mode:
+            options['transaction_mode'] = transaction_mode
+        connection.close()
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas, INTERACTION_WRITE_COALESCING=coalescing):
+                yield
+        finally:
+            interaction_writes.stop()
+            connection.close()
+            options.clear()
+            options.update(saved)
+
+    def run(self, clients, writes):
+        """Lets every client make `writes` writes at once; only successful ones count."""
+        latencies = []
+        errors = []
+        interaction_writes.stats.reset()
+        start_line = threading.Barrier(len(clients) + 1)
+
+        def client(user, book_ids, comment_books):
+            rng = random.Random(user.id)
+            api = APIClient(SERVER_NAME='localhost')
+            api.force_authenticate(user)
+            loved, bookmarked = set(), set()
+            unliked = list(comment_books)
+            rng.shuffle(unliked)
+            start_line.wait()
+            try:
+                for _ in range(writes):
+                    book_id = rng.choice(book_ids)
+                    kind = rng.choice(('love', 'bookmark', 'rating', 'like'))
+                    if kind == 'love':
+                        method = 'delete' if book_id in loved else 'post'
+                        loved ^= {book_id}
+                        call = (method, f'/readers/books/{book_id}/loves/', None)
+                    elif kind == 'bookmark':
+                        method = 'delete' if book_id in bookmarked else 'post'
+                        bookmarked ^= {book_id}
+                        call = (method, f'/readers/books/{book_id}/bookmarks/', None)
+                    elif kind == 'rating' or not unliked:
+                        call = ('post', f'/readers/books/{book_id}/ratings/',
+                                {'user_id': user.id, 'rating': rng.randint(0, 50) / 10})
+                    else:
+                        comment_id = unliked.pop()
+                        call = ('post', f'/readers/books/{comment_books[comment_id]}/comment-likes/',
+                                {'user_id': user.id, 'comment_id': comment_id})
+
+                    method, url, data = call
+                    began = time.perf_counter()
+                    try:
+                        response = getattr(api, method)(url, data, format='json')
+                    except OperationalError as e:
+                        errors.append(str(e))
+                        continue
+                    if response.status_code >= 400:
+                        errors.append(f'HTTP {response.status_code}')
+                        continue
+                    latencies.append((time.perf_counter() - began) * 1000)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=arguments) for arguments in clients]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        latencies.sort()
+        return {
+            'writes_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 2) if latencies else None,
+            'errors': len(errors),
+            'error_kinds': sorted(set(errors)),
+            **interaction_writes.stats.snapshot(),
+        }
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from readers.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recomputes the love/bookmark/rating/comment counters on books and the like counters on comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many rows have drifted.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = reconcile(dry_run=options['dry_run'])
+
+        verb = "drifted" if options['dry_run'] else "repaired"
+        for counter, rows in repaired.items():
+            self.stdout.write(f"{counter}: {rows} row(s) {verb}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(repaired.values())} row(s) {verb} in total."))
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Book = apps.get_model('basic', 'Book')
+    Comment = apps.get_model('readers', 'Comment')
+
+    def count_of(model_name, fk):
+        model = apps.get_model('readers', model_name)
+        counts = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(total=Count('*')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    Book.objects.update(
+        love_count=count_of('Love', 'book'),
+        bookmark_count=count_of('Bookmark', 'book'),
+        rating_count=count_of('Rating', 'book'),
+        comment_count=count_of('Comment', 'book'),
+    )
+    Comment.objects.update(like_count=count_of('CommentLike', 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0002_comment_updated_at_rating_updated_at_commentlike'),
+        ('basic', '0012_book_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
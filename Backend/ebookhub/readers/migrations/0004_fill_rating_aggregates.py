@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Book = apps.get_model('basic', 'Book')
+    Rating = apps.get_model('readers', 'Rating')
+
+    def aggregate_of(aggregate, condition=Q(), default=0):
+        values = (
+            Rating.objects.filter(condition, book=OuterRef('pk')).order_by()
+            .values('book').annotate(total=aggregate).values('total')
+        )
+        return Coalesce(Subquery(values), Value(default))
+
+    histogram = {}
+    for star in range(1, 6):
+        condition = Q()
+        if star > 1:
+            condition &= Q(rating__gte=Decimal(star) - Decimal('0.5'))
+        if star < 5:
+            condition &= Q(rating__lt=Decimal(star) + Decimal('0.5'))
+        histogram[f'rating_{star}_count'] = aggregate_of(Count('*'), condition)
+
+    Book.objects.update(
+        rating_sum=aggregate_of(Sum('rating'), default=Decimal(0)),
+        rating_count=aggregate_of(Count('*')),
+        **histogram,
+    )
+    Book.objects.update(rating=Case(
+        When(rating_count=0, then=Value(None)),
+        default=Round(Cast('rating_sum', FloatField()) / F('rating_count'), 1),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0003_comment_like_count'),
+        ('basic', '0013_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic', '0013_book_rating_aggregates'),
+        ('readers', '0004_fill_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='comment_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', 'like_count', 'id'], name='comment_book_likes_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic', '0014_hot_path_indexes'),
+        ('readers', '0005_comment_stream_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='bookmark_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='bookmark_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='comment_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='love',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='love_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='love',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='love_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='rating_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='rating_user_created_idx'),
+        ),
+    ]
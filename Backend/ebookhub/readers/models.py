@@ -1,6 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
-from basic.models import Book
+from basic.models import Book, Chapter
 
 # Love model: Track users who "love" a book
 class Love(models.Model):
@@ -10,6 +10,11 @@ class Love(models.Model):
 
     class Meta:
         unique_together = ('user', 'book')  # Ensure one love per user per book
+        indexes = [
+            # Per-book and per-user lists, newest first (keyset on created_at, id)
+            models.Index(fields=['book', 'created_at', 'id'], name='love_book_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='love_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} loves {self.book.title}'
@@ -22,6 +27,11 @@ class Bookmark(models.Model):
 
     class Meta:
         unique_together = ('user', 'book')  
+        indexes = [
+            # Per-book and per-user lists, newest first (keyset on created_at, id)
+            models.Index(fields=['book', 'created_at', 'id'], name='bookmark_book_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='bookmark_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} bookmarked {self.book.title}'
@@ -36,6 +46,11 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('user', 'book')  # Ensure one rating per user per book
+        indexes = [
+            # Per-book and per-user lists, newest first (keyset on created_at, id)
+            models.Index(fields=['book', 'created_at', 'id'], name='rating_book_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='rating_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} rated {self.book.title} {self.rating}'
@@ -47,6 +62,16 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)  # Track when the comment was last updated
+    like_count = models.PositiveIntegerField(default=0)  # Denormalized number of CommentLike rows
+
+    class Meta:
+        indexes = [
+            # Keyset orderings of the per-book comment stream
+            models.Index(fields=['book', 'created_at', 'id'], name='comment_book_created_idx'),
+            models.Index(fields=['book', 'like_count', 'id'], name='comment_book_likes_idx'),
+            # A user's comments, newest first
+            models.Index(fields=['user', 'created_at', 'id'], name='comment_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user.username} on {self.book.title}'
@@ -63,3 +88,21 @@ class CommentLike(models.Model):
     def __str__(self):
         return f'{self.user.username} liked a comment by {self.comment.user.username} on {self.comment.book.title}'
 
+
+# ReadingProgress model: Where a user is in a book, written by readers.progress
+class ReadingProgress(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reading_progress')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reading_progress')
+    chapter = models.ForeignKey(Chapter, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    offset = models.PositiveIntegerField(default=0)  # Position inside the chapter, in characters
+    updated_at = models.DateTimeField()  # When the client reported it, not when it was flushed
+
+    class Meta:
+        unique_together = ('user', 'book')  # One position per user per book
+        indexes = [
+            # The continue-reading shelf, most recently read first (keyset on updated_at, id)
+            models.Index(fields=['user', 'updated_at', 'id'], name='progress_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} is reading {self.book.title}'
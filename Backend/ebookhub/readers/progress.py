@@ -0,0 +1,200 @@
+"""
+Write-behind buffering of reading positions.
+
+Clients report where the reader is every few seconds, and only the latest
+report per user and book matters. With `READING_PROGRESS_BUFFERING` on,
+`reading_progress.record` just replaces that entry in memory; a background
+thread upserts everything pending every `READING_PROGRESS_FLUSH_SECONDS`
+(sooner once `READING_PROGRESS_MAX_PENDING` entries wait) in one batched
+INSERT ... ON CONFLICT DO UPDATE. A reader who pings ten times between two
+flushes costs one row write.
+
+Positions are best-effort: what is pending when a process dies without
+running its exit hooks is lost, which costs the reader a few seconds of
+progress. Reads that must see the latest position call `pending` or
+`flush_user` first; other processes' buffers are at most one flush
+interval behind.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from basic.models import Book, Chapter
+
+from .models import ReadingProgress
+
+logger = logging.getLogger(__name__)
+
+UPSERT_BATCH_SIZE = 500
+
+
+class BufferStats:
+    """Reports received and rows written by a buffer, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reports = 0
+        self.rows = 0
+        self.flushes = 0
+
+    def record_report(self):
+        with self._lock:
+            self.reports += 1
+
+    def record_flush(self, rows):
+        with self._lock:
+            self.rows += rows
+            self.flushes += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'reports': self.reports,
+                'rows_written': self.rows,
+                'flushes': self.flushes,
+                'reports_per_row': round(self.reports / self.rows, 2) if self.rows else None,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.reports = self.rows = self.flushes = 0
+
+
+class ProgressBuffer:
+    """The latest unsaved position per (user, book), flushed in batches."""
+
+    def __init__(self):
+        self.stats = BufferStats()
+        self._lock = threading.Lock()
+        # Held while writing, so an older batch never lands after a newer one
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user id -> {book id: (chapter id, offset, updated_at)}
+        self._size = 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._worker = None
+
+    def record(self, user_id, book_id, chapter_id, offset):
+        """Stores a reported position, now or with the next flush."""
+        self.stats.record_report()
+        entry = (chapter_id, offset, timezone.now())
+        if not getattr(settings, 'READING_PROGRESS_BUFFERING', False):
+            self._write({(user_id, book_id): entry})
+            return
+
+        with self._lock:
+            books = self._pending.setdefault(user_id, {})
+            if book_id not in books:
+                self._size += 1
+            books[book_id] = entry
+            full = self._size >= getattr(settings, 'READING_PROGRESS_MAX_PENDING', 5000)
+        self._start_worker()
+        if full:
+            self._wake.set()
+
+    def pending(self, user_id, book_id):
+        """The position waiting to be written for a user and book, if any."""
+        with self._lock:
+            return self._pending.get(user_id, {}).get(book_id)
+
+    def flush_user(self, user_id):
+        """Writes one user's pending positions right away."""
+        with self._flush_lock:
+            with self._lock:
+                books = self._pending.pop(user_id, {})
+                self._size -= len(books)
+            return self._write_or_requeue({(user_id, book_id): entry for book_id, entry in books.items()})
+
+    def flush(self):
+        """Writes every pending position; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._size = self._pending, {}, 0
+            return self._write_or_requeue({
+                (user_id, book_id): entry
+                for user_id, books in pending.items() for book_id, entry in books.items()
+            })
+
+    def stop(self):
+        """Flushes what is pending and ends the background thread."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+            self._stopping = worker is not None
+        if worker is not None and worker.is_alive():
+            self._wake.set()
+            worker.join()
+        self._stopping = False
+        self.flush()
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name='reading-progress-writer', daemon=True)
+                self._worker.start()
+
+    def _work(self):
+        interval = getattr(settings, 'READING_PROGRESS_FLUSH_SECONDS', 2)
+        while not self._stopping:
+            self._wake.wait(interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write buffered reading progress")
+        connection.close()
+
+    def _write_or_requeue(self, entries):
+        """Writes `entries`; if that fails, puts back those not reported again since."""
+        try:
+            return self._write(entries)
+        except Exception:
+            with self._lock:
+                for (user_id, book_id), entry in entries.items():
+                    books = self._pending.setdefault(user_id, {})
+                    if book_id not in books:
+                        books[book_id] = entry
+                        self._size += 1
+            raise
+
+    def _write(self, entries):
+        """
+        Upserts {(user id, book id): (chapter id, offset, updated_at)}. Rows
+        whose user or book was deleted since the report are dropped, and a
+        deleted chapter is stored as none, so one stale entry cannot fail
+        the batch.
+        """
+        if not entries:
+            return 0
+        user_ids = {user_id for user_id, _ in entries}
+        book_ids = {book_id for _, book_id in entries}
+        chapter_ids = {chapter_id for chapter_id, _, _ in entries.values() if chapter_id is not None}
+        users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        books = set(Book.objects.filter(id__in=book_ids).values_list('id', flat=True))
+        chapters = set(Chapter.objects.filter(id__in=chapter_ids).values_list('id', flat=True))
+
+        rows = [
+            ReadingProgress(
+                user_id=user_id, book_id=book_id, offset=offset, updated_at=updated_at,
+                chapter_id=chapter_id if chapter_id in chapters else None,
+            )
+            for (user_id, book_id), (chapter_id, offset, updated_at) in entries.items()
+            if user_id in users and book_id in books
+        ]
+        with transaction.atomic():
+            ReadingProgress.objects.bulk_create(
+                rows, batch_size=UPSERT_BATCH_SIZE, update_conflicts=True,
+                unique_fields=['user', 'book'], update_fields=['chapter', 'offset', 'updated_at'],
+            )
+        self.stats.record_flush(len(rows))
+        return len(rows)
+
+
+reading_progress = ProgressBuffer()
+# Positions still pending when the process exits normally are written
+atexit.register(reading_progress.flush)
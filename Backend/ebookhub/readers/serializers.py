@@ -1,10 +1,12 @@
 from rest_framework import serializers
-from .models import Love, Bookmark, Rating, Comment, CommentLike
-from basic.serializers import BookSerializer
+from .models import Love, Bookmark, Rating, Comment, CommentLike, ReadingProgress
+from basic.covers import cover_variant_urls
+from basic.models import Book, Chapter
+from basic.serializers import BookSerializer, DynamicFieldsMixin
 from django.contrib.auth.models import User
 
 # Love Serializer: Serialize the Love model
-class LoveSerializer(serializers.ModelSerializer):
+class LoveSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()  # Show the username
     book = BookSerializer()  # Include book details
 
@@ -14,7 +16,7 @@ class LoveSerializer(serializers.ModelSerializer):
 
 
 # Bookmark Serializer: Serialize the Bookmark model
-class BookmarkSerializer(serializers.ModelSerializer):
+class BookmarkSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()  # Show the username
     book = BookSerializer()  # Include book details
 
@@ -24,7 +26,7 @@ class BookmarkSerializer(serializers.ModelSerializer):
 
 
 # Rating Serializer: Serialize the Rating model
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()  # Show the username
     book = BookSerializer()  # Include book details
 
@@ -34,17 +36,18 @@ class RatingSerializer(serializers.ModelSerializer):
 
 
 # Comment Serializer: Serialize the Comment model
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()  # Show the username
     book = BookSerializer()  # Include book details
 
     class Meta:
         model = Comment
-        fields = ['user', 'book', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'book', 'content', 'created_at', 'updated_at', 'like_count']
+        read_only_fields = ['like_count']
 
 
 # CommentLike Serializer: Serialize the CommentLike model
-class CommentLikeSerializer(serializers.ModelSerializer):
+class CommentLikeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()  # Show the username
     comment = CommentSerializer()  # Include comment details
 
@@ -53,3 +56,37 @@ class CommentLikeSerializer(serializers.ModelSerializer):
         fields = ['user', 'comment', 'created_at']
 
 
+# ReadingProgress Serializers: the continue-reading shelf
+class ShelfBookSerializer(serializers.ModelSerializer):
+    cover_images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'cover_images']
+
+    def get_cover_images(self, obj):
+        return cover_variant_urls(obj, self.context.get('request'))
+
+
+class ShelfChapterSerializer(serializers.ModelSerializer):
+    length = serializers.IntegerField(source='content_length', read_only=True)
+
+    class Meta:
+        model = Chapter
+        fields = ['id', 'chapter_number', 'chapter_title', 'length']
+
+
+class ReadingProgressSerializer(serializers.ModelSerializer):
+    book = ShelfBookSerializer()
+    chapter = ShelfChapterSerializer()
+
+    # The columns rendered above, so the shelf is one joined query
+    load_fields = (
+        'id', 'offset', 'updated_at',
+        'book__id', 'book__title', 'book__cover_image', 'book__cover_variants',
+        'chapter__id', 'chapter__chapter_number', 'chapter__chapter_title', 'chapter__content_length',
+    )
+
+    class Meta:
+        model = ReadingProgress
+        fields = ['book', 'chapter', 'offset', 'updated_at']
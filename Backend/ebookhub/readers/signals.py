@@ -0,0 +1,39 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from basic.models import Author, Book, Chapter
+from .caching import invalidate_book_detail
+from .models import Comment
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Chapter)
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_detail_on_change(sender, instance, **kwargs):
+    """Drops the cached detail of the book a saved or deleted row belongs to."""
+    book_id = instance.id if sender is Book else instance.book_id
+    invalidate_book_detail(book_id)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def invalidate_detail_on_genres_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_book_detail(instance.id)
+    elif action == 'pre_clear':
+        # genre.book_set.clear(): the books have to be looked up before
+        # their links are gone (the invalidation itself waits for commit)
+        for book_id in Book.objects.filter(genre=instance).values_list('id', flat=True):
+            invalidate_book_detail(book_id)
+    elif action.startswith('post_') and pk_set:
+        # genre.book_set.add(...) and the like: instance is the Genre
+        for book_id in pk_set:
+            invalidate_book_detail(book_id)
+
+
+@receiver(post_save, sender=Author)
+def invalidate_detail_on_author_change(sender, instance, created, **kwargs):
+    if created:
+        return
+    for book_id in Book.objects.filter(author=instance).values_list('id', flat=True):
+        invalidate_book_detail(book_id)
@@ -1,3 +1,703 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from basic.forks import fork_book, save_chapter
+from basic.models import Book, Chapter, Genre, SupportedFormat
+from . import writes
+from .caching import book_detail_key, book_detail_stats
+from .coalescing import WriteCoalescer
+from .counters import bump, reconcile
+from .interactions import UserInteractions, comment_like_state
+from .models import Bookmark, Comment, CommentLike, Love, Rating, ReadingProgress
+from .progress import ProgressBuffer, reading_progress
+
+
+def make_book(publisher, **fields):
+    book_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+    return Book.objects.create(
+        title=fields.pop('title', 'A book'), publisher=publisher, date_published=date(2024, 1, 1),
+        format=book_format, **fields,
+    )
+
+
+class BookListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.reader = User.objects.create_user('reader')
+        for number in range(80):
+            book = make_book(author, title=f'Book {number}', can_fork=True)
+            chapters = Chapter.objects.bulk_create([
+                Chapter(book=book, chapter_title=f'Chapter {chapter}', content='Text', chapter_number=chapter)
+                for chapter in range(1, 7)
+            ])
+            if number % 3 == 0:
+                # Forks land between the originals, on every page
+                fork = fork_book(book, cls.reader)
+                if number % 2 == 0:
+                    save_chapter(fork, chapters[0], chapter_title='Own chapter 1')
+            if number % 4 == 0:
+                Love.objects.create(user=cls.reader, book=book)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        # Books, genres, first chapters, then the reader's loves, bookmarks
+        # and ratings
+        for page_size in (10, 100):
+            with self.subTest(page_size=page_size), self.assertNumQueries(6):
+                page = client.get(reverse('book-list'), {'page_size': page_size}).json()
+            self.assertEqual(len(page['results']), page_size)
+
+        forks = [book for book in page['results'] if book['title'].endswith('[Forked]')]
+        self.assertEqual(len(forks), 25)
+        # The fork's own copy in place of the shared chapter it replaced
+        self.assertEqual([chapter['chapter_title'] for chapter in forks[0]['chapters']],
+                         ['Own chapter 1', 'Chapter 2', 'Chapter 3', 'Chapter 4', 'Chapter 5'])
+        self.assertTrue(page['results'][0]['is_loved'])
+
+    def test_anonymous_query_count(self):
+        for page_size in (10, 100):
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                self.client.get(reverse('book-list'), {'page_size': page_size})
+
+
+class BookDownloadTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root, DOWNLOAD_OFFLOAD='')
+        cls.media.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.book = make_book(User.objects.create_user('publisher'))
+        self.book.file.save('book.epub', ContentFile(self.content))
+        self.url = reverse('book-download', args=[self.book.id])
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file_with_validators(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+
+    def test_matching_if_none_match_is_not_modified(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_stale_if_none_match_sends_the_file(self):
+        response, body = self.get(if_none_match='"0-0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_range(self):
+        response, body = self.get(range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_suffix_range(self):
+        response, body = self.get(range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[-5:])
+
+    def test_range_past_the_end_is_unsatisfiable(self):
+        response, _ = self.get(range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_several_ranges_send_the_whole_file(self):
+        response, body = self.get(range='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(range='bytes=0-3', if_range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[:4])
+
+        # Another version of the file: the whole current one instead
+        response, body = self.get(range='bytes=0-3', if_range='"0-0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_missing_file(self):
+        self.book.file.storage.delete(self.book.file.name)
+        self.assertEqual(self.get()[0].status_code, 404)
+        with override_settings(DOWNLOAD_OFFLOAD='nginx'):
+            response, _ = self.get()
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(DOWNLOAD_OFFLOAD='nginx', DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_nginx_offload(self):
+        response, body = self.get(range='bytes=0-3')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.book.file.name}')
+        self.assertEqual(body, b'')
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader')
+        self.book = make_book(User.objects.create_user('publisher'))
+
+    def test_interactions_bump_counters(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+
+        self.assertEqual(client.post(reverse('love-list', args=[self.book.id])).status_code, 201)
+        self.assertEqual(client.post(reverse('bookmark-list', args=[self.book.id])).status_code, 201)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.love_count, self.book.bookmark_count), (1, 1))
+
+        self.assertEqual(client.delete(reverse('love-list', args=[self.book.id])).status_code, 204)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.love_count, 0)
+
+    def test_bump(self):
+        bump(Book, self.book.id, love_count=2, comment_count=1)
+        bump(Book, self.book.id, love_count=-1)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.love_count, self.book.comment_count), (1, 1))
+
+    def test_reconcile_repairs_drift(self):
+        other = User.objects.create_user('other')
+        # Rows written behind the counters' back
+        Love.objects.create(user=self.reader, book=self.book)
+        Love.objects.create(user=other, book=self.book)
+        Rating.objects.create(user=self.reader, book=self.book, rating=4)
+        Rating.objects.create(user=other, book=self.book, rating=2)
+        Book.objects.filter(id=self.book.id).update(bookmark_count=7)
+        untouched = make_book(self.book.publisher, title='Untouched')
+
+        report = reconcile(dry_run=True)
+        self.assertEqual(report['Book.love_count'], 1)
+        self.assertEqual(report['Book.bookmark_count'], 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.love_count, 0)  # A dry run changes nothing
+
+        report = reconcile()
+        self.assertEqual(report['Book.love_count'], 1)
+        self.assertEqual(report['Book.rating'], 1)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.love_count, self.book.bookmark_count), (2, 0))
+        self.assertEqual((self.book.rating_count, self.book.rating_sum), (2, 6))
+        self.assertEqual((self.book.rating_2_count, self.book.rating_4_count), (1, 1))
+        self.assertEqual(self.book.rating, Decimal('3.0'))
+        untouched.refresh_from_db()
+        self.assertEqual((untouched.love_count, untouched.rating), (0, None))
+
+        self.assertFalse(any(reconcile(dry_run=True).values()))
+
+    def test_reconcile_retires_cached_details(self):
+        request = RequestFactory().get('/')
+        before = book_detail_key(self.book.id, request)
+        Love.objects.create(user=self.reader, book=self.book)
+        with self.captureOnCommitCallbacks(execute=True):
+            reconcile()
+        self.assertNotEqual(book_detail_key(self.book.id, request), before)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = make_book(User.objects.create_user('publisher'))
+        self.readers = [User.objects.create_user(f'reader{number}') for number in range(2)]
+        self.url = reverse('rating-list', args=[self.book.id])
+
+    def rate(self, user, rating):
+        return self.client.post(self.url, {'user_id': user.id, 'rating': rating})
+
+    def aggregates(self):
+        self.book.refresh_from_db()
+        return self.book.rating, self.book.rating_count, self.book.rating_sum, self.book.rating_histogram
+
+    def test_votes_move_the_running_aggregates(self):
+        self.assertEqual(self.rate(self.readers[0], 4).json()['average_rating'], Decimal('4.0'))
+        self.rate(self.readers[1], 2)
+        self.assertEqual(self.aggregates(),
+                         (Decimal('3.0'), 2, Decimal('6.0'), {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}))
+
+        # A changed vote moves from its old star to the new one
+        self.rate(self.readers[0], 4.6)
+        self.assertEqual(self.aggregates(),
+                         (Decimal('3.3'), 2, Decimal('6.6'), {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+
+        client = APIClient()
+        client.force_authenticate(self.readers[1])
+        self.assertEqual(client.delete(self.url).status_code, 204)
+        self.assertEqual(client.delete(self.url).status_code, 404)
+        self.assertEqual(self.aggregates(),
+                         (Decimal('4.6'), 1, Decimal('4.6'), {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1}))
+
+        client.force_authenticate(self.readers[0])
+        client.delete(self.url)
+        self.assertEqual(self.aggregates()[:3], (None, 0, Decimal('0.0')))
+
+    def test_invalid_votes(self):
+        for rating in ('five', -1, 5.5):
+            with self.subTest(rating=rating):
+                self.assertEqual(self.rate(self.readers[0], rating).status_code, 400)
+        self.assertEqual(self.aggregates()[1], 0)
+
+    def test_histogram_on_book_detail(self):
+        self.rate(self.readers[0], 3)
+        client = APIClient()
+        client.force_authenticate(self.readers[1])
+        detail = client.get(reverse('book-detail', args=[self.book.id])).json()
+        self.assertEqual(detail['rating_histogram'], {'1': 0, '2': 0, '3': 1, '4': 0, '5': 0})
+        self.assertEqual(detail['rating'], '3.0')
+
+
+class BookDetailCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        book_detail_stats.reset()
+        self.book = make_book(User.objects.create_user('publisher'), title='Moby Dick')
+        self.lover, self.other = User.objects.create_user('lover'), User.objects.create_user('other')
+        Love.objects.create(user=self.lover, book=self.book)
+        self.url = reverse('book-detail', args=[self.book.id])
+
+    def get(self, user=None, **params):
+        client = APIClient()
+        client.force_authenticate(user or self.other)
+        return client.get(self.url, params).json()
+
+    def test_shared_part_is_cached_once_for_every_reader(self):
+        self.assertFalse(self.get()['is_loved'])
+        self.assertTrue(self.get(self.lover)['is_loved'])
+        self.assertEqual(book_detail_stats.snapshot(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+        # Fieldsets are served from the database, not the cache
+        self.assertEqual(set(self.get(fields='id,title')), {'id', 'title'})
+        self.assertEqual(book_detail_stats.snapshot()['misses'], 1)
+        self.assertEqual(book_detail_stats.snapshot()['hits'], 1)
+
+    def test_changes_retire_the_cached_detail_on_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.book.title = 'The Whale'
+            self.book.save()
+            # Not committed yet: readers keep getting the committed state
+            self.assertEqual(self.get()['title'], 'Moby Dick')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get()['title'], 'The Whale')
+
+    def test_rolled_back_change_keeps_the_cached_detail(self):
+        request = RequestFactory().get('/')
+        before = book_detail_key(self.book.id, request)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.book.title = 'Rolled back'
+                    self.book.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(book_detail_key(self.book.id, request), before)
+
+    def test_related_changes(self):
+        changes = [
+            lambda: self.book.genre.add(Genre.objects.create(name='Adventure')),
+            lambda: Genre.objects.get(name='Adventure').book_set.clear(),
+            lambda: Chapter.objects.create(book=self.book, chapter_title='Loomings', content='Text', chapter_number=1),
+            lambda: Comment.objects.create(user=self.other, book=self.book, content='Great'),
+        ]
+        request = RequestFactory().get('/')
+        for change in changes:
+            before = book_detail_key(self.book.id, request)
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertNotEqual(book_detail_key(self.book.id, request), before)
+
+
+class InteractionFlagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        publisher = User.objects.create_user('publisher')
+        cls.reader = User.objects.create_user('reader')
+        cls.books = [make_book(publisher, title=f'Book {number}') for number in range(30)]
+        for book in cls.books[::2]:
+            Love.objects.create(user=cls.reader, book=book)
+        for book in cls.books[::3]:
+            Bookmark.objects.create(user=cls.reader, book=book)
+        Rating.objects.create(user=cls.reader, book=cls.books[0], rating=Decimal('4.5'))
+
+    def expected(self, book):
+        index = self.books.index(book)
+        return {
+            'is_loved': index % 2 == 0,
+            'is_bookmarked': index % 3 == 0,
+            'user_rating': Decimal('4.5') if index == 0 else None,
+        }
+
+    def test_three_queries_for_any_number_of_books(self):
+        with self.assertNumQueries(3):
+            interactions = UserInteractions(self.reader, [book.id for book in self.books])
+        for book in self.books:
+            self.assertEqual(interactions.for_book(book.id), self.expected(book))
+
+    def test_async_load_matches(self):
+        book_ids = [book.id for book in self.books]
+        interactions = async_to_sync(UserInteractions.aload)(self.reader, book_ids)
+        self.assertEqual([interactions.for_book(book_id) for book_id in book_ids],
+                         [self.expected(book) for book in self.books])
+
+    def test_library_lists_carry_the_flags(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        page = client.get(reverse('books-loved-by-user', args=[self.reader.id]), {'page_size': 100}).json()
+        books = {book.id: book for book in self.books}
+        self.assertEqual(len(page['results']), 15)
+        for book in page['results']:
+            expected = self.expected(books[book['id']])
+            self.assertEqual((book['is_loved'], book['is_bookmarked']), (True, expected['is_bookmarked']))
+
+        # Someone else's library shows the caller's own flags
+        other = User.objects.create_user('other')
+        client.force_authenticate(other)
+        page = client.get(reverse('books-loved-by-user', args=[self.reader.id])).json()
+        self.assertFalse(any(book['is_loved'] for book in page['results']))
+        # Anonymous callers get the plain representation
+        page = self.client.get(reverse('books-loved-by-user', args=[self.reader.id])).json()
+        self.assertNotIn('is_loved', page['results'][0])
+
+
+class CommentStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = make_book(User.objects.create_user('publisher'))
+        cls.readers = [User.objects.create_user(f'reader{number}') for number in range(4)]
+        cls.comments = []
+        for number in range(12):
+            comment = Comment.objects.create(user=cls.readers[0], book=cls.book, content=f'Comment {number}')
+            cls.comments.append(comment)
+        # Comments 5, 2 and 9 get 3, 2 and 1 likes
+        for comment, likes in ((cls.comments[5], 3), (cls.comments[2], 2), (cls.comments[9], 1)):
+            for reader in cls.readers[:likes]:
+                CommentLike.objects.create(user=reader, comment=comment)
+        reconcile()
+
+    def walk(self, ordering):
+        client = APIClient()
+        client.force_authenticate(self.readers[0])
+        url = reverse('comment-list', args=[self.book.id]) + f'?ordering={ordering}&page_size=5'
+        seen = []
+        while url:
+            page = client.get(url).json()
+            seen.extend(comment['id'] for comment in page['results'])
+            url = page['next']
+        return seen
+
+    def test_orderings(self):
+        ids = [comment.id for comment in self.comments]
+        self.assertEqual(self.walk('newest'), ids[::-1])
+        self.assertEqual(self.walk('oldest'), ids)
+        most_liked = self.walk('most_liked')
+        self.assertEqual(most_liked[:3], [ids[5], ids[2], ids[9]])
+        self.assertEqual(sorted(most_liked), sorted(ids))
+
+    def test_unknown_ordering(self):
+        response = self.client.get(reverse('comment-list', args=[self.book.id]), {'ordering': 'random'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_book_detail_embeds_only_the_newest_comments(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.readers[1])
+        detail = client.get(reverse('book-detail', args=[self.book.id])).json()
+        self.assertEqual(detail['comment_count'], 12)
+        self.assertEqual([comment['id'] for comment in detail['comments']],
+                         [comment.id for comment in self.comments[:-4:-1]])
+
+
+class CommentLikeStateTests(TestCase):
+    def setUp(self):
+        self.book = make_book(User.objects.create_user('publisher'))
+        self.reader, self.other = User.objects.create_user('reader'), User.objects.create_user('other')
+        self.first = Comment.objects.create(user=self.other, book=self.book, content='First')
+        self.second = Comment.objects.create(user=self.other, book=self.book, content='Second')
+        Comment.objects.create(user=self.other, book=make_book(self.book.publisher), content='Elsewhere')
+        for user in (self.reader, self.other):
+            self.client.post(reverse('comment-like-list', args=[self.book.id]),
+                             {'user_id': user.id, 'comment_id': self.first.id})
+
+    def test_liked_flag_follows_the_user(self):
+        with self.assertNumQueries(1):
+            state = comment_like_state(self.book.id, self.reader)
+        self.assertEqual(state, [
+            {'comment_id': self.first.id, 'like_count': 2, 'liked': True},
+            {'comment_id': self.second.id, 'like_count': 0, 'liked': False},
+        ])
+        self.assertEqual([row['liked'] for row in comment_like_state(self.book.id, None)], [False, False])
+
+    def test_endpoint(self):
+        url = reverse('comment-like-list', args=[self.book.id])
+        anonymous = self.client.get(url).json()
+        self.assertEqual([(row['like_count'], row['liked']) for row in anonymous], [(2, False), (0, False)])
+
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        self.assertEqual([row['liked'] for row in client.get(url).json()], [True, False])
+        self.assertEqual(client.get(reverse('comment-like-list', args=[0])).status_code, 404)
+
+    def test_second_like_is_refused(self):
+        response = self.client.post(reverse('comment-like-list', args=[self.book.id]),
+                                    {'user_id': self.reader.id, 'comment_id': self.first.id})
+        self.assertEqual(response.status_code, 400)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.like_count, 2)
+
+
+@override_settings(INTERACTION_WRITE_COALESCING=True, INTERACTION_WRITE_WINDOW_MS=200)
+class WriteCoalescingTests(TransactionTestCase):
+    def setUp(self):
+        self.coalescer = WriteCoalescer('test')
+        self.addCleanup(self.coalescer.stop)
+        publisher = User.objects.create_user('publisher')
+        self.books = [make_book(publisher, title=f'Book {number}') for number in range(3)]
+        self.readers = [User.objects.create_user(f'reader{number}') for number in range(3)]
+
+    def run_together(self, calls):
+        """Runs each call from a thread of its own; returns results or exceptions in order."""
+        outcomes = [None] * len(calls)
+
+        def call(index, func, *args):
+            try:
+                outcomes[index] = self.coalescer.run(func, *args)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(index, *item)) for index, item in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_one_failing_write_leaves_the_others_committed(self):
+        Love.objects.create(user=self.readers[0], book=self.books[0])
+        outcomes = self.run_together([
+            (writes.add_love, self.readers[0].id, self.books[0].id),  # Already loved
+            (writes.add_love, self.readers[1].id, self.books[0].id),
+            (writes.add_bookmark, self.readers[2].id, self.books[1].id),
+        ])
+
+        self.assertIsInstance(outcomes[0], IntegrityError)
+        self.assertIsInstance(outcomes[1], Love)
+        self.assertIsInstance(outcomes[2], Bookmark)
+        self.assertEqual(self.coalescer.stats.snapshot(), {'writes': 3, 'batches': 1, 'writes_per_batch': 3.0})
+        self.assertEqual(Love.objects.filter(book=self.books[0]).count(), 2)
+        self.assertTrue(Bookmark.objects.filter(user=self.readers[2], book=self.books[1]).exists())
+        # The failed write's counter bump went with its savepoint
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].love_count, 1)
+
+    def test_writes_inside_a_transaction_run_in_place(self):
+        with transaction.atomic():
+            self.coalescer.run(writes.add_love, self.readers[0].id, self.books[0].id)
+            self.assertTrue(Love.objects.filter(user=self.readers[0]).exists())
+        self.assertEqual(self.coalescer.stats.snapshot()['batches'], 0)
+
+    @override_settings(INTERACTION_WRITE_COALESCING=False)
+    def test_off(self):
+        self.assertTrue(self.coalescer.run(writes.add_love, self.readers[0].id, self.books[0].id))
+        self.assertEqual(self.coalescer.stats.snapshot()['batches'], 0)
+
+
+class SqlitePragmaTests(TestCase):
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234, 'cache_size': -2048})
+    def test_new_connections_get_the_pragmas(self):
+        other = connections.create_connection(connection.alias)
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -2048)
+
+
+@override_settings(READING_PROGRESS_BUFFERING=True)
+class ReadingProgressTests(TestCase):
+    def setUp(self):
+        self.buffer = ProgressBuffer()
+        # Flushed by hand below instead of by the background thread
+        for buffer in (self.buffer, reading_progress):
+            patcher = mock.patch.object(buffer, '_start_worker')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(reading_progress.flush)
+        self.reader, self.other = User.objects.create_user('reader'), User.objects.create_user('other')
+        self.book = make_book(User.objects.create_user('publisher'))
+        self.chapters = Chapter.objects.bulk_create([
+            Chapter(book=self.book, chapter_title=f'Chapter {number}', content='Text', chapter_number=number)
+            for number in range(1, 4)
+        ])
+
+    def test_keeps_the_latest_position(self):
+        for offset in range(10):
+            self.buffer.record(self.reader.id, self.book.id, self.chapters[0].id, offset)
+        self.buffer.record(self.reader.id, self.book.id, self.chapters[1].id, 40)
+        self.buffer.record(self.other.id, self.book.id, self.chapters[2].id, 7)
+        self.assertEqual(self.buffer.pending(self.reader.id, self.book.id)[:2], (self.chapters[1].id, 40))
+        self.assertFalse(ReadingProgress.objects.exists())
+
+        with self.assertNumQueries(6):  # Three existence checks, one savepoint pair, one upsert
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            set(ReadingProgress.objects.values_list('user_id', 'chapter_id', 'offset')),
+            {(self.reader.id, self.chapters[1].id, 40), (self.other.id, self.chapters[2].id, 7)},
+        )
+        self.assertEqual(self.buffer.stats.snapshot(), {
+            'reports': 12, 'rows_written': 2, 'flushes': 1, 'reports_per_row': 6.0,
+        })
+
+        # The next flush updates the row in place
+        self.buffer.record(self.reader.id, self.book.id, self.chapters[2].id, 3)
+        self.buffer.flush()
+        self.assertEqual(ReadingProgress.objects.get(user=self.reader).chapter_id, self.chapters[2].id)
+        self.assertEqual(ReadingProgress.objects.count(), 2)
+
+    def test_failed_write_requeues_unless_reported_again(self):
+        self.buffer.record(self.reader.id, self.book.id, self.chapters[0].id, 10)
+        self.buffer.record(self.other.id, self.book.id, self.chapters[0].id, 20)
+
+        def fail_after_a_new_report(entries):
+            # A report that arrives while the batch is being written wins
+            self.buffer.record(self.reader.id, self.book.id, self.chapters[1].id, 99)
+            raise DatabaseError('locked')
+
+        with mock.patch.object(self.buffer, '_write', side_effect=fail_after_a_new_report):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending(self.reader.id, self.book.id)[:2], (self.chapters[1].id, 99))
+        self.assertEqual(self.buffer.pending(self.other.id, self.book.id)[:2], (self.chapters[0].id, 20))
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(ReadingProgress.objects.get(user=self.reader).offset, 99)
+
+    def test_stale_entries_do_not_fail_the_batch(self):
+        gone = User.objects.create_user('gone')
+        self.buffer.record(gone.id, self.book.id, self.chapters[0].id, 1)
+        self.buffer.record(self.reader.id, self.book.id, self.chapters[2].id, 5)
+        gone.delete()
+        self.chapters[2].delete()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertIsNone(ReadingProgress.objects.get(user=self.reader).chapter_id)
+
+    def test_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        url = reverse('reading-progress', args=[self.book.id])
+        self.assertEqual(client.get(url).status_code, 404)
+        self.assertEqual(client.put(url, {'chapter_id': 0, 'offset': 1}, format='json').status_code, 404)
+        self.assertEqual(client.put(url, {'chapter_id': 'x'}, format='json').status_code, 400)
+        self.assertEqual(client.put(url, {'chapter_id': self.chapters[0].id, 'offset': -1}, format='json').status_code, 400)
+
+        response = client.put(url, {'chapter_id': self.chapters[1].id, 'offset': 120}, format='json')
+        self.assertEqual(response.status_code, 202)
+        # Read back from the buffer before it is written
+        self.assertFalse(ReadingProgress.objects.exists())
+        self.assertEqual(client.get(url).json()['offset'], 120)
+
+        other_book = make_book(self.book.publisher, title='Other')
+        ReadingProgress.objects.create(user=self.reader, book=other_book, offset=3,
+                                       updated_at=timezone.now() - timedelta(hours=1))
+        shelf = client.get(reverse('continue-reading')).json()['results']
+        self.assertEqual([(entry['book']['id'], entry['offset']) for entry in shelf],
+                         [(self.book.id, 120), (other_book.id, 3)])
+        self.assertEqual(shelf[0]['chapter']['id'], self.chapters[1].id)
+        self.assertIsNone(reading_progress.pending(self.reader.id, self.book.id))
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        publisher = User.objects.create_user('publisher')
+        cls.reader = User.objects.create_user('reader')
+        genre = Genre.objects.create(name='Fiction')
+        cls.books = [make_book(publisher, title=f'Book {number}', can_fork=True) for number in range(12)]
+        for book in cls.books:
+            book.genre.add(genre)
+            Chapter.objects.bulk_create([
+                Chapter(book=book, chapter_title=f'Chapter {number}', content='Text', chapter_number=number)
+                for number in range(1, 4)
+            ])
+        Love.objects.create(user=cls.reader, book=cls.books[1])
+        Rating.objects.create(user=cls.reader, book=cls.books[1], rating=4)
+        cls.fork = fork_book(cls.books[1], cls.reader)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assertSamePayload(self, name, *, query=None, **kwargs):
+        sync_url, async_url = reverse(name, kwargs=kwargs), reverse(f'{name}-async', kwargs=kwargs)
+        sync = self.client.get(sync_url, query)
+        asynchronous = self.client.get(async_url, query)
+        self.assertEqual(asynchronous.status_code, sync.status_code)
+        # Pagination links point back at the route that was called
+        self.assertEqual(json.loads(asynchronous.content.decode().replace(async_url, sync_url)), sync.json())
+        return sync
+
+    def test_book_list(self):
+        self.assertSamePayload('book-list')
+        self.client.force_authenticate(self.reader)
+        response = self.assertSamePayload('book-list', query={'page_size': 5, 'fields': 'id,title,is_loved'})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(self.assertSamePayload('book-list', query={'cursor': 'garbage'}).status_code, 404)
+
+    def test_book_detail(self):
+        # Both need a user
+        self.assertEqual(self.assertSamePayload('book-detail', id=self.books[1].id).status_code, 401)
+        self.client.force_authenticate(self.reader)
+        for book in (self.books[1], self.books[2], self.fork):
+            with self.subTest(book=book.title):
+                self.assertSamePayload('book-detail', id=book.id)
+        self.assertSamePayload('book-detail', id=self.books[1].id, query={'fields': 'id,title'})
+        self.assertEqual(self.assertSamePayload('book-detail', id=0).status_code, 404)
+
+    def test_chapter_detail(self):
+        shared = Chapter.objects.filter(book=self.books[1]).order_by('chapter_number')[1]
+        self.assertSamePayload('chapter-detail', book_id=self.books[1].id, chapter_id=shared.id)
+        # A fork's chapter read from its original
+        response = self.assertSamePayload('chapter-detail', book_id=self.fork.id, chapter_id=shared.id)
+        self.assertEqual(response.json()['chapter']['id'], shared.id)
+        self.assertSamePayload('chapter-detail', book_id=self.fork.id, chapter_id=shared.id, query={'toc': 'false'})
+        self.assertSamePayload('chapter-detail', book_id=self.books[2].id, chapter_id=shared.id)
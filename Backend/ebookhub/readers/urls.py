@@ -1,8 +1,13 @@
 from django.urls import path
-from readers import views
+from readers import async_views, views
 urlpatterns = [
     path('books/', views.BookList.as_view(), name='book-list'),  
     path('books/<int:book_id>/c/<int:chapter_id>/', views.ChapterDetail.as_view(), name='chapter-detail'),    
+    path('books/<int:book_id>/toc/', views.BookTOCView.as_view(), name='book-toc'),
+    path('books/<int:book_id>/download/', views.BookDownloadView.as_view(), name='book-download'),
+    path('books/<int:book_id>/search/', views.BookFindView.as_view(), name='book-find'),
+    path('books/<int:book_id>/progress/', views.ReadingProgressView.as_view(), name='reading-progress'),
+    path('continue-reading/', views.ContinueReadingView.as_view(), name='continue-reading'),
 
     # Routes for a specific book's actions by user 
     path('books/<int:book_id>/loves/', views.LoveList.as_view(), name='love-list'),
@@ -17,5 +22,10 @@ urlpatterns = [
     path('users/<int:user_id>/bookmarked-books/', views.BooksBookmarkedByUserView.as_view(), name='books-bookmarked-by-user'),
     path('users/<int:user_id>/rated-books/', views.BooksRatedByUserView.as_view(), name='books-rated-by-user'),
     path('users/<int:user_id>/commented-books/', views.BooksCommentedByUserView.as_view(), name='books-commented-by-user'),
+
+    # Async-native variants for the ASGI stack (see readers.async_views)
+    path('async/books/', async_views.book_list, name='book-list-async'),
+    path('async/books/<int:id>/', async_views.book_detail, name='book-detail-async'),
+    path('async/books/<int:book_id>/c/<int:chapter_id>/', async_views.chapter_detail, name='chapter-detail-async'),
     
 ]
@@ -1,23 +1,36 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.exceptions import PermissionDenied
-from rest_framework import status, generics
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from rest_framework import status
 
 
+from decimal import Decimal
+
 from django.contrib.auth.models import User
-from django.db.models import Avg  # Import Avg for aggregation
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.http import Http404
 
 from basic.models import Book,Chapter
-from basic.serializers import BookSerializer,ChapterSerializer, BookDetailSerializer
-from readers.models import Love, Bookmark, Rating, Comment, CommentLike
-from readers.serializers import LoveSerializer, BookmarkSerializer, RatingSerializer, CommentSerializer, CommentLikeSerializer
+from basic.pagination import KeysetPagination
+from basic.toc import get_book_toc, neighbours
+from basic.search import find_in_book
+from basic.forks import find_chapter
+from basic.serializers import BookSerializer,ChapterSerializer
+from readers.models import Love, Bookmark, Rating, Comment, CommentLike, ReadingProgress
+from readers.caching import get_book_detail
+from readers.downloads import download_response
+from readers import writes
+from readers.coalescing import interaction_writes
+from readers.progress import reading_progress
+from readers.interactions import comment_like_state, interaction_context
+from readers.serializers import LoveSerializer, BookmarkSerializer, RatingSerializer, CommentSerializer, CommentLikeSerializer, ReadingProgressSerializer
+from ebookhub.routers import primary_reads
 
 
 # Pagination Class
-class BookPagination(PageNumberPagination):
+class BookPagination(KeysetPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
@@ -26,10 +39,11 @@ class BookPagination(PageNumberPagination):
 # Book List View - List all books
 class BookList(APIView):
     def get(self, request):
-        books = Book.objects.all().order_by('id')
+        books = BookSerializer.shape_queryset(Book.objects.all().order_by('id'), request.query_params)
         paginator = BookPagination()
         result_page = paginator.paginate_queryset(books, request)
-        serializer = BookSerializer(result_page, many=True)
+        context = {'query_params': request.query_params, **interaction_context(request, result_page)}
+        serializer = BookSerializer(result_page, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
 
@@ -38,9 +52,11 @@ class LoveList(APIView):
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
 
     def get(self, request, book_id):
-        loves = Love.objects.filter(book_id=book_id)
-        serializer = LoveSerializer(loves, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        loves = LoveSerializer.shape_queryset(Love.objects.filter(book_id=book_id), request.query_params)
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(loves, request)
+        serializer = LoveSerializer(result_page, many=True, context={'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, book_id):
         user = request.user  # Get the authenticated user
@@ -52,8 +68,7 @@ class LoveList(APIView):
         if Love.objects.filter(user=user, book=book).exists():
             return Response({"detail": "You have already loved this book."}, status=status.HTTP_400_BAD_REQUEST)
 
-        love = Love(user=user, book=book)
-        love.save()
+        love = interaction_writes.run(writes.add_love, user.id, book.id)
 
         serializer = LoveSerializer(love)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -69,7 +84,7 @@ class LoveList(APIView):
         if not love:
             return Response({"detail": "You have not loved this book."}, status=status.HTTP_404_NOT_FOUND)
 
-        love.delete()
+        interaction_writes.run(writes.remove_love, user.id, book.id)
         return Response({"detail": "Love removed."}, status=status.HTTP_204_NO_CONTENT)
     
 
@@ -79,9 +94,11 @@ class BookmarkList(APIView):
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
 
     def get(self, request, book_id):
-        bookmarks = Bookmark.objects.filter(book_id=book_id)
-        serializer = BookmarkSerializer(bookmarks, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        bookmarks = BookmarkSerializer.shape_queryset(Bookmark.objects.filter(book_id=book_id), request.query_params)
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(bookmarks, request)
+        serializer = BookmarkSerializer(result_page, many=True, context={'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, book_id):
         user = request.user  # Get the authenticated user
@@ -93,8 +110,7 @@ class BookmarkList(APIView):
         if Bookmark.objects.filter(user=user, book=book).exists():
             return Response({"detail": "You have already bookmarked this book."}, status=status.HTTP_400_BAD_REQUEST)
 
-        bookmark = Bookmark(user=user, book=book)
-        bookmark.save()
+        bookmark = interaction_writes.run(writes.add_bookmark, user.id, book.id)
 
         serializer = BookmarkSerializer(bookmark)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -110,7 +126,7 @@ class BookmarkList(APIView):
         if not bookmark:
             return Response({"detail": "You have not bookmarked this book."}, status=status.HTTP_404_NOT_FOUND)
 
-        bookmark.delete()
+        interaction_writes.run(writes.remove_bookmark, user.id, book.id)
         serializer = BookmarkSerializer(bookmark)
         return Response(serializer.data, status=status.HTTP_204_NO_CONTENT)
 
@@ -120,9 +136,11 @@ class BookmarkList(APIView):
 class RatingList(APIView):
     def get(self, request, book_id):
         # Retrieve all ratings for the book
-        ratings = Rating.objects.filter(book_id=book_id)
-        serializer = RatingSerializer(ratings, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        ratings = RatingSerializer.shape_queryset(Rating.objects.filter(book_id=book_id), request.query_params)
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(ratings, request)
+        serializer = RatingSerializer(result_page, many=True, context={'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, book_id):
         user_id = request.data.get('user_id')  # Get user_id from the request
@@ -144,30 +162,49 @@ class RatingList(APIView):
         if rating < 0 or rating > 5:
             return Response({"detail": "Rating must be between 0 and 5."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the user has already rated this book
-        existing_rating = Rating.objects.filter(user_id=user_id, book_id=book_id).first()
-        if existing_rating:
-            existing_rating.rating = rating
-            existing_rating.save()
-        else:
-            # Create a new rating
-            Rating.objects.create(user_id=user_id, book_id=book_id, rating=rating)
+        # Round the way the column stores it, so the running sum matches the rows
+        rating = Decimal(str(rating)).quantize(Decimal('0.1'))
+
+        interaction_writes.run(writes.cast_rating, user.id, book.id, rating)
+
+        average_rating = Book.objects.filter(id=book.id).values_list('rating', flat=True).get()
+        return Response({"detail": "Rating updated successfully.", "average_rating": average_rating}, status=status.HTTP_200_OK)
+
+    def delete(self, request, book_id):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
 
-        # Calculate the new average rating for the book
-        avg_rating = Rating.objects.filter(book_id=book_id).aggregate(Avg('rating'))['rating__avg']
-        book.rating = round(avg_rating, 2)  # Update the book's rating field
-        book.save()
+        if not interaction_writes.run(writes.remove_rating, request.user.id, book_id):
+            return Response({"detail": "You have not rated this book."}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({"detail": "Rating updated successfully.", "average_rating": book.rating}, status=status.HTTP_200_OK)
+        return Response({"detail": "Rating removed."}, status=status.HTTP_204_NO_CONTENT)
 
 
 
 # Comment List View - List all comments on books
 class CommentList(APIView):
+    # ?ordering= value -> keyset ordering of the comment stream
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+        'most_liked': ('-like_count', '-id'),
+    }
+
     def get(self, request, book_id):
-        comments = Comment.objects.filter(book_id=book_id)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        ordering = self.orderings.get(request.query_params.get('ordering', 'newest'))
+        if ordering is None:
+            return Response(
+                {"detail": f"Ordering must be one of: {', '.join(self.orderings)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Like counts are a column of the comment row, so ranking by them
+        # needs no join or aggregate
+        comments = CommentSerializer.shape_queryset(Comment.objects.filter(book_id=book_id), request.query_params)
+        paginator = BookPagination(ordering=ordering)
+        result_page = paginator.paginate_queryset(comments, request)
+        serializer = CommentSerializer(result_page, many=True, context={'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, book_id):
         user_id = request.data.get('user_id')  # Get user_id from the request
@@ -182,8 +219,8 @@ class CommentList(APIView):
         if not content:
             return Response({"detail": "Content cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-        comment = Comment(user_id=user_id, book_id=book_id, content=content)
-        comment.save()
+        with transaction.atomic():
+            comment = writes.add_comment(user.id, book.id, content)
 
         serializer = CommentSerializer(comment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -192,16 +229,20 @@ class CommentList(APIView):
 # Comment Like List View - List all comment likes
 class CommentLikeList(APIView):
     def get(self, request, book_id):
-        comment_likes = CommentLike.objects.filter(book_id=book_id)
-        serializer = CommentLikeSerializer(comment_likes, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """
+        Like state of every comment on the book: its like count and whether
+        the current user liked it, as one row per comment.
+        """
+        if not Book.objects.filter(id=book_id).exists():
+            return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(comment_like_state(book_id, request.user), status=status.HTTP_200_OK)
 
     def post(self, request, book_id):
         user_id = request.data.get('user_id')  # Get user_id from the request
         comment_id = request.data.get('comment_id')  # Get comment_id from the request
 
         user = User.objects.filter(id=user_id).first()  # Retrieve the user object
-        comment = Comment.objects.filter(id=comment_id).first()  # Retrieve the comment object
+        comment = Comment.objects.filter(id=comment_id, book_id=book_id).first()  # Retrieve the comment object
 
         if not user or not comment:
             return Response({"detail": "User or Comment not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -209,8 +250,7 @@ class CommentLikeList(APIView):
         if CommentLike.objects.filter(user_id=user, comment_id=comment_id).exists():
             return Response({"detail": "You have already liked this comment."}, status=status.HTTP_400_BAD_REQUEST)
 
-        comment_like = CommentLike(user_id=user_id, comment_id=comment_id)
-        comment_like.save()
+        comment_like = interaction_writes.run(writes.add_comment_like, user.id, comment.id)
 
         serializer = CommentLikeSerializer(comment_like)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -220,45 +260,51 @@ class CommentLikeList(APIView):
 # View for listing books loved by a user with pagination
 class BooksLovedByUserView(APIView):
     def get(self, request, user_id):
-        loves = Love.objects.filter(user_id=user_id)
-        book_ids = loves.values_list('book_id', flat=True)
-        books = Book.objects.filter(id__in=book_ids)
+        loves = BookSerializer.shape_queryset(
+            Love.objects.filter(user_id=user_id).select_related('book'), request.query_params, prefix='book__'
+        )
         
-        # Apply pagination
-        paginator = BookPagination()
-        result_page = paginator.paginate_queryset(books, request)
+        # Apply pagination, most recently loved first
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(loves, request)
         
-        serializer = BookSerializer(result_page, many=True)
+        books = [love.book for love in result_page]
+        context = {'query_params': request.query_params, **interaction_context(request, books)}
+        serializer = BookSerializer(books, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
 
 # View for listing books bookmarked by a user with pagination
 class BooksBookmarkedByUserView(APIView):
     def get(self, request, user_id):
-        bookmarks = Bookmark.objects.filter(user_id=user_id)
-        book_ids = bookmarks.values_list('book_id', flat=True)
-        books = Book.objects.filter(id__in=book_ids)
+        bookmarks = BookSerializer.shape_queryset(
+            Bookmark.objects.filter(user_id=user_id).select_related('book'), request.query_params, prefix='book__'
+        )
         
-        # Apply pagination
-        paginator = BookPagination()
-        result_page = paginator.paginate_queryset(books, request)
+        # Apply pagination, most recently bookmarked first
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(bookmarks, request)
         
-        serializer = BookSerializer(result_page, many=True)
+        books = [bookmark.book for bookmark in result_page]
+        context = {'query_params': request.query_params, **interaction_context(request, books)}
+        serializer = BookSerializer(books, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
 
 # View for listing books rated by a user with pagination
 class BooksRatedByUserView(APIView):
     def get(self, request, user_id):
-        ratings = Rating.objects.filter(user_id=user_id)
-        book_ids = ratings.values_list('book_id', flat=True)
-        books = Book.objects.filter(id__in=book_ids)
+        ratings = BookSerializer.shape_queryset(
+            Rating.objects.filter(user_id=user_id).select_related('book'), request.query_params, prefix='book__'
+        )
         
-        # Apply pagination
-        paginator = BookPagination()
-        result_page = paginator.paginate_queryset(books, request)
+        # Apply pagination, most recently rated first
+        paginator = BookPagination(ordering=('-created_at', '-id'))
+        result_page = paginator.paginate_queryset(ratings, request)
         
-        serializer = BookSerializer(result_page, many=True)
+        books = [rating.book for rating in result_page]
+        context = {'query_params': request.query_params, **interaction_context(request, books)}
+        serializer = BookSerializer(books, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
 
@@ -267,56 +313,164 @@ class BooksCommentedByUserView(APIView):
     def get(self, request, user_id):
         comments = Comment.objects.filter(user_id=user_id)
         book_ids = comments.values_list('book_id', flat=True)
-        books = Book.objects.filter(id__in=book_ids)
+        books = BookSerializer.shape_queryset(Book.objects.filter(id__in=book_ids), request.query_params)
         
         # Apply pagination
         paginator = BookPagination()
         result_page = paginator.paginate_queryset(books, request)
         
-        serializer = BookSerializer(result_page, many=True)
+        context = {'query_params': request.query_params, **interaction_context(request, result_page)}
+        serializer = BookSerializer(result_page, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
-class BookDetailView(generics.RetrieveAPIView):
-    queryset = Book.objects.all()
-    serializer_class = BookDetailSerializer
-    lookup_field = 'id'
+class BookDetailView(APIView):
+    """
+    Retrieve a book with its chapters, genres and comments. The part that
+    is the same for every reader comes from the per-book cache (see
+    `readers.caching`); only the reader's own love, bookmark and rating are
+    looked up per request. `?fields=` and `?expand=` bypass the cache.
+    """
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
 
-    def get_serializer_context(self):
-        """
-        Override this method to add the `user` to the context of the serializer.
-        """
-        context = super().get_serializer_context()
-        if self.request.user.is_authenticated:
-            context['user'] = self.request.user  # Add the authenticated user to the context
-        return context
-
-    def get(self, request, *args, **kwargs):
+    def get(self, request, id):
         # If user is not authenticated, raise PermissionDenied
         if not request.user.is_authenticated:
             raise PermissionDenied("You must be logged in to view this book detail.")
 
-        return super().get(request, *args, **kwargs)
+        return Response(get_book_detail(id, request, request.user), status=status.HTTP_200_OK)
 
 
 
+class BookDownloadView(APIView):
+    """
+    Download the EPUB of a book, with ETag revalidation and byte ranges
+    (see `readers.downloads`).
+    """
+    def get(self, request, book_id):
+        book = get_object_or_404(Book.objects.only('id', 'title', 'file'), id=book_id)
+        if not book.file:
+            return Response({"detail": "This book has no file to download."}, status=status.HTTP_404_NOT_FOUND)
+        return download_response(request, book.file, f'{book.title}.epub')
+
+
+class BookTOCView(APIView):
+    """
+    Retrieve the table of contents of a book: id, number, title and length
+    of every chapter, without their content.
+    """
+    def get(self, request, book_id):
+        if not Book.objects.filter(id=book_id).exists():
+            return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(get_book_toc(book_id), status=status.HTTP_200_OK)
+
+
+class BookFindView(APIView):
+    """
+    Find text inside one book: the matching chapters, best first, each
+    with a highlighted snippet (HTML-escaped text with the matches in
+    <mark> tags).
+    """
+    def get(self, request, book_id):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"detail": "The 'q' parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        book = Book.objects.only('id', 'forked_from', 'forked_through_chapter').filter(id=book_id).first()
+        if book is None:
+            return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'query': query, 'results': find_in_book(book, query)}, status=status.HTTP_200_OK)
+
+
 class ChapterDetail(APIView):
     """
-    Retrieve a specific chapter's details along with the list of all chapters in the book.
+    Retrieve a specific chapter's details along with pointers to the previous
+    and next chapters. The book's table of contents is included as
+    `all_chapters` unless the client already has it and passes `?toc=false`.
     """
     def get(self, request, book_id, chapter_id):
-        # Fetch the requested chapter
-        chapter = get_object_or_404(Chapter, id=chapter_id, book_id=book_id)
+        # Fetch the requested chapter; a fork may be reading its original's
+        chapter = Chapter.objects.filter(id=chapter_id, book_id=book_id).first()
+        if chapter is None:
+            book = get_object_or_404(Book.objects.only('id', 'forked_from', 'forked_through_chapter'), id=book_id)
+            chapter = find_chapter(book, chapter_id)
+            if chapter is None:
+                raise Http404
         chapter_serializer = ChapterSerializer(chapter)
 
-        # Fetch all chapters in the book
-        all_chapters = Chapter.objects.filter(book_id=book_id).order_by('chapter_number')
-        all_chapters_serializer = ChapterSerializer(all_chapters, many=True)
+        # The table of contents is cached per book and never carries content
+        toc = get_book_toc(book_id)
+        previous_chapter, next_chapter = neighbours(toc, chapter.id)
+
+        data = {
+            "chapter": chapter_serializer.data,
+            "previous": previous_chapter,
+            "next": next_chapter,
+        }
+        if request.query_params.get('toc', 'true').lower() != 'false':
+            data["all_chapters"] = toc
+
+        return Response(data, status=status.HTTP_200_OK)
+
 
+class ReadingProgressView(APIView):
+    """
+    The reader's position in a book. Clients PUT `chapter_id` and `offset`
+    every few seconds while reading; the position is buffered and written
+    in batches (see `readers.progress`), so the answer is 202 and, once the
+    book's TOC is cached, nothing is read from the database.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, book_id):
+        entry = reading_progress.pending(request.user.id, book_id)
+        if entry is not None:
+            chapter_id, offset, updated_at = entry
+        else:
+            with primary_reads():
+                progress = ReadingProgress.objects.filter(user=request.user, book_id=book_id).first()
+            if progress is None:
+                return Response({"detail": "No reading progress for this book."}, status=status.HTTP_404_NOT_FOUND)
+            chapter_id, offset, updated_at = progress.chapter_id, progress.offset, progress.updated_at
         return Response(
-            {
-                "chapter": chapter_serializer.data,
-                "all_chapters": all_chapters_serializer.data,
-            },
+            {"book_id": book_id, "chapter_id": chapter_id, "offset": offset, "updated_at": updated_at},
             status=status.HTTP_200_OK,
         )
+
+    def put(self, request, book_id):
+        try:
+            chapter_id = int(request.data.get('chapter_id'))
+            offset = int(request.data.get('offset', 0))
+        except (TypeError, ValueError):
+            return Response({"detail": "chapter_id and offset must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0:
+            return Response({"detail": "offset cannot be negative."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The cached TOC lists the book's chapters, a fork's shared ones included
+        if not any(entry['id'] == chapter_id for entry in get_book_toc(book_id)):
+            return Response({"detail": "Chapter not found in this book."}, status=status.HTTP_404_NOT_FOUND)
+
+        reading_progress.record(request.user.id, book_id, chapter_id, offset)
+        response = Response({"book_id": book_id, "chapter_id": chapter_id, "offset": offset}, status=status.HTTP_202_ACCEPTED)
+        # Nothing to read back yet; do not send the reader's next pages to the primary
+        response.pin_to_primary = False
+        return response
+
+
+class ContinueReadingView(APIView):
+    """
+    The books the user has been reading, most recent first, with the
+    chapter and offset to resume at. One indexed query per page.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # This process's pending positions first, so the latest one shows
+        reading_progress.flush_user(request.user.id)
+        progress = (
+            ReadingProgress.objects.filter(user=request.user)
+            .select_related('book', 'chapter').only(*ReadingProgressSerializer.load_fields)
+        )
+        paginator = BookPagination(ordering=('-updated_at', '-id'))
+        with primary_reads():
+            result_page = paginator.paginate_queryset(progress, request)
+        serializer = ReadingProgressSerializer(result_page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,77 @@
+"""
+The interaction writes of the reader API, each one a unit that inserts or
+deletes a row and moves the matching counters. They expect to run inside
+a transaction; the views hand them to `interaction_writes` (see
+`readers.coalescing`), which supplies it.
+"""
+from basic.models import Book
+from .counters import apply_rating, bump
+from .models import Bookmark, Comment, CommentLike, Love, Rating
+
+
+def add_love(user_id, book_id):
+    love = Love.objects.create(user_id=user_id, book_id=book_id)
+    bump(Book, book_id, love_count=1)
+    return love
+
+
+def remove_love(user_id, book_id):
+    """Returns whether there was a love to remove."""
+    deleted, _ = Love.objects.filter(user_id=user_id, book_id=book_id).delete()
+    if deleted:
+        bump(Book, book_id, love_count=-1)
+    return bool(deleted)
+
+
+def add_bookmark(user_id, book_id):
+    bookmark = Bookmark.objects.create(user_id=user_id, book_id=book_id)
+    bump(Book, book_id, bookmark_count=1)
+    return bookmark
+
+
+def remove_bookmark(user_id, book_id):
+    """Returns whether there was a bookmark to remove."""
+    deleted, _ = Bookmark.objects.filter(user_id=user_id, book_id=book_id).delete()
+    if deleted:
+        bump(Book, book_id, bookmark_count=-1)
+    return bool(deleted)
+
+
+def cast_rating(user_id, book_id, rating):
+    """
+    Creates or changes a user's vote, moving the book's running aggregates
+    from the previous vote (if any) to this one; no scan over the book's
+    ratings.
+    """
+    existing = Rating.objects.select_for_update().filter(user_id=user_id, book_id=book_id).first()
+    if existing:
+        previous = existing.rating
+        existing.rating = rating
+        existing.save()
+        apply_rating(book_id, old=previous, new=rating)
+        return existing
+    created = Rating.objects.create(user_id=user_id, book_id=book_id, rating=rating)
+    apply_rating(book_id, new=rating)
+    return created
+
+
+def remove_rating(user_id, book_id):
+    """Returns whether there was a vote to remove."""
+    rating = Rating.objects.select_for_update().filter(user_id=user_id, book_id=book_id).first()
+    if not rating:
+        return False
+    rating.delete()
+    apply_rating(book_id, old=rating.rating)
+    return True
+
+
+def add_comment(user_id, book_id, content):
+    comment = Comment.objects.create(user_id=user_id, book_id=book_id, content=content)
+    bump(Book, book_id, comment_count=1)
+    return comment
+
+
+def add_comment_like(user_id, comment_id):
+    comment_like = CommentLike.objects.create(user_id=user_id, comment_id=comment_id)
+    bump(Comment, comment_id, like_count=1)
+    return comment_like
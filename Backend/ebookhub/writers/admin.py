@@ -1,5 +1,11 @@
 from django.contrib import admin
 
+from .models import Job
 
 
-# Register your models here.
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'book', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+admin.site.register(Job, JobAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WritersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'writers'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registers the signal receivers)
@@ -0,0 +1,245 @@
+"""
+Bulk EPUB import for seeding or migrating a catalog (`manage.py
+import_epubs`), without going through UploadEPUBView one book at a time.
+
+Whole books are parsed by a pool of processes (`writers.epub.read_book`)
+while this process writes the finished ones in batches: the authors and
+genres of a batch are resolved in one go, then its books, their genres
+and their chapters are inserted with bulk_create, in one transaction per
+batch.
+
+The books already imported are the checkpoint. Each EPUB is copied to
+the books' storage under a name that starts with a hash of its source
+path, and that name is committed with its book, so running the same
+import again skips everything an interrupted run committed.
+"""
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
+from multiprocessing import get_context
+
+from django.core.files import File
+from django.db import transaction
+
+from basic import search
+from basic.models import Book, Chapter, SupportedFormat
+
+from .epub import read_book
+from .ingest import CHAPTER_BATCH_SIZE, resolve_authors, resolve_genres
+
+IMPORT_PREFIX = 'epub_books/import-'
+KEY_LENGTH = 16
+MANIFEST_FIELDS = ('path', 'title', 'author', 'genres', 'description', 'date_published')
+
+
+def source_key(relative_path):
+    """The stable key of one EPUB of an import, from its path in the source."""
+    normalized = relative_path.replace(os.sep, '/')
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:KEY_LENGTH]
+
+
+def read_sources(source):
+    """
+    Lists the EPUBs to import as dicts with their absolute `path`, `key`
+    and whatever metadata the source gives (see MANIFEST_FIELDS).
+
+    `source` is either a directory, searched recursively for *.epub files,
+    or a manifest: a CSV file with a header row or a JSON Lines file, one
+    EPUB per row, with `path` relative to the manifest. A CSV `genres`
+    cell is comma-separated. Metadata left out comes from the EPUB itself.
+    """
+    if os.path.isdir(source):
+        root = source
+        rows = [
+            {'path': os.path.relpath(os.path.join(directory, name), root)}
+            for directory, _, names in os.walk(source)
+            for name in sorted(names) if name.lower().endswith('.epub')
+        ]
+    else:
+        root = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='', encoding='utf-8') as f:
+            if source.lower().endswith('.csv'):
+                rows = list(csv.DictReader(f))
+                for row in rows:
+                    if isinstance(row.get('genres'), str):
+                        row['genres'] = [genre.strip() for genre in row['genres'].split(',')]
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+
+    sources = {}
+    for row in rows:
+        if not row.get('path'):
+            raise ValueError(f"Manifest row without a path: {row}")
+        entry = {field: row[field] for field in MANIFEST_FIELDS if row.get(field)}
+        entry['key'] = source_key(os.path.normpath(row['path']))
+        entry['path'] = os.path.join(root, row['path'])
+        sources.setdefault(entry['key'], entry)
+    return sorted(sources.values(), key=lambda entry: entry['path'])
+
+
+def imported_keys():
+    """Keys of the EPUBs that earlier imports committed."""
+    names = Book.objects.filter(file__startswith=IMPORT_PREFIX).values_list('file', flat=True)
+    return {name[len(IMPORT_PREFIX):][:KEY_LENGTH] for name in names}
+
+
+def _published(entry, metadata):
+    value = entry.get('date_published') or metadata['date'] or ''
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    if value[:4].isdigit():
+        return date(int(value[:4]), 1, 1)
+    return date.today()
+
+
+def write_batch(parsed, publisher, book_format):
+    """
+    Writes one batch of parsed EPUBs, as (entry, metadata, chapters)
+    triples, in one transaction. Returns (books, chapters) written.
+    """
+    storage = Book._meta.get_field('file').storage
+    saved = []
+    try:
+        with transaction.atomic():
+            author_names = {
+                entry['key']: (entry.get('author') or next(iter(metadata['authors']), ''))[:255]
+                for entry, metadata, _ in parsed
+            }
+            authors = resolve_authors(author_names.values())
+            # Title-cased like resolve_genres does, so 'fantasy' and 'Fantasy' are one
+            genre_names = {
+                entry['key']: list(dict.fromkeys(
+                    name[:100].title() for name in (entry.get('genres') or metadata['subjects']) if name
+                ))
+                for entry, metadata, _ in parsed
+            }
+            genres = {genre.name: genre for genre in resolve_genres(
+                name for names in genre_names.values() for name in names
+            )}
+
+            books = []
+            for entry, metadata, _ in parsed:
+                with open(entry['path'], 'rb') as f:
+                    name = storage.save(f"{IMPORT_PREFIX}{entry['key']}-{os.path.basename(entry['path'])}", File(f))
+                saved.append(name)
+                title = entry.get('title') or metadata['title'] or os.path.splitext(os.path.basename(entry['path']))[0]
+                books.append(Book(
+                    title=title[:200],
+                    author=authors.get(author_names[entry['key']]),
+                    publisher=publisher,
+                    description=entry.get('description') or metadata['description'],
+                    date_published=_published(entry, metadata),
+                    format=book_format,
+                    file=name,
+                ))
+            Book.objects.bulk_create(books)
+
+            Through = Book.genre.through
+            Through.objects.bulk_create([
+                Through(book_id=book.id, genre_id=genres[name].id)
+                for book, (entry, _, _) in zip(books, parsed)
+                for name in genre_names[entry['key']]
+            ])
+
+            chapters = Chapter.objects.bulk_create(
+                [
+                    Chapter(book=book, chapter_title=title[:200], content=content, chapter_number=number)
+                    for book, (_, _, contents) in zip(books, parsed)
+                    for number, (title, content) in enumerate(contents, start=1)
+                ],
+                batch_size=CHAPTER_BATCH_SIZE,
+            )
+
+            # bulk_create skips the signals that maintain the search index
+            search.index_new_books(books)
+            search.index_new_chapters(chapters)
+    except BaseException:
+        for name in saved:
+            storage.delete(name)
+        raise
+    return len(books), len(chapters)
+
+
+class ImportStats:
+    """Counts and rates of one import run."""
+
+    def __init__(self, total, skipped):
+        self.started = time.perf_counter()
+        self.total = total
+        self.skipped = skipped
+        self.books = 0
+        self.chapters = 0
+        self.batches = 0
+        self.failed = []  # (path, error)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'books': self.books,
+            'chapters': self.chapters,
+            'batches': self.batches,
+            'failed': len(self.failed),
+            'skipped': self.skipped,
+            'remaining': self.total - self.books - len(self.failed),
+            'seconds': round(elapsed, 1),
+            'books_per_second': round(self.books / elapsed, 1) if elapsed else None,
+            'chapters_per_second': round(self.chapters / elapsed, 1) if elapsed else None,
+        }
+
+
+def import_epubs(sources, publisher, workers=None, batch_books=100, batch_chapters=5000, on_batch=None):
+    """
+    Imports the EPUBs listed by `read_sources` for `publisher`, skipping
+    the ones already imported. A batch is written once it holds
+    `batch_books` books or `batch_chapters` chapters; `on_batch(stats)` is
+    called after each. EPUBs that fail to parse are counted and left out;
+    a failed write stops the import. Returns the ImportStats.
+    """
+    done = imported_keys()
+    todo = [entry for entry in sources if entry['key'] not in done]
+    stats = ImportStats(total=len(todo), skipped=len(sources) - len(todo))
+    book_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+    workers = workers or os.cpu_count() or 1
+
+    def flush(batch):
+        books, chapters = write_batch(batch, publisher, book_format)
+        stats.books += books
+        stats.chapters += chapters
+        stats.batches += 1
+        if on_batch is not None:
+            on_batch(stats)
+
+    upcoming = iter(todo)
+    batch, batch_size = [], 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        # A few books per worker in flight, so parsed books never pile up
+        running = {}
+        while True:
+            for entry in upcoming:
+                running[pool.submit(read_book, entry['path'])] = entry
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                entry = running.pop(future)
+                try:
+                    metadata, chapters = future.result()
+                except Exception as e:
+                    stats.failed.append((entry['path'], f'{type(e).__name__}: {e}'))
+                    continue
+                batch.append((entry, metadata, chapters))
+                batch_size += len(chapters)
+            if len(batch) >= batch_books or batch_size >= batch_chapters:
+                flush(batch)
+                batch, batch_size = [], 0
+    if batch:
+        flush(batch)
+    return stats
@@ -0,0 +1,78 @@
+"""
+Turning an uploaded EPUB into chapters, plus the batched author/genre
+lookups shared by the upload view and the background worker.
+"""
+from django.db import transaction
+
+from basic.models import Author, Chapter, Genre
+from basic.search import index_book_chapters
+from basic.toc import invalidate_book_toc
+from readers.caching import invalidate_book_detail
+
+from .epub import iter_chapters
+
+CHAPTER_BATCH_SIZE = 500
+
+
+def resolve_genres(names):
+    """
+    Returns Genre rows for the given names (title-cased, de-duplicated),
+    creating the missing ones. Costs one SELECT and at most one INSERT.
+    """
+    names = list(dict.fromkeys(name.title() for name in names if name))
+    genres = {}
+    for genre in Genre.objects.filter(name__in=names).order_by('id'):
+        genres.setdefault(genre.name, genre)
+
+    missing = [Genre(name=name) for name in names if name not in genres]
+    if missing:
+        Genre.objects.bulk_create(missing)
+        # bulk_create does not return primary keys on every backend
+        for genre in Genre.objects.filter(name__in=[genre.name for genre in missing]).order_by('id'):
+            genres.setdefault(genre.name, genre)
+    return [genres[name] for name in names]
+
+
+def resolve_authors(names):
+    """Returns a name -> Author mapping, creating the missing authors in bulk."""
+    names = list(dict.fromkeys(name for name in names if name))
+    authors = {}
+    for author in Author.objects.filter(name__in=names).order_by('id'):
+        authors.setdefault(author.name, author)
+
+    missing = [Author(name=name) for name in names if name not in authors]
+    if missing:
+        Author.objects.bulk_create(missing)
+        for author in Author.objects.filter(name__in=[author.name for author in missing]).order_by('id'):
+            authors.setdefault(author.name, author)
+    return authors
+
+
+def ingest_epub(book):
+    """
+    Replaces the chapters of `book` with the ones found in its EPUB file.
+    Chapters are written with bulk_create in batches as they are parsed,
+    all inside one transaction, so a failed run leaves the book as it was
+    and can simply be retried.
+    """
+    count = 0
+    with transaction.atomic():
+        Chapter.objects.filter(book=book).delete()
+
+        pending = []
+        for number, (title, content) in enumerate(iter_chapters(book.file.path), start=1):
+            pending.append(Chapter(book=book, chapter_title=title, content=content, chapter_number=number))
+            if len(pending) >= CHAPTER_BATCH_SIZE:
+                Chapter.objects.bulk_create(pending)
+                count += len(pending)
+                pending = []
+        if pending:
+            Chapter.objects.bulk_create(pending)
+            count += len(pending)
+
+        # bulk_create skips the signals that maintain the search index
+        index_book_chapters(book.id)
+        invalidate_book_toc(book.id)
+        invalidate_book_detail(book.id)
+
+    return count
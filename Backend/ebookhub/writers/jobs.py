@@ -0,0 +1,78 @@
+"""
+A small persistent job queue backed by the `Job` table. The API enqueues
+work and returns straight away; `manage.py process_jobs` claims queued jobs
+one at a time and runs the handler registered for their kind.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from basic.covers import generate_cover_variants
+from .ingest import ingest_epub
+from .models import Job
+
+
+def run_epub_job(job):
+    return {'chapters': ingest_epub(job.book)}
+
+
+def run_cover_job(job):
+    variants = generate_cover_variants(job.book)
+    return {'sizes': sorted(variants.get('sizes', {}))}
+
+
+HANDLERS = {
+    Job.KIND_EPUB: run_epub_job,
+    Job.KIND_COVER: run_cover_job,
+}
+
+
+def enqueue(kind, book=None, **payload):
+    return Job.objects.create(kind=kind, book=book, payload=payload)
+
+
+def claim_next_job(kinds=None):
+    """
+    Marks the oldest queued job as running and returns it, or None. The
+    conditional UPDATE makes sure two workers never claim the same job.
+    """
+    queued = Job.objects.filter(status=Job.STATUS_QUEUED)
+    if kinds:
+        queued = queued.filter(kind__in=kinds)
+
+    for job_id in queued.order_by('id').values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(id=job_id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.select_related('book').get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """Runs a claimed job and records its outcome."""
+    try:
+        with transaction.atomic():
+            result = HANDLERS[job.kind](job)
+    except Exception as e:
+        job.status = Job.STATUS_FAILED
+        job.error = f"{type(e).__name__}: {e}"
+    else:
+        job.status = Job.STATUS_DONE
+        job.result = result or {}
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(older_than):
+    """Puts back jobs left running by a worker that died, returning how many."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return Job.objects.filter(status=Job.STATUS_RUNNING, started_at__lt=cutoff).update(
+        status=Job.STATUS_QUEUED, started_at=None,
+    )
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from basic.covers import generate_cover_variants, needs_cover_variants
+from basic.models import Book
+from writers.jobs import enqueue
+from writers.models import Job
+
+
+class Command(BaseCommand):
+    help = "Creates the resized variants of covers uploaded before they existed, or that changed since."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200, help="Books loaded per query.")
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that are already current.")
+        parser.add_argument('--enqueue', action='store_true',
+                            help="Queue cover jobs for the `process_jobs` workers instead of resizing here.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the books that need variants.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        pending = done = failed = 0
+
+        while True:
+            books = list(
+                Book.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'cover_image', 'cover_variants')[:chunk_size]
+            )
+            if not books:
+                break
+            last_id = books[-1].id
+
+            for book in books:
+                if not (options['force'] and book.cover_image or needs_cover_variants(book)):
+                    continue
+                pending += 1
+                if options['dry_run']:
+                    continue
+                if options['enqueue']:
+                    enqueue(Job.KIND_COVER, book=book)
+                    continue
+                try:
+                    generate_cover_variants(book)
+                except Exception as e:
+                    # A missing or unreadable original should not stop the backfill
+                    failed += 1
+                    self.stderr.write(f"Book {book.id}: {type(e).__name__}: {e}")
+                else:
+                    done += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Processed up to book {last_id} ({pending} needing variants so far)")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"{pending} book(s) need cover variants."))
+        elif options['enqueue']:
+            self.stdout.write(self.style.SUCCESS(f"Queued {pending} cover job(s)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} book(s), {failed} failed."))
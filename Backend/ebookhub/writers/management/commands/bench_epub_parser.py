@@ -0,0 +1,84 @@
+import glob
+import os
+import time
+import tracemalloc
+import warnings
+
+import ebooklib
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ebooklib import epub
+
+from writers.epub import iter_chapters
+
+
+def legacy_chapters(path):
+    """The ebooklib + BeautifulSoup extraction the upload view used to run."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        epub_book = epub.read_epub(path)
+
+    chapter_order = 1
+    for item in epub_book.get_items():
+        if item.get_type() == ebooklib.ITEM_DOCUMENT:
+            soup = BeautifulSoup(item.content, 'html.parser')
+            chapter_title_tag = soup.find('p', class_='chaptertitle')
+            if chapter_title_tag:
+                chapter_title = chapter_title_tag.get_text(strip=True)
+            else:
+                chapter_title = f"{chapter_order}"
+            yield chapter_title, soup.get_text(separator="\n\n", strip=True)
+            chapter_order += 1
+
+
+class Command(BaseCommand):
+    help = "Compares the streaming EPUB parser with the previous ebooklib/BeautifulSoup one: output, time and memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="EPUB files (defaults to every EPUB under MEDIA_ROOT).")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per parser; the best time is reported.")
+        parser.add_argument('--workers', type=int, default=None, help="Process pool size for the streaming parser.")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or glob.glob(os.path.join(settings.MEDIA_ROOT, '**', '*.epub'), recursive=True)
+        if not paths:
+            raise CommandError("No EPUB files to benchmark.")
+
+        parsers = [
+            ('legacy', legacy_chapters),
+            ('streaming', lambda path: iter_chapters(path, workers=1)),
+            ('parallel', lambda path: iter_chapters(path, workers=options['workers'])),
+        ]
+        mismatches = 0
+        for path in paths:
+            self.stdout.write(f"{os.path.basename(path)} ({os.path.getsize(path) / 1024:.0f} KiB)")
+            outputs = {}
+            for name, parse in parsers:
+                best = None
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    chapters = list(parse(path))
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                # Peak Python heap of the parsing process (pool workers excluded)
+                tracemalloc.start()
+                for _ in parse(path):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                outputs[name] = chapters
+                self.stdout.write(
+                    f"  {name:>10}: {best * 1000:8.1f} ms  peak {peak / 1024:8.0f} KiB  {len(chapters)} chapters"
+                )
+
+            for name in ('streaming', 'parallel'):
+                if outputs[name] != outputs['legacy']:
+                    mismatches += 1
+                    self.stderr.write(f"  {name} output differs from the legacy parser")
+
+        if mismatches:
+            raise CommandError(f"{mismatches} output mismatch(es).")
+        self.stdout.write(self.style.SUCCESS("Outputs are identical."))
@@ -0,0 +1,58 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from writers.bulk_import import import_epubs, read_sources
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a directory or manifest (CSV or JSON Lines) of EPUBs: parses them in a process "
+        "pool and writes books, authors, genres and chapters in batches. Run it again to resume "
+        "an interrupted import; books already imported are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="A directory of .epub files or a manifest (see writers.bulk_import).")
+        parser.add_argument('--publisher', required=True, help="Username of the user the books are published by.")
+        parser.add_argument('--workers', type=int, default=None, help="Parsing processes (defaults to the CPU count).")
+        parser.add_argument('--batch-books', type=int, default=100, help="Books written per transaction at most.")
+        parser.add_argument('--batch-chapters', type=int, default=5000,
+                            help="Chapters after which a batch is written early.")
+        parser.add_argument('--json', action='store_true', help="Print the final counts as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            publisher = User.objects.get(username=options['publisher'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['publisher']!r}.")
+        try:
+            sources = read_sources(options['source'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {options['source']}: {e}")
+
+        def report(stats):
+            row = stats.snapshot()
+            self.stdout.write(
+                f"{row['books']} books, {row['chapters']} chapters in {row['seconds']}s "
+                f"({row['books_per_second']} books/s, {row['chapters_per_second']} chapters/s), "
+                f"{row['remaining']} to go"
+            )
+
+        stats = import_epubs(
+            sources, publisher, workers=options['workers'], batch_books=options['batch_books'],
+            batch_chapters=options['batch_chapters'], on_batch=report,
+        )
+
+        for path, error in stats.failed:
+            self.stderr.write(f"{path}: {error}")
+        row = stats.snapshot()
+        if options['json']:
+            self.stdout.write(json.dumps(row, indent=2))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {row['books']} books and {row['chapters']} chapters in {row['seconds']}s "
+            f"({row['books_per_second']} books/s, {row['chapters_per_second']} chapters/s); "
+            f"{row['skipped']} already imported, {row['failed']} failed."
+        ))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from writers.jobs import claim_next_job, requeue_stale_jobs, run_job
+from writers.models import Job
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (EPUB ingestion, ...). Keep one or more of these running next to the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of polling.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--kind', action='append', choices=[kind for kind, _ in Job.KIND_CHOICES],
+                            help="Only run jobs of this kind (repeatable).")
+        parser.add_argument('--requeue-after', type=int, default=3600,
+                            help="Requeue jobs that have been running for longer than this many seconds.")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options['requeue_after'])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
+
+        while True:
+            job = claim_next_job(options['kind'])
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            start = time.perf_counter()
+            job = run_job(job)
+            elapsed = time.perf_counter() - start
+            if job.status == Job.STATUS_DONE:
+                self.stdout.write(self.style.SUCCESS(f"{job} finished in {elapsed:.2f}s: {job.result}"))
+            else:
+                self.stderr.write(f"{job} failed after {elapsed:.2f}s: {job.error}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('epub', 'EPUB ingestion'), ('cover', 'Cover variants')], max_length=20),
+        ),
+    ]
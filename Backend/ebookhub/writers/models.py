@@ -1,3 +1,42 @@
 from django.db import models
+from basic.models import Book
 
-# Create your models here.
+
+# Job model: Work queued by the API and carried out by the `process_jobs` worker
+class Job(models.Model):
+    KIND_EPUB = 'epub'
+    KIND_COVER = 'cover'
+    KIND_CHOICES = [
+        (KIND_EPUB, 'EPUB ingestion'),
+        (KIND_COVER, 'Cover variants'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)  # Extra input for the job handler
+    result = models.JSONField(default=dict, blank=True)  # Summary written by the handler on success
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),  # The worker polls for the oldest queued job
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} job {self.id} ({self.status})'
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from basic.covers import needs_cover_variants
+from basic.models import Book
+from .jobs import enqueue
+from .models import Job
+
+
+@receiver(post_save, sender=Book)
+def enqueue_cover_variants(sender, instance, update_fields=None, **kwargs):
+    """Queues the resizing of a new or changed cover for the job worker."""
+    if update_fields is not None and 'cover_image' not in update_fields:
+        return
+    if not needs_cover_variants(instance):
+        return
+    if Job.objects.filter(kind=Job.KIND_COVER, book=instance, status=Job.STATUS_QUEUED).exists():
+        return
+    enqueue(Job.KIND_COVER, book=instance)
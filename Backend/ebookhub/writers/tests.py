@@ -1,3 +1,397 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from basic.forks import fork_book, save_chapter
+from basic.models import Author, Book, Chapter, Profile, SupportedFormat
+from basic.search import find_in_book
+from readers.models import Love
+from . import bulk_import, epub
+from .jobs import claim_next_job, enqueue, requeue_stale_jobs
+from .management.commands.bench_epub_parser import legacy_chapters
+from .models import Job
+
+
+def make_book(publisher, **fields):
+    book_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+    return Book.objects.create(
+        title=fields.pop('title', 'A book'), publisher=publisher, date_published=date(2024, 1, 1),
+        format=book_format, **fields,
+    )
+
+
+def make_epub(chapters, title='A book', creators=(), subjects=(), description=None):
+    """An EPUB with one XHTML document per (chapter title or None, [paragraphs]) in `chapters`."""
+    metadata = f'<dc:identifier id="id">test</dc:identifier><dc:title>{title}</dc:title><dc:language>en</dc:language>'
+    metadata += ''.join(f'<dc:creator>{name}</dc:creator>' for name in creators)
+    metadata += ''.join(f'<dc:subject>{name}</dc:subject>' for name in subjects)
+    if description:
+        metadata += f'<dc:description>{description}</dc:description>'
+    items = ''.join(
+        f'<item id="c{i}" href="c{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(len(chapters))
+    )
+    spine = ''.join(f'<itemref idref="c{i}"/>' for i in range(len(chapters)))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('mimetype', 'application/epub+zip')
+        archive.writestr('META-INF/container.xml', (
+            '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            '</rootfiles></container>'
+        ))
+        archive.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0"?><package version="3.0" xmlns="http://www.idpf.org/2007/opf" unique-identifier="id">'
+            f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">{metadata}</metadata>'
+            f'<manifest>{items}</manifest><spine>{spine}</spine></package>'
+        ))
+        for i, (chapter_title, paragraphs) in enumerate(chapters):
+            heading = f'<p class="chaptertitle">{chapter_title}</p>' if chapter_title else ''
+            body = ''.join(f'<p>{paragraph}</p>' for paragraph in paragraphs)
+            archive.writestr(f'OEBPS/c{i}.xhtml', f'<html><body>{heading}{body}</body></html>')
+    return buffer.getvalue()
+
+
+class WriterListTests(TestCase):
+    def setUp(self):
+        self.publisher = User.objects.create_user('publisher')
+        self.book = make_book(self.publisher, can_fork=True)
+        self.chapters = [
+            Chapter.objects.create(book=self.book, chapter_title=f'Chapter {number}', content='Text',
+                                   chapter_number=number)
+            for number in (1, 2, 3)
+        ]
+        self.reader = User.objects.create_user('reader')
+        self.fork = fork_book(self.book, self.reader)
+        Love.objects.create(user=self.reader, book=self.book)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def test_fieldsets(self):
+        urls = [
+            reverse('mybooks', args=[self.publisher.id]),
+            reverse('books-forked-by-user', args=[self.reader.id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                [book] = self.client.get(url, {'fields': 'id,title'}).json()['results']
+                self.assertEqual(set(book), {'id', 'title'})
+
+    def test_reader_flags(self):
+        [book] = self.client.get(reverse('mybooks', args=[self.publisher.id])).json()['results']
+        self.assertEqual((book['is_loved'], book['is_bookmarked'], book['user_rating']), (True, False, None))
+        [fork] = self.client.get(reverse('books-forked-by-user', args=[self.reader.id])).json()['results']
+        self.assertFalse(fork['is_loved'])
+        self.assertNotIn('is_loved', APIClient().get(reverse('mybooks', args=[self.publisher.id])).json()['results'][0])
+
+    def test_profile_chapter_order(self):
+        url = reverse('mybooks', args=[self.publisher.id])
+        titles = lambda response: [chapter['chapter_title'] for chapter in response.json()['results'][0]['chapters']]
+        self.assertEqual(titles(self.client.get(url)), ['Chapter 1', 'Chapter 2', 'Chapter 3'])
+
+        Profile.objects.create(user=self.reader, full_name='Reader', role='reader', reversed_chapter_order=True)
+        self.assertEqual(titles(self.client.get(url)), ['Chapter 3', 'Chapter 2', 'Chapter 1'])
+        # ?reverse=true flips the profile's order back
+        self.assertEqual(titles(self.client.get(url, {'reverse': 'true'})), ['Chapter 1', 'Chapter 2', 'Chapter 3'])
+
+
+class WriterListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.writer = User.objects.create_user('writer')
+        Profile.objects.create(user=cls.writer, full_name='Writer', role='writer', reversed_chapter_order=True)
+        for number in range(110):
+            # Forks of other books with the writer's own books in between
+            book = make_book(author, title=f'Book {number}', can_fork=True)
+            chapters = Chapter.objects.bulk_create([
+                Chapter(book=book, chapter_title=f'Chapter {chapter}', content='Text', chapter_number=chapter)
+                for chapter in range(1, 7)
+            ])
+            fork = fork_book(book, cls.writer)
+            if number % 2 == 0:
+                save_chapter(fork, chapters[0], chapter_title='Own chapter 1')
+            if number % 3 == 0:
+                make_book(cls.writer, title=f'Own book {number}')
+            if number % 5 == 0:
+                Love.objects.create(user=cls.writer, book=fork)
+
+    def assertSameQueries(self, url, queries):
+        client = APIClient()
+        for page_size in (10, 100):
+            # Fresh, as a request would load it: no cached profile
+            client.force_authenticate(User.objects.get(id=self.writer.id))
+            with self.subTest(url=url, page_size=page_size), self.assertNumQueries(queries):
+                page = client.get(url, {'page_size': page_size}).json()
+            self.assertEqual(len(page['results']), page_size)
+        return page['results']
+
+    def test_mybooks(self):
+        # Books, genres, first chapters, the writer's profile, then loves,
+        # bookmarks and ratings
+        books = self.assertSameQueries(reverse('mybooks', args=[self.writer.id]), 7)
+        self.assertTrue(any(book['title'].startswith('Own book') for book in books))
+        fork = books[0]
+        # Newest chapter first, as the profile asks, with the fork's own copy
+        self.assertEqual([chapter['chapter_title'] for chapter in fork['chapters']],
+                         ['Chapter 5', 'Chapter 4', 'Chapter 3', 'Chapter 2', 'Own chapter 1'])
+
+    def test_forked_books(self):
+        books = self.assertSameQueries(reverse('books-forked-by-user', args=[self.writer.id]), 6)
+        self.assertTrue(all(book['title'].endswith('[Forked]') for book in books))
+        self.assertTrue(books[0]['is_loved'])
+
+
+class UploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.publisher = User.objects.create_user('publisher')
+
+    def upload(self, content=b'PK not really an epub'):
+        return APIClient().post(reverse('upload-epub'), {
+            'file': SimpleUploadedFile('book.epub', content),
+            'title': 'Moby Dick', 'author': 'Herman Melville', 'genre': 'Adventure Classic',
+            'description': 'A whale.', 'user_id': self.publisher.id,
+        }, format='multipart')
+
+    def test_upload_queues_a_job(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(id=response.json()['job']['id'])
+        self.assertEqual((job.kind, job.status, job.book.title), (Job.KIND_EPUB, Job.STATUS_QUEUED, 'Moby Dick'))
+        self.assertEqual(sorted(job.book.genre.values_list('name', flat=True)), ['Adventure', 'Classic'])
+
+    def test_failed_enqueue_leaves_no_book(self):
+        with mock.patch('writers.views.enqueue', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                self.upload()
+        self.assertFalse(Book.objects.exists())
+
+    def test_job_status_is_for_the_publisher_only(self):
+        job = Job.objects.get(id=self.upload().json()['job']['id'])
+        url = reverse('job-detail', args=[job.id])
+
+        client = APIClient()
+        self.assertEqual(client.get(url).status_code, 404)
+        client.force_authenticate(User.objects.create_user('someone'))
+        self.assertEqual(client.get(url).status_code, 404)
+        client.force_authenticate(self.publisher)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Job.STATUS_QUEUED)
+
+    def test_worker_ingests_the_upload(self):
+        epub = make_epub([('Loomings', ['Call me Ishmael.', 'Some years ago.']), (None, ['The Carpet-Bag'])])
+        job_id = self.upload(epub).json()['job']['id']
+        call_command('process_jobs', once=True, stdout=io.StringIO())
+
+        job = Job.objects.get(id=job_id)
+        self.assertEqual((job.status, job.result, job.attempts), (Job.STATUS_DONE, {'chapters': 2}, 1))
+        chapters = [(chapter.chapter_title, chapter.content) for chapter in job.book.chapters.order_by('chapter_number')]
+        self.assertEqual(chapters, [
+            ('Loomings', 'Loomings\n\nCall me Ishmael.\n\nSome years ago.'),
+            ('2', 'The Carpet-Bag'),
+        ])
+        # Chapters are written in bulk and indexed afterwards
+        self.assertEqual(len(find_in_book(job.book, 'ishmael')), 1)
+
+    def test_failed_ingest_is_recorded(self):
+        job_id = self.upload().json()['job']['id']
+        call_command('process_jobs', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        job = Job.objects.get(id=job_id)
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('BadZipFile', job.error)
+        self.assertFalse(job.book.chapters.exists())
+
+    def test_claims_and_stale_jobs(self):
+        first, second = enqueue(Job.KIND_EPUB), enqueue(Job.KIND_COVER)
+        self.assertEqual(claim_next_job([Job.KIND_COVER]), second)
+        self.assertEqual(claim_next_job(), first)
+        self.assertIsNone(claim_next_job())
+
+        Job.objects.filter(id=first.id).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(requeue_stale_jobs(older_than=3600), 1)
+        self.assertEqual(claim_next_job(), first)
+
+
+class EpubParserTests(TestCase):
+    chapters = [
+        ('Loomings', ['Call me <em>Ishmael</em>.', 'Caf&eacute; &amp; &#147;quotes&#148;<br/>after a break']),
+        (None, ['<script>var hidden = 1;</script>Visible', '  spaced   out  ', 'Line<br>break</br>']),
+        ('The <b>Carpet</b>-Bag', ['<span>nested <i>inline</i> text</span>']),
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = f'{self.directory}/book.epub'
+        with open(self.path, 'wb') as file:
+            file.write(make_epub(self.chapters))
+
+    def test_same_output_as_the_previous_parser(self):
+        parsed = list(epub.iter_chapters(self.path, workers=1))
+        self.assertEqual(parsed, list(legacy_chapters(self.path)))
+        self.assertEqual([title for title, _ in parsed], ['Loomings', '2', 'TheCarpet-Bag'])
+
+    def test_pool_keeps_the_order(self):
+        with mock.patch.object(epub, 'PARALLEL_MIN_BYTES', 0):
+            self.assertEqual(list(epub.iter_chapters(self.path, workers=2)),
+                             list(epub.iter_chapters(self.path, workers=1)))
+
+    def test_pool_bounds_the_documents_in_flight(self):
+        submitted = []
+
+        class Executor:
+            def __init__(self, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def submit(self, function, args):
+                submitted.append(args[1])
+                future = mock.Mock()
+                future.result.return_value = ('title', args[1])
+                return future
+
+        members = [f'c{number}.xhtml' for number in range(50)]
+        with mock.patch.object(epub, 'ProcessPoolExecutor', Executor):
+            documents = epub._extract_in_pool(self.path, members, workers=2)
+            self.assertEqual(next(documents), ('title', 'c0.xhtml'))
+            self.assertEqual(len(submitted), 2 * epub.IN_FLIGHT_PER_WORKER + 1)
+            self.assertEqual([text for _, text in documents], members[1:])
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.publisher = User.objects.create_user('publisher')
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def write_epub(self, relative_path, content):
+        path = os.path.join(self.source, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def in_threads(self):
+        """Parses in threads instead of spawned processes; the tests only need the scheduling."""
+        return mock.patch.object(
+            bulk_import, 'ProcessPoolExecutor', lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+        )
+
+    def test_directory_import_and_rerun(self):
+        self.write_epub('melville/moby.epub', make_epub(
+            [('Loomings', ['Call me Ishmael.']), ('The Carpet-Bag', ['A bag.'])], title='Moby Dick',
+            creators=['Herman Melville'], subjects=['adventure', 'Adventure', 'Sea'], description='A whale.',
+        ))
+        self.write_epub('austen.epub', make_epub([(None, ['It is a truth.'])], title='Pride', creators=['Jane Austen']))
+
+        out = io.StringIO()
+        call_command('import_epubs', self.source, publisher='publisher', workers=1, batch_books=1, stdout=out)
+        self.assertIn('Imported 2 books and 3 chapters', out.getvalue())
+        self.assertIn('0 already imported, 0 failed.', out.getvalue())
+        # Progress after each batch, with the rates so far
+        self.assertRegex(out.getvalue(), r'\d books, \d chapters in [\d.]+s \([\d.]+ books/s, [\d.]+ chapters/s\), [01] to go')
+
+        book = Book.objects.get(title='Moby Dick')
+        self.assertEqual((book.author.name, book.description, book.publisher), ('Herman Melville', 'A whale.', self.publisher))
+        self.assertEqual(sorted(book.genre.values_list('name', flat=True)), ['Adventure', 'Sea'])
+        self.assertEqual(list(book.chapters.order_by('chapter_number').values_list('chapter_title', flat=True)),
+                         ['Loomings', 'The Carpet-Bag'])
+        self.assertTrue(book.file.name.startswith(bulk_import.IMPORT_PREFIX))
+        self.assertEqual(len(find_in_book(book, 'ishmael')), 1)
+
+        out = io.StringIO()
+        call_command('import_epubs', self.source, publisher='publisher', workers=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['books'], report['skipped'], report['remaining']), (0, 2, 0))
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_interrupted_import_resumes_from_the_committed_books(self):
+        for number in range(4):
+            self.write_epub(f'book{number}.epub', make_epub([('One', [f'Book {number}.'])], title=f'Book {number}'))
+        sources = bulk_import.read_sources(self.source)
+        write_batch, calls = bulk_import.write_batch, []
+
+        def fail_the_second(parsed, *args):
+            calls.append(parsed)
+            if len(calls) == 2:
+                raise OSError('disk full')
+            return write_batch(parsed, *args)
+
+        with self.in_threads(), mock.patch.object(bulk_import, 'write_batch', side_effect=fail_the_second):
+            with self.assertRaises(OSError):
+                bulk_import.import_epubs(sources, self.publisher, workers=1, batch_books=1)
+        # Books finishing together share a batch; the first one is committed
+        committed = len(calls[0])
+        self.assertEqual(Book.objects.count(), committed)
+        self.assertEqual(len(bulk_import.imported_keys()), committed)
+
+        batches = []
+        with self.in_threads():
+            stats = bulk_import.import_epubs(sources, self.publisher, workers=1, batch_books=1, on_batch=batches.append)
+        row = stats.snapshot()
+        self.assertEqual((row['books'], row['chapters'], row['skipped'], row['remaining']),
+                         (4 - committed, 4 - committed, committed, 0))
+        self.assertEqual(len(batches), row['batches'])
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), [f'Book {number}' for number in range(4)])
+
+    def test_manifest_metadata_and_failures(self):
+        self.write_epub('epubs/a.epub', make_epub([('One', ['Text.'])], title='From the EPUB', creators=['Someone']))
+        self.write_epub('epubs/broken.epub', b'not a zip')
+        manifest = os.path.join(self.source, 'manifest.csv')
+        with open(manifest, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'title', 'author', 'genres', 'date_published'])
+            writer.writerow(['epubs/a.epub', 'From the manifest', 'An Author', 'horror, mystery', '1897'])
+            writer.writerow(['epubs/broken.epub', '', '', '', ''])
+
+        with self.in_threads():
+            stats = bulk_import.import_epubs(bulk_import.read_sources(manifest), self.publisher, workers=2)
+        self.assertEqual((stats.books, len(stats.failed)), (1, 1))
+        self.assertTrue(stats.failed[0][0].endswith('broken.epub'))
+        book = Book.objects.get()
+        self.assertEqual((book.title, book.author.name, book.date_published), ('From the manifest', 'An Author', date(1897, 1, 1)))
+        self.assertEqual(sorted(book.genre.values_list('name', flat=True)), ['Horror', 'Mystery'])
+        self.assertFalse(Author.objects.filter(name='Someone').exists())
+
+    def test_unknown_publisher(self):
+        with self.assertRaisesMessage(CommandError, "No user named 'nobody'."):
+            call_command('import_epubs', self.source, publisher='nobody', stdout=io.StringIO())
@@ -1,10 +1,12 @@
 from django.urls import path
-from .views import BooksByAuthorView, BooksForkedByUserView, ForkBookView,UploadEPUBView,MybooksView
+from .views import BooksByAuthorView, BooksForkedByUserView, ForkBookView,UploadEPUBView,MybooksView,JobDetailView,ChapterUpdateView
 
 urlpatterns = [
     path('authors/<int:author_id>/books/', BooksByAuthorView.as_view(), name='books-by-author'),
     path('users/<int:user_id>/forked-books/', BooksForkedByUserView.as_view(), name='books-forked-by-user'),
     path('books/<int:pk>/fork/', ForkBookView.as_view(), name='fork-book'),
+    path('books/<int:book_id>/chapters/<int:chapter_id>/', ChapterUpdateView.as_view(), name='chapter-update'),
     path('upload-epub/', UploadEPUBView.as_view(), name='upload-epub'),
+    path('jobs/<int:pk>/', JobDetailView.as_view(), name='job-detail'),
     path('mybooks/<int:publisher_id>/',MybooksView.as_view(),name='mybooks'),
 ]
\ No newline at end of file
@@ -7,20 +7,33 @@ from rest_framework.parsers import MultiPartParser, FormParser
 # from django.utils.text import slugify
 from basic.models import Book, Chapter, Fork, Author,Genre,SupportedFormat,Profile
 from basic.serializers import BookSerializer, ChapterSerializer
+from basic.pagination import KeysetPagination
 from django.contrib.auth.models import User
+from django.db import transaction
+
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 from datetime import datetime
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
+
+from basic.forks import chapters_of, find_chapter, fork_book, save_chapter
+from readers.interactions import interaction_context
+
+from .ingest import resolve_authors, resolve_genres
+from .jobs import enqueue
+from .models import Job
+from .serializers import JobSerializer
 
 
 class BooksByAuthorView(APIView):
     def get(self, request, author_id):
         # Get books written by the author (books where author is the given user)
-        books = Book.objects.filter(author_id=author_id)
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        books = BookSerializer.shape_queryset(Book.objects.filter(author_id=author_id), request.query_params)
+        paginator = KeysetPagination()
+        result_page = paginator.paginate_queryset(books, request)
+        context = {'query_params': request.query_params, **interaction_context(request, result_page)}
+        serializer = BookSerializer(result_page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
 
 class MybooksView(APIView):
     def get(self, request, publisher_id):
@@ -30,21 +43,31 @@ class MybooksView(APIView):
         
 
         # Filter books by publisher ID
-        books = Book.objects.filter(publisher_id=publisher_id)
+        books = BookSerializer.shape_queryset(Book.objects.filter(publisher_id=publisher_id), request.query_params)
         
-        # Pass the `reverse` parameter to the serializer context
-        serializer = BookSerializer(books, many=True, context={ 'reverse': reverse})
+        paginator = KeysetPagination()
+        result_page = paginator.paginate_queryset(books, request)
+
+        # `reverse` flips the chapter order of the reader's profile, read through the request
+        context = {
+            'request': request, 'query_params': request.query_params, 'reverse': reverse,
+            **interaction_context(request, result_page),
+        }
+        serializer = BookSerializer(result_page, many=True, context=context)
         
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class BooksForkedByUserView(APIView):
     def get(self, request, user_id):
         # Get books that are forked by the user
         forked_books = Fork.objects.filter(forked_by_id=user_id).values('forked_book')
-        books = Book.objects.filter(id__in=forked_books)
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        books = BookSerializer.shape_queryset(Book.objects.filter(id__in=forked_books), request.query_params)
+        paginator = KeysetPagination()
+        result_page = paginator.paginate_queryset(books, request)
+        context = {'query_params': request.query_params, **interaction_context(request, result_page)}
+        serializer = BookSerializer(result_page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class ForkBookView(APIView):
@@ -66,26 +89,8 @@ class ForkBookView(APIView):
         if Fork.objects.filter(forked_book=original_book).exists():
             return Response({"detail": "This book has already been forked and cannot be forked again."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create a new forked book (copy of the original)
-        forked_book = Book.objects.create(
-            title=f"{original_book.title} [Forked]",
-            author=original_book.author,
-            publisher=request.user,  # The user who forks is the publisher
-            genre=original_book.genre,
-            description=original_book.description,
-            cover_image=original_book.cover_image,
-            date_published=datetime.now().strftime("%Y-%m-%d"),  # Set the current date as the publication date
-            can_fork=False,  # Forked books cannot be forked again
-            is_forked=True,
-            ongoing=original_book.ongoing,
-        )
-
-        # Create a Fork entry
-        Fork.objects.create(
-            original_book=original_book,
-            forked_by=request.user,
-            forked_book=forked_book,
-        )
+        # Shares the original's chapters instead of copying them (see basic.forks)
+        forked_book = fork_book(original_book, request.user)
 
         # Serialize the forked book to return it in the response
         serializer = BookSerializer(forked_book)
@@ -120,82 +125,60 @@ class UploadEPUBView(APIView):
         except User.DoesNotExist:
             return Response({"detail": "Invalid user_id."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get or create the author instance
-        author, created = Author.objects.get_or_create(name=book_author_name)
-
-        # Assuming 'Format' model exists and you have a default format entry
-        default_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
-
-        # Process genre list
-        genres = []
-        for genre_name in book_genre_list.split():
-            genre_name = genre_name.title()
-            genre, created = Genre.objects.get_or_create(name=genre_name)
-            genres.append(genre)
-
-        # Create the book instance with the format and cover (if provided)
-        book = Book.objects.create(
-            title=book_title,
-            author=author,
-            publisher=user,
-            description=book_description,
-            file=epub_file,
-            cover_image=cover_file if cover_file else None,  # Assign cover file if provided
-            format=default_format,
-            date_published=datetime.now().strftime("%Y-%m-%d")
-        )
+        # The book, its genres and its job are written together: a failure
+        # leaves no book without chapters nor a job without a book
+        with transaction.atomic():
+            # Get or create the author instance
+            author = resolve_authors([book_author_name])[book_author_name]
+
+            # Assuming 'Format' model exists and you have a default format entry
+            default_format, _ = SupportedFormat.objects.get_or_create(name='EPUB')
+
+            # Process genre list in one lookup instead of one get_or_create per genre
+            genres = resolve_genres(book_genre_list.split())
+
+            # Create the book instance with the format and cover (if provided)
+            book = Book.objects.create(
+                title=book_title,
+                author=author,
+                publisher=user,
+                description=book_description,
+                file=epub_file,
+                cover_image=cover_file if cover_file else None,  # Assign cover file if provided
+                format=default_format,
+                date_published=datetime.now().strftime("%Y-%m-%d")
+            )
+
+            # Associate genres with the book
+            book.genre.set(genres)
+
+            # Chapters are extracted by the `process_jobs` worker, which only
+            # sees the job once the transaction commits
+            job = enqueue(Job.KIND_EPUB, book=book)
 
-        # Associate genres with the book
-        book.genre.set(genres)
+        return Response({
+            "detail": f"Book '{book.title}' uploaded successfully. Its chapters are being processed.",
+            "job": JobSerializer(job).data,
+            "status_url": request.build_absolute_uri(reverse('job-detail', args=[job.id])),
+        }, status=status.HTTP_202_ACCEPTED)
 
-        try:
-            book = self.extract_chapters_from_epub(book)
-        except Exception as e:
-            print("error:===========",e)
-            return Response({"detail": f"Failed to extract chapters: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response({"detail": f"Book '{book.title}' uploaded successfully."}, status=status.HTTP_201_CREATED)
-        
-    def extract_chapters_from_epub(self, book):
-        # Open the EPUB file
-        epub_book = epub.read_epub(book.file.path)
-
-        # Extract the chapters
-        chapter_order = 1
-        for item in epub_book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                # Parse the content of the chapter
-                soup = BeautifulSoup(item.content, 'html.parser')
-
-                # Extract the title of the chapter
-                chapter_title_tag = soup.find('p', class_='chaptertitle')
-
-                # Check if the chapter title element is found
-                if chapter_title_tag:
-                    chapter_title = chapter_title_tag.get_text(strip=True)
-                else:
-                    chapter_title = f"{chapter_order}"
-                
-                # Extract the text content while preserving spaces and newlines
-                chapter_content = soup.get_text(separator="\n\n", strip=True)  # Maintain newline for readability
-
-                # Create and save each chapter
-                Chapter.objects.create(
-                    book=book,
-                    chapter_title=chapter_title,
-                    content=chapter_content,
-                    chapter_number=chapter_order
-                )
-
-                chapter_order += 1
-
-        return book
+class JobDetailView(APIView):
+    def get(self, request, pk):
+        # Only the publisher of the job's book may follow it; anyone else,
+        # anonymous callers included, gets the same 404 as for a missing job
+        try:
+            job = Job.objects.get(pk=pk, book__publisher_id=request.user.id)
+        except Job.DoesNotExist:
+            return Response({"detail": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
 
 
     
 class ChapterListView(APIView):
     def get(self, request, book_id):
-        chapters = Chapter.objects.filter(book_id=book_id)
+        book = get_object_or_404(Book.objects.only('id', 'forked_from', 'forked_through_chapter'), id=book_id)
+        chapters = chapters_of(book)
         # You can limit the number of chapters displayed, e.g., 20 chapters
         chapters = chapters[:20]
         # You should create a ChapterSerializer for this
@@ -223,17 +206,25 @@ class ChapterCreateView(APIView):
 
 
 class ChapterUpdateView(APIView):
+    """
+    Edit a chapter of one of your books. Editing a chapter a fork still
+    shares with its original gives the fork its own copy; the original is
+    left as it is.
+    """
     def put(self, request, book_id, chapter_id):
-        try:
-            chapter = Chapter.objects.get(book_id=book_id, id=chapter_id)
-        except Chapter.DoesNotExist:
+        book = get_object_or_404(Book.objects.only('id', 'publisher', 'forked_from', 'forked_through_chapter'), id=book_id)
+        if book.publisher_id != request.user.id:
+            return Response({"detail": "You can only edit chapters of your own books."}, status=status.HTTP_403_FORBIDDEN)
+        chapter = find_chapter(book, chapter_id)
+        if chapter is None:
             return Response({"detail": "Chapter not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        chapter.title = request.data.get('title', chapter.title)
-        chapter.content = request.data.get('content', chapter.content)
-
-        chapter.save()
-        return Response({"detail": f"Chapter '{chapter.title}' updated successfully."}, status=status.HTTP_200_OK)
+        chapter = save_chapter(
+            book, chapter,
+            chapter_title=request.data.get('title', chapter.chapter_title),
+            content=request.data.get('content', chapter.content),
+        )
+        return Response({"detail": f"Chapter '{chapter.chapter_title}' updated successfully.", "id": chapter.id}, status=status.HTTP_200_OK)
 
 
 class ChapterDeleteView(APIView):
@@ -241,6 +232,7 @@ class ChapterDeleteView(APIView):
         try:
             chapter = Chapter.objects.get(book_id=book_id, id=chapter_id)
         except Chapter.DoesNotExist:
+            # A chapter a fork shares belongs to the original; it is not the fork's to delete
             return Response({"detail": "Chapter not found."}, status=status.HTTP_404_NOT_FOUND)
 
         chapter.delete()
@@ -45,7 +45,7 @@ const AuthorBooks: React.FC = () => {
         const response = await axios.get(
           `${process.env.REACT_APP_API_URL}/writers/mybooks/${publisherId}/`
         );
-        setBooks(response.data);
+        setBooks(response.data.results);
       } catch (err) {
         setError('Failed to fetch books. Please try again.');
       } finally {
@@ -129,7 +129,7 @@ const BookDetails: React.FC = () => {
         const newComment = response;
         newComment.user__username = newComment.user;
         if (newComment && newComment.content) {
-          setComments([...comments, newComment]);
+          setComments([newComment, ...comments]);  // Newest first, like the API
           setComment('');
         } else {
           console.error('Unexpected response format for new comment:', response);